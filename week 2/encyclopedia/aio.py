@@ -0,0 +1,95 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import util
+from .rendering import render_entry
+
+
+def async_settings():
+    return getattr(settings, "WIKI_ASYNC", {})
+
+
+# threads doing blocking storage calls for async views, kept apart from
+# the thread-sensitive executor that sync_to_async uses by default
+io_executor = ThreadPoolExecutor(
+    async_settings().get("IO_THREADS", 32), thread_name_prefix="wiki-io")
+
+# threads rendering Markdown, bounded so rendering cannot starve the
+# I/O threads or run more renders at once than there are cores
+render_executor = ThreadPoolExecutor(
+    async_settings().get("RENDER_THREADS", os.cpu_count()), thread_name_prefix="wiki-render")
+
+
+async def run_in(executor, fn, *args, **kwargs):
+    '''
+    Runs fn in executor without blocking the event loop. The context
+    is copied, so timing stages still count towards the request.
+    '''
+    context = contextvars.copy_context()
+    call = partial(context.run, fn, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(executor, call)
+
+
+async def run_io(fn, *args, **kwargs):
+    return await run_in(io_executor, fn, *args, **kwargs)
+
+
+async def get_entry(title):
+    return await run_io(util.get_entry, title)
+
+
+async def entry_stat(title):
+    return await run_io(util.entry_stat, title)
+
+
+async def render(title, content):
+    '''
+    Returns the HTML for an entry, rendered in the render pool unless
+    the render cache has it.
+    '''
+    return await run_in(render_executor, render_entry, title, content)
+
+
+async def iterate(iterator):
+    '''
+    Yields the items of a blocking iterator, each one produced in the
+    render threads.
+    '''
+    done = object()
+    while (item := await run_in(render_executor, next, iterator, done)) is not done:
+        yield item
+
+
+def condition(etag_func=None, last_modified_func=None):
+    '''
+    django.views.decorators.http.condition for async views. etag_func
+    and last_modified_func stat entries, so they run in the I/O threads.
+    '''
+    def validators(request, *args, **kwargs):
+        etag = etag_func(request, *args, **kwargs) if etag_func else None
+        modified = last_modified_func(request, *args, **kwargs) if last_modified_func else None
+        return (quote_etag(etag) if etag is not None else None,
+                int(modified.timestamp()) if modified else None)
+
+    def decorator(view):
+        @wraps(view)
+        async def inner(request, *args, **kwargs):
+            etag, last_modified = await run_io(validators, request, *args, **kwargs)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            if request.method in ("GET", "HEAD"):
+                if last_modified and not response.has_header("Last-Modified"):
+                    response.headers["Last-Modified"] = http_date(last_modified)
+                if etag:
+                    response.headers.setdefault("ETag", etag)
+            return response
+        return inner
+    return decorator
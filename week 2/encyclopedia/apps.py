@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class EncyclopediaConfig(AppConfig):
     name = 'encyclopedia'
+
+    def ready(self):
+        # connect the entry_saved receivers
+        from . import links, picker, rendering, revisions, search, snapshot, titles
@@ -0,0 +1,135 @@
+import io
+import json
+import os
+import tarfile
+import time
+import zipfile
+
+
+def archive_format(path):
+    '''
+    Tells the format of an archive from its file name:
+    "jsonl", "zip" or "tar" (optionally compressed).
+    '''
+    name = path.lower()
+    if name.endswith(".jsonl"):
+        return "jsonl"
+    if name.endswith(".zip"):
+        return "zip"
+    if name.endswith((".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tar.xz")):
+        return "tar"
+    raise ValueError(f"Unknown archive type: {path}")
+
+
+def valid_title(title):
+    '''
+    Tells whether title can name an entry: not empty, not hidden and
+    without path separators that would put it outside the entries.
+    '''
+    return bool(title) and not title.startswith(".") and "/" not in title and "\\" not in title
+
+
+def title_from_member(name):
+    '''
+    Returns the entry title for an archive member such as
+    "entries/Python.md", or None if it is not a Markdown file. The
+    title may still not be valid_title().
+    '''
+    base = name.rsplit("/", 1)[-1]
+    if not base.endswith(".md"):
+        return None
+    return base[:-3]
+
+
+def read_archive(path, on_skip=None):
+    '''
+    Yields (title, content) pairs from a tar, zip or JSONL archive,
+    reading one entry at a time so the archive is never held in memory.
+    JSONL lines are objects with "title" and "content" keys; lines
+    that are not, and lines or members whose title is not valid_title(),
+    are passed over and described to on_skip if given.
+    '''
+    def skip(where, problem):
+        if on_skip:
+            on_skip(f"{where}: {problem}")
+
+    kind = archive_format(path)
+    if kind == "jsonl":
+        with open(path, encoding="utf-8") as f:
+            for number, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    item = json.loads(line)
+                    title, content = item["title"], item["content"]
+                except (ValueError, KeyError, TypeError):
+                    title = content = None
+                if not isinstance(title, str) or not isinstance(content, str):
+                    problem = "not an object with a title and content"
+                elif not valid_title(title):
+                    problem = f"invalid title {title!r}"
+                else:
+                    yield title, content
+                    continue
+                skip(f"line {number}", problem)
+    elif kind == "zip":
+        with zipfile.ZipFile(path) as archive:
+            for info in archive.infolist():
+                title = title_from_member(info.filename)
+                if title is None or info.is_dir():
+                    continue
+                if not valid_title(title):
+                    skip(info.filename, f"invalid title {title!r}")
+                    continue
+                yield title, archive.read(info).decode("utf-8")
+    else:
+        # "r|*" reads the tar as a stream, whatever its compression
+        with tarfile.open(path, "r|*") as archive:
+            for member in archive:
+                title = title_from_member(member.name)
+                if title is None or not member.isfile():
+                    continue
+                if not valid_title(title):
+                    skip(member.name, f"invalid title {title!r}")
+                    continue
+                yield title, archive.extractfile(member).read().decode("utf-8")
+
+
+class ArchiveWriter:
+    """
+    Writes (title, content) pairs to a tar, zip or JSONL archive one at
+    a time. Tar archives are written as a stream, compressed according
+    to the extension.
+    """
+
+    def __init__(self, path):
+        self.kind = archive_format(path)
+        if self.kind == "jsonl":
+            self._file = open(path, "w", encoding="utf-8")
+        elif self.kind == "zip":
+            self._file = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        else:
+            compression = {".gz": "gz", ".tgz": "gz", ".bz2": "bz2", ".xz": "xz"}.get(
+                os.path.splitext(path)[1], "")
+            self._file = tarfile.open(path, f"w|{compression}")
+
+    def write(self, title, content):
+        if self.kind == "jsonl":
+            self._file.write(json.dumps({"title": title, "content": content}, ensure_ascii=False) + "\n")
+        elif self.kind == "zip":
+            self._file.writestr(f"entries/{title}.md", content)
+        else:
+            data = content.encode("utf-8")
+            info = tarfile.TarInfo(f"entries/{title}.md")
+            info.size = len(data)
+            info.mtime = time.time()
+            self._file.addfile(info, io.BytesIO(data))
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
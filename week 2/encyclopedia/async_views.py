@@ -0,0 +1,132 @@
+from bisect import bisect_left, bisect_right
+
+from django.contrib import messages
+from django.http import StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.loader import render_to_string
+from django.views.decorators.cache import cache_control
+from django.views.decorators.vary import vary_on_headers
+
+from . import aio, util
+from .links import link_graph
+from .picker import random_picker
+from .rendering import gzip_entry, stream_entry
+from .timing import render
+from .views import (
+    MAX_PAGE_SIZE, PAGE_CACHE_CONTROL, PAGE_SIZE, STREAM_CHUNK, STREAM_MARKER, accepts_gzip,
+    article_page_etag, article_page_last_modified, article_parts, gzip_article,
+    index_page, index_page_etag, index_page_last_modified, search_query, search_results,
+)
+
+# Coroutine versions of the read-only views, used under ASGI (see
+# settings.WIKI_ASYNC). Storage calls run in aio's I/O threads and
+# rendering in its render threads, so a slow disk never blocks the
+# event loop or the thread-sensitive executor.
+
+
+@cache_control(**PAGE_CACHE_CONTROL)
+@aio.condition(etag_func=index_page_etag, last_modified_func=index_page_last_modified)
+async def index(request):
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    start = request.GET.get("from")
+
+    # ?stream=1 sends every entry from the cursor on, rendered in chunks
+    if request.GET.get("stream"):
+        return await stream_index(request, after, start)
+
+    try:
+        limit = min(max(int(request.GET.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = PAGE_SIZE
+    context = await aio.run_io(index_page, after, before, start, limit)
+    return render(request, "encyclopedia/index.html", context)
+
+
+async def stream_index(request, after, start):
+    names = await aio.run_io(util.entry_index.names)
+    if after is not None:
+        first = bisect_right(names, after)
+    elif start is not None:
+        first = bisect_left(names, start)
+    else:
+        first = 0
+
+    page = render_to_string("encyclopedia/index.html", {
+        "stream_marker": STREAM_MARKER,
+        "initials": await aio.run_io(util.entry_index.initials),
+    }, request)
+    head, tail = page.split(STREAM_MARKER)
+
+    async def chunks():
+        yield head
+        for i in range(first, len(names), STREAM_CHUNK):
+            yield render_to_string("encyclopedia/index_entries.html", {
+                "entries": names[i:i + STREAM_CHUNK],
+            })
+        yield tail
+
+    return StreamingHttpResponse(chunks())
+
+
+@vary_on_headers("Accept-Encoding")
+@cache_control(**PAGE_CACHE_CONTROL)
+@aio.condition(etag_func=article_page_etag, last_modified_func=article_page_last_modified)
+async def article(request, name):
+    if request.method == 'POST':
+        return redirect('encyclopedia:edit', name = name)
+
+    mapped = await aio.run_io(util.open_large_entry, name)
+    if mapped is not None:
+        random_picker.record_view(name)
+        head, tail = await aio.run_io(article_parts, request, name)
+
+        async def chunks():
+            try:
+                yield head
+                async for piece in aio.iterate(stream_entry(name, mapped)):
+                    yield piece
+                yield tail
+            finally:
+                mapped.close()
+
+        return StreamingHttpResponse(chunks())
+
+    entry = await aio.get_entry(name)
+    if entry:
+        random_picker.record_view(name)
+        if accepts_gzip(request):
+            body = await aio.run_in(aio.render_executor, gzip_entry, name, entry)
+            return await aio.run_io(gzip_article, request, name, body)
+        return render(request, "encyclopedia/article.html", {
+            "title": name,
+            "article": await aio.render(name, entry),
+            "backlinks": await aio.run_io(link_graph.links_to, name),
+        })
+    else:
+        return render(request, "encyclopedia/article.html", {
+            "article": "None"
+        })
+
+
+async def search(request):
+    q = search_query(request)
+    if q:
+        match, results, suggestions = await aio.run_io(search_results, q)
+        if match:
+            return redirect('encyclopedia:article', name=match)
+        return render(request, 'encyclopedia/search.html', {
+            'results': results,
+            'suggestions': suggestions,
+            'search': q
+        })
+    return render(request, 'encyclopedia/search.html')
+
+
+async def random(request):
+    # ?weight=recent or ?weight=views skews the pick, see RandomPicker
+    random_choice = await aio.run_io(random_picker.pick, request.GET.get('weight'))
+    if random_choice is None:
+        messages.error(request, 'ERROR: There are no pages yet.')
+        return redirect('encyclopedia:index')
+    return redirect('encyclopedia:article', name= random_choice)
@@ -0,0 +1,287 @@
+import os
+import re
+import struct
+import threading
+import zlib
+from collections import Counter, namedtuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import zstandard
+except ImportError:  # zstd is optional, zlib is always there
+    zstandard = None
+
+# a compressed entry starts with MAGIC, a format byte ("z" for zlib,
+# "s" for zstd) and the id of the dictionary it was compressed with,
+# 0 for none. Markdown never starts with a NUL byte, so anything else
+# is a plain UTF-8 entry.
+MAGIC = b"\x00wiki"
+HEADER = struct.Struct(">5scI")
+FORMATS = {"zlib": b"z", "zstd": b"s"}
+
+# zlib only looks this far back, so a larger dictionary is wasted
+ZLIB_WINDOW = 32 * 1024
+
+ZSTD_DICTIONARY_SIZE = 112 * 1024
+
+# runs of this many words are the candidates for a zlib dictionary
+SHINGLE_WORDS = 3
+
+TOKEN_RE = re.compile(r"\S+\s*")
+
+# gzip member header: deflate, no flags, no mtime, unknown OS
+GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+# deflate data of a part of a page, with the CRC-32 and length of the
+# text and the matrix moving a CRC-32 past it (see crc32_shift)
+GzipBody = namedtuple("GzipBody", "deflate crc size shift")
+
+
+def compression_settings():
+    return getattr(settings, "WIKI_ENTRY_COMPRESSION", {})
+
+
+def dictionary_id(data):
+    # 0 stands for "no dictionary"
+    return zlib.crc32(data) or 1
+
+
+class Dictionaries:
+    """
+    The shared dictionaries entries are compressed with. The current
+    one is the file settings.WIKI_ENTRY_COMPRESSION["DICTIONARY"];
+    when a new one is trained the old one is kept next to it as
+    "<file>.<id>", so entries compressed with it can still be read.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # id -> dictionary bytes
+        self._loaded = {}
+        # ((path, mtime, size), id, bytes) of the current file as last read
+        self._current = None
+
+    def path(self):
+        return compression_settings().get("DICTIONARY")
+
+    def current(self):
+        '''
+        Returns (id, bytes) of the current dictionary, or (0, None).
+        The file is read again only when its mtime or size changes.
+        '''
+        path = self.path()
+        if not path:
+            return 0, None
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return 0, None
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            current = self._current
+        if current is not None and current[0] == key:
+            return current[1], current[2]
+        with open(path, "rb") as f:
+            data = f.read()
+        ident = dictionary_id(data)
+        with self._lock:
+            self._loaded[ident] = data
+            self._current = (key, ident, data)
+        return ident, data
+
+    def get(self, ident):
+        with self._lock:
+            data = self._loaded.get(ident)
+        if data is not None:
+            return data
+        current, data = self.current()
+        if current != ident:
+            try:
+                with open(f"{self.path()}.{ident:08x}", "rb") as f:
+                    data = f.read()
+            except (FileNotFoundError, TypeError):
+                raise ValueError(f"entry compressed with missing dictionary {ident:08x}")
+            with self._lock:
+                self._loaded[ident] = data
+        return data
+
+    def install(self, data):
+        '''
+        Makes data the current dictionary, archiving the old one.
+        Returns its id.
+        '''
+        path = self.path()
+        if not path:
+            raise ImproperlyConfigured('WIKI_ENTRY_COMPRESSION["DICTIONARY"] is not set')
+        old, _ = self.current()
+        if old:
+            os.replace(path, f"{path}.{old:08x}")
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._loaded.clear()
+            self._current = None
+        return dictionary_id(data)
+
+
+dictionaries = Dictionaries()
+
+
+def require_zstd():
+    if zstandard is None:
+        raise ImproperlyConfigured("the zstd entry format needs the zstandard package")
+
+
+def encode_entry(content):
+    '''
+    Returns the bytes to store for an entry: UTF-8, compressed in
+    settings.WIKI_ENTRY_COMPRESSION["FORMAT"] if one is set and that
+    makes it smaller.
+    '''
+    data = content.encode("utf-8")
+    config = compression_settings()
+    name = config.get("FORMAT")
+    if not name or len(data) < config.get("MIN_BYTES", 64):
+        return data
+    if name not in FORMATS:
+        raise ImproperlyConfigured(f"unknown entry format {name!r}, choose from {', '.join(FORMATS)}")
+    ident, dictionary = dictionaries.current()
+    if name == "zstd":
+        require_zstd()
+        compressor = zstandard.ZstdCompressor(
+            level=config.get("LEVEL", 9),
+            dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None)
+        body = compressor.compress(data)
+    else:
+        if dictionary:
+            compressor = zlib.compressobj(config.get("LEVEL", 9), zdict=dictionary[-ZLIB_WINDOW:])
+        else:
+            compressor = zlib.compressobj(config.get("LEVEL", 9))
+        body = compressor.compress(data) + compressor.flush()
+    packed = HEADER.pack(MAGIC, FORMATS[name], ident) + body
+    return packed if len(packed) < len(data) else data
+
+
+def is_compressed(data):
+    return data[:len(MAGIC)] == MAGIC
+
+
+def decode_entry(data):
+    '''
+    Returns the text of an entry from its stored bytes, whichever
+    format they are in.
+    '''
+    if not is_compressed(data):
+        return bytes(data).decode("utf-8")
+    _, format_byte, ident = HEADER.unpack_from(data)
+    dictionary = dictionaries.get(ident) if ident else None
+    body = memoryview(data)[HEADER.size:]
+    if format_byte == FORMATS["zstd"]:
+        require_zstd()
+        decompressor = zstandard.ZstdDecompressor(
+            dict_data=zstandard.ZstdCompressionDict(dictionary) if dictionary else None)
+        return decompressor.decompress(body).decode("utf-8")
+    if format_byte == FORMATS["zlib"]:
+        if dictionary:
+            decompressor = zlib.decompressobj(zdict=dictionary[-ZLIB_WINDOW:])
+        else:
+            decompressor = zlib.decompressobj()
+        return (decompressor.decompress(body) + decompressor.flush()).decode("utf-8")
+    raise ValueError(f"unknown entry format {format_byte!r}")
+
+
+def train_dictionary(samples, name="zlib", size=None):
+    '''
+    Builds a dictionary for the named format from sample entry texts.
+    '''
+    if name == "zstd":
+        require_zstd()
+        return zstandard.train_dictionary(
+            size or ZSTD_DICTIONARY_SIZE, [sample.encode("utf-8") for sample in samples]).as_bytes()
+    return train_zlib_dictionary(samples, size or ZLIB_WINDOW)
+
+
+def train_zlib_dictionary(samples, size=ZLIB_WINDOW):
+    '''
+    Builds a zlib preset dictionary out of the runs of words found in
+    the most samples, weighted by their length. The most useful runs
+    go last, where zlib reaches them with the shortest distances.
+    '''
+    counts = Counter()
+    for sample in samples:
+        tokens = TOKEN_RE.findall(sample)
+        counts.update({"".join(tokens[i:i + SHINGLE_WORDS])
+                       for i in range(len(tokens) - SHINGLE_WORDS + 1)})
+    chosen = []
+    total = 0
+    repeated = [(shingle, count) for shingle, count in counts.items() if count > 1]
+    for shingle, count in sorted(repeated, key=lambda item: item[1] * len(item[0]), reverse=True):
+        cost = len(shingle.encode("utf-8"))
+        if total + cost > size:
+            continue
+        chosen.append(shingle)
+        total += cost
+    return "".join(reversed(chosen)).encode("utf-8")
+
+
+def crc32_shift(length):
+    '''
+    Returns the 32 columns of the GF(2) matrix that turns the CRC-32 of
+    some data A into its contribution to the CRC-32 of A followed by
+    length more bytes, so that crc32(A + B) is
+    crc32_combine(crc32(A), crc32(B), crc32_shift(len(B))).
+    '''
+    zeros = bytes(min(length, 64 * 1024))
+
+    def advance(crc):
+        left = length
+        while left:
+            crc = zlib.crc32(zeros[:left], crc)
+            left -= min(left, len(zeros))
+        return crc
+
+    base = advance(0)
+    return [advance(1 << bit) ^ base for bit in range(32)]
+
+
+def crc32_combine(crc1, crc2, shift):
+    combined = 0
+    bit = 0
+    while crc1:
+        if crc1 & 1:
+            combined ^= shift[bit]
+        crc1 >>= 1
+        bit += 1
+    return combined ^ crc2
+
+
+def gzip_body(html):
+    '''
+    Compresses the part of a page that is the same for every request
+    into deflate blocks that gzip_page can put between other blocks.
+    '''
+    data = html.encode("utf-8")
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    # a sync flush ends on a byte boundary without marking the last block
+    deflate = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    return GzipBody(deflate, zlib.crc32(data), len(data), crc32_shift(len(data)))
+
+
+def gzip_page(head, body, tail):
+    '''
+    Returns a gzip stream of head, the already compressed GzipBody and
+    tail. Only head and tail are compressed here.
+    '''
+    head = head.encode("utf-8")
+    tail = tail.encode("utf-8")
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    start = compressor.compress(head) + compressor.flush(zlib.Z_SYNC_FLUSH)
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -zlib.MAX_WBITS)
+    end = compressor.compress(tail) + compressor.flush()
+    crc = zlib.crc32(tail, crc32_combine(zlib.crc32(head), body.crc, body.shift))
+    size = (len(head) + body.size + len(tail)) & 0xFFFFFFFF
+    return b"".join([GZIP_HEADER, start, body.deflate, end, struct.pack("<II", crc, size)])
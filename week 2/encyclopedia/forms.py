@@ -1,4 +1,3 @@
-from socket import fromshare
 from django import forms
 
 class AddPage(forms.Form):
@@ -16,4 +15,6 @@ class EditPage(forms.Form):
     text =  forms.CharField(label='Content', widget=forms.Textarea(
         attrs={'class': 'form-control', 'required':'False'}
     ))
+    # version of the entry when the form was loaded
+    version = forms.CharField(widget=forms.HiddenInput, required=False)
     
\ No newline at end of file
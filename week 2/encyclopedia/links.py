@@ -0,0 +1,244 @@
+import json
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from urllib.parse import unquote
+
+import django
+from django.conf import settings
+from django.dispatch import receiver
+
+from . import util
+from .signals import entry_saved
+
+LINK_RE = re.compile(r"""/wiki/([^/\s)>"'#?]+)""")
+
+# what comes right before /wiki/<name> when it is the target of an
+# inline link, an autolink or HTML href, or a reference definition
+LINK_PREFIXES = ("](", "<", 'href="', "href='", "]: ", "]:")
+
+
+def extract_links(content):
+    '''
+    Returns the sorted names of the entries an entry links to.
+    '''
+    names = set()
+    # a plain scan for /wiki/ is much faster than matching the prefixes
+    for match in LINK_RE.finditer(content):
+        start = match.start()
+        if content[max(0, start - 6):start].endswith(LINK_PREFIXES):
+            names.add(unquote(match.group(1)))
+    return sorted(names)
+
+
+def extract_batch(titles):
+    '''
+    Runs in a worker process: reads a batch of entries and returns
+    (title, links) for those that still exist.
+    '''
+    extracted = []
+    for title in titles:
+        content = util.storage.read(title)
+        if content is not None:
+            extracted.append((title, extract_links(content)))
+    return extracted
+
+
+class LinkGraph:
+    """
+    Links between entries, as the sorted targets of every entry
+    (adjacency lists) with the reverse edges kept alongside for
+    "what links here".
+
+    The adjacency lists are saved as JSON to the file named by
+    settings.WIKI_LINK_GRAPH together with the mtime each entry had
+    when its links were extracted, at most once a minute (see
+    util.DeferredSave); on first use the saved graph is loaded and
+    only entries modified since are read again.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._loaded = False
+        self._signature = None
+        # title -> [sorted targets, mtime_ns]
+        self.links = {}
+        # target -> set of titles linking to it
+        self.backlinks = {}
+        self.saver = util.DeferredSave(self.save)
+
+    # ---- building ----
+
+    def set_links(self, title, targets, mtime=0):
+        '''
+        Replaces the outgoing links of an entry, updating the reverse
+        edges of only the targets that were added or removed.
+        '''
+        with self._lock:
+            old = set(self.links.get(title, ((), 0))[0])
+            new = set(targets)
+            for target in old - new:
+                sources = self.backlinks[target]
+                sources.discard(title)
+                if not sources:
+                    del self.backlinks[target]
+            for target in new - old:
+                self.backlinks.setdefault(target, set()).add(title)
+            self.links[title] = [sorted(new), mtime]
+
+    def remove(self, title):
+        with self._lock:
+            self.set_links(title, ())
+            del self.links[title]
+
+    def sync(self):
+        '''
+        Brings the graph in line with the entry storage, reading only
+        the entries that were added or modified since the last sync.
+        Returns True if anything changed.
+        '''
+        with self._lock:
+            changed = False
+            seen = set()
+            for title, mtime in util.storage.iter_stats():
+                seen.add(title)
+                doc = self.links.get(title)
+                if doc is None or doc[1] != mtime:
+                    content = util.storage.read(title)
+                    if content is not None:
+                        self.set_links(title, extract_links(content), mtime)
+                        changed = True
+            for title in set(self.links) - seen:
+                self.remove(title)
+                changed = True
+            self._signature = util.entries_signature()
+            return changed
+
+    def rebuild(self, workers=None, batch_size=500):
+        '''
+        Extracts the links of every entry again, in worker processes.
+        Workers are sent batches of titles and read the entries from
+        util.storage themselves, so only the links come back. Returns
+        the number of entries read.
+        '''
+        stats = dict(util.storage.iter_stats())
+        titles = iter(stats)
+        batches = iter(lambda: list(islice(titles, batch_size)), [])
+        count = 0
+        with self._lock:
+            self.links = {}
+            self.backlinks = {}
+            # the initializer sets Django up in workers started with "spawn"
+            with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+                for extracted in pool.map(extract_batch, batches):
+                    for title, targets in extracted:
+                        self.links[title] = [targets, stats[title]]
+                        for target in targets:
+                            self.backlinks.setdefault(target, set()).add(title)
+                    count += len(extracted)
+            self._signature = util.entries_signature()
+            self._loaded = True
+        return count
+
+    def load(self):
+        with self._lock:
+            if self.path and os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self.links = {}
+                self.backlinks = {}
+                for title, (targets, mtime) in data["links"].items():
+                    self.set_links(title, targets, mtime)
+            self._loaded = True
+            if self.sync():
+                self.saver.request()
+
+    def save(self):
+        '''
+        Writes the adjacency lists to disk, replacing the old file atomically.
+        '''
+        if not self.path:
+            return
+        with self._save_lock:
+            # entries get new lists when their links change, so a shallow
+            # copy is enough to write the file without holding the lock
+            with self._lock:
+                links = dict(self.links)
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"links": links}, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+
+    def ensure_loaded(self):
+        with self._lock:
+            if not self._loaded:
+                self.load()
+
+    def _ensure_fresh(self):
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            elif util.entries_signature() != self._signature:
+                if self.sync():
+                    self.saver.request()
+
+    def update(self, title, content):
+        '''
+        Re-extracts the links of a single entry after it has been saved.
+        '''
+        with self._lock:
+            if not self._loaded:
+                # the next load() picks the new file up through its mtime
+                return
+            st = util.entry_stat(title)
+            self.set_links(title, extract_links(content), st.mtime_ns if st else 0)
+            self._signature = util.entries_signature()
+        self.saver.request()
+
+    # ---- querying ----
+
+    def links_from(self, title):
+        self._ensure_fresh()
+        return list(self.links.get(title, ((), 0))[0])
+
+    def links_to(self, title):
+        '''
+        Returns the sorted names of the other entries linking to title.
+        '''
+        self._ensure_fresh()
+        with self._lock:
+            return sorted(self.backlinks.get(title, set()) - {title})
+
+    def orphans(self):
+        '''
+        Returns the sorted entries no other entry links to.
+        '''
+        self._ensure_fresh()
+        with self._lock:
+            return [title for title in util.entry_index.names()
+                    if not self.backlinks.get(title, set()) - {title}]
+
+    def broken(self):
+        '''
+        Returns sorted (title, target) pairs of links to entries that
+        do not exist.
+        '''
+        self._ensure_fresh()
+        names = set(util.entry_index.names())
+        with self._lock:
+            return sorted((source, target)
+                          for target, sources in self.backlinks.items()
+                          if target not in names
+                          for source in sources)
+
+
+link_graph = LinkGraph(getattr(settings, "WIKI_LINK_GRAPH", None))
+
+
+@receiver(entry_saved)
+def update_link_graph(sender, title, content, **kwargs):
+    link_graph.update(title, content)
@@ -0,0 +1,43 @@
+import json
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia.management.commands.bench_search import make_vocabulary
+from encyclopedia.titles import PrefixIndex
+
+
+class Command(BaseCommand):
+    help = "Measures autocomplete latency over a large set of synthetic titles."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--titles", type=int, default=1000000)
+        parser.add_argument("--queries", type=int, default=20000)
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vocabulary = make_vocabulary(50000, rng)
+        titles = {f"{rng.choice(vocabulary).capitalize()} {rng.choice(vocabulary)} {i}"
+                  for i in range(options["titles"])}
+
+        start = time.perf_counter()
+        index = PrefixIndex()
+        index.build(titles)
+        self.stdout.write(f"sorted {len(titles)} titles in {time.perf_counter() - start:.2f}s")
+
+        # prefixes of real titles, one to eight characters long, as typed
+        sample = rng.sample(sorted(titles), min(len(titles), options["queries"]))
+        queries = [title[:rng.randint(1, 8)] for title in sample]
+        timings = []
+        for q in queries:
+            start = time.perf_counter()
+            json.dumps({"query": q, "results": index.lookup(q, options["limit"])})
+            timings.append(time.perf_counter() - start)
+        timings.sort()
+        mean = sum(timings) / len(timings)
+        p99 = timings[int(len(timings) * 0.99) - 1]
+        self.stdout.write(f"lookup + JSON   mean {mean * 1000:7.3f} ms   "
+                          f"p99 {p99 * 1000:7.3f} ms   max {timings[-1] * 1000:7.3f} ms")
@@ -0,0 +1,76 @@
+import random
+import shutil
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+from encyclopedia.management.commands.bench_render import make_article
+from encyclopedia.management.commands.bench_search import make_vocabulary
+from encyclopedia.management.commands.bench_storage import make_storage
+from encyclopedia.rendering import render_markdown, stream_markdown
+
+
+class Command(BaseCommand):
+    help = ("Compares the Python heap used by concurrent readers of a large entry "
+            "when it is read and rendered whole and when it is memory-mapped and "
+            "rendered as a stream. Mapped pages are shared and not counted.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 30], help="entry sizes in MB")
+        parser.add_argument("--readers", type=int, default=8, help="concurrent readers")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vocabulary = make_vocabulary(5000, rng)
+        root = tempfile.mkdtemp()
+        saved = util.storage
+        try:
+            util.storage = make_storage("flat", root)
+            for megabytes in options["sizes"]:
+                article = make_article(megabytes * 1024 * 1024, rng, vocabulary)
+                title = f"Article {megabytes}"
+                util.storage.write(title, article)
+                # both ways render from the block cache, so only reading differs
+                expected = render_markdown(article)
+                del article
+                self.stdout.write(f"{megabytes} MB entry, {options['readers']} readers")
+
+                def whole():
+                    return len(render_markdown(util.get_entry(title)))
+
+                def streamed():
+                    with util.storage.open_mapped(title) as entry:
+                        return sum(len(piece) for piece in stream_markdown(entry))
+
+                for name, read in (("read whole", whole), ("memory-mapped", streamed)):
+                    peak, elapsed, lengths = self.measure(read, options["readers"])
+                    if set(lengths) != {len(expected)}:
+                        raise CommandError(f"{name} rendered a different article")
+                    self.stdout.write(f"  {name:14} peak heap {peak / 1024 / 1024:8.1f} MB   "
+                                      f"{elapsed:6.2f}s")
+        finally:
+            util.storage = saved
+            shutil.rmtree(root)
+
+    def measure(self, read, readers):
+        '''
+        Runs read in readers threads at once. Returns the peak traced
+        heap in bytes, the time taken and what each call returned.
+        '''
+        lengths = []
+        threads = [threading.Thread(target=lambda: lengths.append(read())) for _ in range(readers)]
+        tracemalloc.start()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return peak, elapsed, lengths
@@ -0,0 +1,86 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia.management.commands.bench_search import make_vocabulary
+from encyclopedia.rendering import block_cache, markdown, render_markdown, split_blocks
+
+
+def make_article(size, rng, vocabulary):
+    '''
+    Returns a synthetic Markdown article of about size characters with
+    headings, paragraphs, lists, code blocks and quotes.
+    '''
+    def sentence():
+        return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(8, 30))).capitalize() + "."
+
+    parts = []
+    length = 0
+    section = 0
+    while length < size:
+        kind = rng.random()
+        if kind < 0.08:
+            section += 1
+            part = f"## Section {section} {rng.choice(vocabulary)}"
+        elif kind < 0.2:
+            part = "\n".join(f"- {sentence()}" for _ in range(rng.randint(2, 6)))
+        elif kind < 0.25:
+            part = "```\n" + "\n".join(rng.choice(vocabulary) * 3 for _ in range(rng.randint(2, 8))) + "\n```"
+        elif kind < 0.28:
+            part = f"> {sentence()}"
+        else:
+            part = " ".join(sentence() for _ in range(rng.randint(2, 8)))
+            part += f" See *{rng.choice(vocabulary)}* and **{rng.choice(vocabulary)}**."
+        parts.append(part)
+        length += len(part) + 2
+    return "\n\n".join(parts) + "\n"
+
+
+def edit_paragraph(article, rng, vocabulary):
+    '''
+    Returns article with a word appended to one randomly chosen paragraph.
+    '''
+    parts = article.split("\n\n")
+    paragraphs = [i for i, part in enumerate(parts) if part[:1].isalpha()]
+    i = rng.choice(paragraphs)
+    parts[i] += f" {rng.choice(vocabulary)}"
+    return "\n\n".join(parts)
+
+
+class Command(BaseCommand):
+    help = "Compares full and incremental Markdown rendering after single-paragraph edits."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1, 2])
+        parser.add_argument("--edits", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        vocabulary = make_vocabulary(5000, rng)
+        for megabytes in options["sizes"]:
+            article = make_article(megabytes * 1024 * 1024, rng, vocabulary)
+            self.stdout.write(f"{megabytes} MB article, {len(split_blocks(article))} blocks")
+            block_cache.clear()
+
+            start = time.perf_counter()
+            render_markdown(article)
+            self.stdout.write(f"  cold incremental render {time.perf_counter() - start:8.3f}s")
+
+            full = incremental = 0
+            for _ in range(options["edits"]):
+                article = edit_paragraph(article, rng, vocabulary)
+                start = time.perf_counter()
+                expected = markdown(article)
+                full += time.perf_counter() - start
+                start = time.perf_counter()
+                html = render_markdown(article)
+                incremental += time.perf_counter() - start
+                if html != expected:
+                    raise CommandError("incremental render differs from the full render")
+
+            edits = options["edits"]
+            self.stdout.write(f"  full render after edit  {full / edits:8.3f}s")
+            self.stdout.write(f"  incremental after edit  {incremental / edits:8.3f}s"
+                              f"   ({full / incremental:.1f}x faster, output identical)")
@@ -0,0 +1,108 @@
+import os
+import random
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia import util
+from encyclopedia.search import SearchIndex
+
+SYLLABLES = "ka lo mi ne ru sa ti vo ze py dj an go wi ki".split() + ["پا", "یت", "ون", "جن"]
+
+
+def make_vocabulary(size, rng):
+    '''
+    Returns size made-up words built from SYLLABLES.
+    '''
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_corpus(count, words_per_entry, seed, vocabulary_size=20000):
+    '''
+    Returns a dict of count synthetic entries, title -> Markdown content,
+    and the vocabulary used. Words are drawn with a Zipf-like
+    distribution so a few are common and most are rare, as in real text.
+    '''
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    corpus = {}
+    for i in range(count):
+        words = rng.choices(vocabulary, weights, k=words_per_entry + 2)
+        title = f"{words[0].capitalize()} {words[1]} {i}"
+        corpus[title] = f"# {title}\n\n{' '.join(words[2:])}\n"
+    return corpus, vocabulary
+
+
+class Command(BaseCommand):
+    help = "Compares the inverted search index with the linear title scan."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=100000)
+        parser.add_argument("--words", type=int, default=60)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        corpus, vocabulary = make_corpus(options["entries"], options["words"], options["seed"])
+        titles = sorted(corpus)
+        rng = random.Random(options["seed"])
+        queries = [rng.choice(vocabulary) for _ in range(options["queries"])]
+
+        start = time.perf_counter()
+        index = SearchIndex()
+        for title, content in corpus.items():
+            index.add_document(title, content)
+        build = time.perf_counter() - start
+        self.stdout.write(f"built index over {len(corpus)} entries in {build:.2f}s")
+
+        def title_scan(q):
+            return [t for t in titles if util.check_sub(t, q) or util.check_sub(q, t)]
+
+        def body_scan(q):
+            return [t for t in titles if util.check_sub(corpus[t], q)]
+
+        def ranked(q):
+            return index.rank(q)
+
+        reads = []
+
+        def read(title):
+            reads.append(title)
+            return corpus.get(title)
+
+        def searched(q):
+            # what the search page gets, with a snippet of every result;
+            # entries whose match is past the excerpt are read, here from
+            # memory rather than storage
+            return index.results(q, read=read)
+
+        for name, fn in (("linear title scan", title_scan),
+                         ("linear body scan", body_scan),
+                         ("inverted index", ranked),
+                         ("index with snippets", searched)):
+            timings = []
+            for q in queries:
+                start = time.perf_counter()
+                fn(q)
+                timings.append(time.perf_counter() - start)
+            timings.sort()
+            mean = sum(timings) / len(timings)
+            p95 = timings[int(len(timings) * 0.95) - 1]
+            self.stdout.write(f"{name:20} mean {mean * 1000:9.3f} ms   p95 {p95 * 1000:9.3f} ms")
+        results = sum(len(index.rank(q)) for q in queries)
+        self.stdout.write(f"snippets needing an entry read: {len(reads)} of {results}")
+
+        # an edit changes one entry, but saving writes the whole index;
+        # util.DeferredSave does it once per WIKI_INDEX_SAVE_DELAY at most
+        with tempfile.TemporaryDirectory() as root:
+            index.path = os.path.join(root, "search_index.json")
+            start = time.perf_counter()
+            index.save()
+            save = time.perf_counter() - start
+            size = os.path.getsize(index.path)
+        self.stdout.write(f"saving the whole index: {save * 1000:.0f} ms, {size / 1e6:.1f} MB")
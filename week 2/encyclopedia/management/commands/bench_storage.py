@@ -0,0 +1,64 @@
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia.storage import (
+    BACKENDS, FlatFileStorage, ShardedFileStorage, SQLiteStorage, write_batch,
+)
+
+
+def make_storage(name, root):
+    '''
+    Returns an empty storage of the named backend in directory root.
+    '''
+    if name == "flat":
+        os.makedirs(os.path.join(root, "entries"))
+        return FlatFileStorage("entries", location=root)
+    if name == "sqlite":
+        return SQLiteStorage(os.path.join(root, "entries.sqlite3"))
+    return ShardedFileStorage(os.path.join(root, "entries"))
+
+
+class Command(BaseCommand):
+    help = "Measures write, listing and lookup speed of the entry storage backends."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+        parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS),
+                            default=["flat", "sharded", "sqlite"])
+        parser.add_argument("--lookups", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        rng = random.Random(0)
+        content = "# Title\n\n" + "Lorem ipsum dolor sit amet. " * 60
+        self.stdout.write(f"{'backend':8} {'entries':>8} {'write/s':>10} {'list ms':>10} {'lookup us':>10}")
+        for size in options["sizes"]:
+            titles = [f"Entry {i}" for i in range(size)]
+            lookups = [rng.choice(titles) for _ in range(options["lookups"])]
+            for name in options["backends"]:
+                root = tempfile.mkdtemp()
+                try:
+                    storage = make_storage(name, root)
+
+                    start = time.perf_counter()
+                    for i in range(0, size, 1000):
+                        write_batch(storage, [(title, content) for title in titles[i:i + 1000]])
+                    writes = size / (time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    storage.list_titles()
+                    listing = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    for title in lookups:
+                        storage.read(title)
+                    lookup = (time.perf_counter() - start) / len(lookups)
+
+                    self.stdout.write(f"{name:8} {size:>8} {writes:>10.0f} "
+                                      f"{listing * 1000:>10.1f} {lookup * 1e6:>10.1f}")
+                finally:
+                    shutil.rmtree(root)
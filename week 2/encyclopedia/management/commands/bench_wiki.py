@@ -0,0 +1,500 @@
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+from django.urls import clear_url_caches
+
+from encyclopedia import links, rendering, revisions, util, views
+from encyclopedia.management.commands.bench_storage import make_storage
+from encyclopedia.rendering import MemoryRenderCache, block_cache, render_markdown
+from encyclopedia.revisions import RevisionStore
+from encyclopedia.search import search_index
+from encyclopedia.storage import BACKENDS, write_batch
+from encyclopedia.titles import prefix_index, title_index
+
+# syllables words are made of, per language of the synthetic corpus
+LANGUAGES = {
+    "en": "ka lo mi ne ru sa ti vo ze py dj an go wi ki th er in on st".split(),
+    "fa": "پا یت ون جن سا می کو ره دا نی شه بر".split(),
+    "de": "schn ä ü ö ber gen lich keit sch un ver".split(),
+    "ru": "ка ло ми не ру са ти во зе ст ов".split(),
+    "zh": list("的一是不了人我在有他这中大来上国个到说们为"),
+}
+
+# share of load test requests going to each view
+LOAD_MIX = {
+    "index": 10, "article": 40, "random": 5, "search": 10, "autocomplete": 10,
+    "newpage": 2, "edit": 3, "save": 2, "history": 3, "revision": 3, "diff": 2,
+    "links": 2, "timings": 1,
+}
+
+# views that have coroutine versions, used to compare WSGI with ASGI
+ASYNC_MIX = {"index": 15, "article": 60, "search": 15, "random": 10}
+
+
+def parse_mix(value):
+    '''
+    Parses "en=3,fa=1" into {"en": 3.0, "fa": 1.0}.
+    '''
+    mix = {}
+    for part in value.split(","):
+        language, _, weight = part.partition("=")
+        if language not in LANGUAGES:
+            raise CommandError(f"unknown language {language!r}, choose from {', '.join(LANGUAGES)}")
+        mix[language] = float(weight or 1)
+    return mix
+
+
+def make_corpus(count, words, mix, rng):
+    '''
+    Returns count synthetic entries, (title, Markdown) pairs in the
+    languages of mix, with headings, lists and links to other entries.
+    Words are drawn with a Zipf-like distribution.
+    '''
+    vocabularies = {}
+    for language in mix:
+        syllables = LANGUAGES[language]
+        vocabulary = sorted({"".join(rng.choice(syllables) for _ in range(rng.randint(2, 4)))
+                             for _ in range(5000)})
+        vocabularies[language] = (vocabulary, [1 / (rank + 1) for rank in range(len(vocabulary))])
+    languages, weights = zip(*mix.items())
+    titles = []
+    for i in range(count):
+        vocabulary, _ = vocabularies[rng.choices(languages, weights)[0]]
+        titles.append(f"{rng.choice(vocabulary).capitalize()} {rng.choice(vocabulary)} {i}")
+    entries = []
+    for title in titles:
+        vocabulary, zipf = vocabularies[rng.choices(languages, weights)[0]]
+        text = rng.choices(vocabulary, zipf, k=words)
+        paragraphs = [" ".join(text[i:i + 60]) + "." for i in range(0, len(text), 60)]
+        linked = rng.sample(titles, min(3, len(titles)))
+        items = "\n".join(f"- [{other}](/wiki/{other.replace(' ', '%20')})" for other in linked)
+        entries.append((title, f"# {title}\n\n" + "\n\n".join(paragraphs) + f"\n\n## See also\n\n{items}\n"))
+    return entries
+
+
+def summarize(timings):
+    '''
+    Returns count, mean and percentiles in ms of a list of durations in seconds.
+    '''
+    timings = sorted(timings)
+    if not timings:
+        return {"count": 0}
+
+    def percentile(p):
+        return round(timings[min(len(timings) - 1, int(len(timings) * p / 100))] * 1000, 4)
+
+    return {
+        "count": len(timings),
+        "mean": round(sum(timings) / len(timings) * 1000, 4),
+        "p50": percentile(50),
+        "p95": percentile(95),
+        "p99": percentile(99),
+        "max": round(timings[-1] * 1000, 4),
+    }
+
+
+class SlowStorage:
+    """
+    Entry storage that waits delay seconds before every read and stat,
+    like a slow network disk would.
+    """
+
+    def __init__(self, storage, delay):
+        self.storage = storage
+        self.delay = delay
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def read(self, title):
+        time.sleep(self.delay)
+        return self.storage.read(title)
+
+    def stat(self, title):
+        time.sleep(self.delay)
+        return self.storage.stat(title)
+
+
+@contextmanager
+def url_mode(use_async):
+    '''
+    Serves the read-only views with their coroutine versions if
+    use_async, or the plain ones otherwise, as asgi.py and wsgi.py do.
+    '''
+    import encyclopedia.urls
+    import wiki.urls
+
+    def reload():
+        importlib.reload(encyclopedia.urls)
+        importlib.reload(wiki.urls)
+        clear_url_caches()
+
+    config = dict(getattr(settings, "WIKI_ASYNC", {}), VIEWS=use_async)
+    try:
+        with override_settings(WIKI_ASYNC=config):
+            reload()
+            yield
+    finally:
+        reload()
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ("Builds a synthetic wiki in a temporary directory, micro-benchmarks "
+            "the storage, search and rendering functions, load-tests every view "
+            "with concurrent test clients and writes the results as JSON. "
+            "With --compare, reports metrics that got slower than a saved run.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--entries", type=int, default=2000)
+        parser.add_argument("--words", type=int, default=300, help="words per entry")
+        parser.add_argument("--languages", default="en=3,fa=1",
+                            help=f"language mix, e.g. en=3,fa=1 ({', '.join(LANGUAGES)})")
+        parser.add_argument("--backend", choices=sorted(BACKENDS), default="flat")
+        parser.add_argument("--iterations", type=int, default=200,
+                            help="calls per micro-benchmark")
+        parser.add_argument("--clients", type=int, default=8, help="concurrent test clients")
+        parser.add_argument("--requests", type=int, default=2000, help="load test requests")
+        parser.add_argument("--concurrency", type=int, default=500,
+                            help="concurrent requests in the ASGI comparison")
+        parser.add_argument("--io-delay", type=float, default=20,
+                            help="ms every entry read and stat takes in the WSGI/ASGI comparison")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="results file, default benchmarks/<commit>.json")
+        parser.add_argument("--compare", help="earlier results file to compare with")
+        parser.add_argument("--threshold", type=float, default=10,
+                            help="percent slower that counts as a regression")
+        parser.add_argument("--strict", action="store_true", help="fail if anything regressed")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        root = tempfile.mkdtemp()
+        try:
+            with self.isolated_wiki(root, options["backend"]):
+                entries = make_corpus(options["entries"], options["words"],
+                                      parse_mix(options["languages"]), rng)
+                start = time.perf_counter()
+                for i in range(0, len(entries), 1000):
+                    write_batch(util.storage, entries[i:i + 1000])
+                util.entry_index.invalidate()
+                self.stdout.write(f"wrote {len(entries)} entries in {time.perf_counter() - start:.1f}s")
+
+                results = {
+                    "commit": git_commit(),
+                    "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                    "python": platform.python_version(),
+                    "django": django.get_version(),
+                    "options": {key: options[key] for key in (
+                        "entries", "words", "languages", "backend", "iterations",
+                        "clients", "requests", "concurrency", "io_delay", "seed")},
+                    "micro": self.micro_benchmarks(entries, options["iterations"], rng),
+                    "load": self.load_test(entries, options["clients"], options["requests"], rng),
+                    "modes": self.compare_modes(entries, options["clients"], options["concurrency"],
+                                                options["requests"], options["io_delay"], rng),
+                }
+        finally:
+            shutil.rmtree(root)
+
+        output = options["output"] or os.path.join(
+            "benchmarks", f"{results['commit'] or time.strftime('%Y%m%d-%H%M%S')}.json")
+        if os.path.dirname(output):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {output}."))
+
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as f:
+                regressions = self.compare(json.load(f), results, options["threshold"])
+            if regressions and options["strict"]:
+                raise CommandError(f"{regressions} metrics regressed by more than {options['threshold']}%")
+
+    @contextmanager
+    def isolated_wiki(self, root, backend):
+        '''
+        Points the app at fresh stores in root for the duration of the
+        benchmark, so the real entries, history and indexes are untouched.
+        '''
+        saved = (util.storage, revisions.revision_store, views.revision_store,
+                 rendering.render_cache, search_index.path, links.link_graph.path)
+        util.storage = make_storage(backend, root)
+        revisions.revision_store = views.revision_store = RevisionStore(
+            os.path.join(root, "revisions.sqlite3"))
+        rendering.render_cache = MemoryRenderCache()
+        search_index.path = links.link_graph.path = None
+        search_index._loaded = links.link_graph._loaded = False
+        util.entry_index.invalidate()
+        try:
+            with override_settings(WIKI_SNAPSHOT_ON_SAVE=False, ALLOWED_HOSTS=["testserver"]):
+                yield
+        finally:
+            (util.storage, revisions.revision_store, views.revision_store,
+             rendering.render_cache, search_index.path, links.link_graph.path) = saved
+            search_index._loaded = links.link_graph._loaded = False
+            util.entry_index.invalidate()
+
+    def timed(self, name, fn, args, results):
+        timings = []
+        for arg in args:
+            start = time.perf_counter()
+            fn(arg)
+            timings.append(time.perf_counter() - start)
+        results[name] = summarize(timings)
+        summary = results[name]
+        self.stdout.write(f"{name:28} mean {summary['mean']:9.3f} ms   p50 {summary['p50']:9.3f} ms   "
+                          f"p99 {summary['p99']:9.3f} ms")
+
+    def micro_benchmarks(self, entries, iterations, rng):
+        titles = [title for title, _ in entries]
+        contents = dict(entries)
+        picks = [rng.choice(titles) for _ in range(iterations)]
+        words = [word for title in picks for word in contents[title].split()[2:4]]
+        results = {}
+
+        def cold_list(_):
+            util.entry_index.invalidate()
+            util.list_entries()
+
+        self.timed("list_entries (cold)", cold_list, range(max(1, iterations // 20)), results)
+        self.timed("list_entries", lambda _: util.list_entries(), range(iterations), results)
+        self.timed("get_entry", util.get_entry, picks, results)
+        self.timed("save_entry", lambda title: util.save_entry(title, contents[title] + "\nEdited.\n"),
+                   picks[:max(1, iterations // 4)], results)
+        search_index.ensure_loaded()
+        self.timed("search (full text)", search_index.search, words[:iterations], results)
+        self.timed("search (title substring)", title_index.find_substring,
+                   [title[:4] for title in picks], results)
+        self.timed("autocomplete", prefix_index.complete, [title[:2] for title in picks], results)
+
+        def cold_render(title):
+            block_cache.clear()
+            render_markdown(contents[title])
+
+        self.timed("render (cold)", cold_render, picks[:max(1, iterations // 4)], results)
+        self.timed("render (block cache)", lambda title: render_markdown(contents[title]),
+                   picks[:max(1, iterations // 4)], results)
+        return results
+
+    def make_request(self, client, view, title, rng):
+        '''
+        Sends one request of the load test mix. Returns the response.
+        '''
+        path = quote(title)
+        if view == "index":
+            return client.get("/")
+        if view == "article":
+            return client.get(f"/wiki/{path}")
+        if view == "random":
+            return client.get("/random")
+        if view == "search":
+            return client.post("/search", {"q": title.split()[0]})
+        if view == "autocomplete":
+            return client.get("/autocomplete", {"q": title[:rng.randint(1, 4)]})
+        if view == "newpage":
+            return client.get("/newpage")
+        if view == "edit":
+            return client.get(f"/wiki/{path}/edit")
+        if view == "save":
+            content = util.get_entry(title) or ""
+            return client.post(f"/wiki/{path}/edit", {"title": title, "text": content + "\nEdited."})
+        if view == "history":
+            return client.get(f"/wiki/{path}/history")
+        if view == "revision":
+            return client.get(f"/wiki/{path}/revision/1")
+        if view == "diff":
+            return client.get(f"/wiki/{path}/diff", {"from": 1, "to": 2})
+        if view == "links":
+            return client.get("/links")
+        return client.get("/timings")
+
+    def load_test(self, entries, clients, requests, rng):
+        titles = [title for title, _ in entries]
+        names, weights = zip(*LOAD_MIX.items())
+        # decided up front so every run sends the same requests
+        plan = [(view, rng.choice(titles)) for view in rng.choices(names, weights, k=requests)]
+        timings = {name: [] for name in names}
+        errors = {name: 0 for name in names}
+        lock = threading.Lock()
+        next_request = iter(plan)
+
+        def work():
+            client = Client()
+            local_rng = random.Random(threading.get_ident())
+            while True:
+                with lock:
+                    item = next(next_request, None)
+                if item is None:
+                    return
+                view, title = item
+                start = time.perf_counter()
+                response = self.make_request(client, view, title, local_rng)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    timings[view].append(elapsed)
+                    if response.status_code >= 500:
+                        errors[view] += 1
+
+        threads = [threading.Thread(target=work) for _ in range(max(1, clients))]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        results = {
+            "throughput": round(requests / elapsed, 1),
+            "latency": summarize([t for view_timings in timings.values() for t in view_timings]),
+            "views": {},
+        }
+        self.stdout.write(f"load test: {requests} requests from {clients} clients, "
+                          f"{results['throughput']} requests/s")
+        for name in names:
+            summary = summarize(timings[name])
+            summary["errors"] = errors[name]
+            results["views"][name] = summary
+            if summary["count"]:
+                self.stdout.write(f"  {name:14} {summary['count']:6} requests   p50 {summary['p50']:8.2f} ms   "
+                                  f"p95 {summary['p95']:8.2f} ms   p99 {summary['p99']:8.2f} ms   "
+                                  f"{errors[name]} errors")
+        return results
+
+    def compare_modes(self, entries, clients, concurrency, requests, io_delay, rng):
+        '''
+        Sends the same reads to the plain views from clients threads, as
+        a threaded WSGI server would, and to the async views from
+        concurrency tasks on one event loop, as an ASGI server would.
+        Every entry read and stat is slowed down by io_delay ms.
+        '''
+        titles = [title for title, _ in entries]
+        names, weights = zip(*ASYNC_MIX.items())
+        plan = [(view, rng.choice(titles)) for view in rng.choices(names, weights, k=requests)]
+        saved = util.storage
+        util.storage = SlowStorage(saved, io_delay / 1000)
+        results = {}
+        try:
+            with url_mode(False):
+                results["wsgi"] = self.run_threads(plan, clients)
+            with url_mode(True):
+                results["asgi"] = asyncio.run(self.run_tasks(plan, concurrency))
+        finally:
+            util.storage = saved
+
+        self.stdout.write(f"WSGI vs ASGI: {requests} reads, {io_delay} ms per disk access")
+        for mode, workers in (("wsgi", f"{clients} threads"), ("asgi", f"{concurrency} tasks")):
+            summary = results[mode]
+            self.stdout.write(f"  {mode} ({workers}): {summary['throughput']} requests/s   "
+                              f"p50 {summary['latency']['p50']:8.2f} ms   "
+                              f"p99 {summary['latency']['p99']:8.2f} ms   {summary['errors']} errors")
+        return results
+
+    def run_threads(self, plan, clients):
+        lock = threading.Lock()
+        pending = iter(plan)
+        timings = []
+        errors = 0
+
+        def work():
+            nonlocal errors
+            client = Client()
+            local_rng = random.Random(threading.get_ident())
+            while True:
+                with lock:
+                    item = next(pending, None)
+                if item is None:
+                    return
+                start = time.perf_counter()
+                response = self.make_request(client, *item, local_rng)
+                elapsed = time.perf_counter() - start
+                with lock:
+                    timings.append(elapsed)
+                    errors += response.status_code >= 500
+
+        threads = [threading.Thread(target=work) for _ in range(max(1, clients))]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {"throughput": round(len(plan) / elapsed, 1), "latency": summarize(timings),
+                "errors": errors}
+
+    async def run_tasks(self, plan, concurrency):
+        pending = iter(plan)
+        timings = []
+        errors = 0
+
+        async def work(seed):
+            nonlocal errors
+            client = AsyncClient()
+            local_rng = random.Random(seed)
+            # a single event loop, so no lock is needed around the shared state
+            for item in pending:
+                start = time.perf_counter()
+                response = await self.make_request(client, *item, local_rng)
+                timings.append(time.perf_counter() - start)
+                errors += response.status_code >= 500
+
+        start = time.perf_counter()
+        await asyncio.gather(*(work(seed) for seed in range(max(1, concurrency))))
+        elapsed = time.perf_counter() - start
+        return {"throughput": round(len(plan) / elapsed, 1), "latency": summarize(timings),
+                "errors": errors}
+
+    def compare(self, old, new, threshold):
+        '''
+        Prints the metrics that changed by more than threshold percent
+        between two result files. Returns the number of regressions.
+        '''
+        pairs = []
+        for name, summary in new["micro"].items():
+            if name in old.get("micro", {}):
+                pairs.append((f"{name} p50", old["micro"][name].get("p50"), summary.get("p50")))
+        for name, summary in new["load"]["views"].items():
+            if name in old.get("load", {}).get("views", {}):
+                pairs.append((f"{name} view p95", old["load"]["views"][name].get("p95"), summary.get("p95")))
+        # throughput is better when higher, compare its inverse
+        pairs.append(("load throughput", 1 / old["load"]["throughput"], 1 / new["load"]["throughput"]))
+        for mode, summary in new.get("modes", {}).items():
+            if mode in old.get("modes", {}):
+                pairs.append((f"{mode} throughput", 1 / old["modes"][mode]["throughput"],
+                               1 / summary["throughput"]))
+
+        self.stdout.write(f"compared with {old.get('commit') or 'earlier run'}:")
+        regressions = 0
+        for name, before, after in pairs:
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            if change > threshold:
+                regressions += 1
+                self.stdout.write(self.style.ERROR(f"  {name:32} {change:+7.1f}% slower"))
+            elif change < -threshold:
+                self.stdout.write(self.style.SUCCESS(f"  {name:32} {-change:7.1f}% faster"))
+        if not regressions:
+            self.stdout.write("  no regressions")
+        return regressions
@@ -0,0 +1,27 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia.snapshot import build_snapshot, snapshot_directory
+
+
+class Command(BaseCommand):
+    help = ("Renders every entry, the index page and a search index JSON to "
+            "static files, e.g. for nginx to serve /wiki/<title> from "
+            "wiki/<title>.html and pass edits and searches on to Django.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--directory", help="default settings.WIKI_SNAPSHOT_DIR")
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        directory = options["directory"] or snapshot_directory()
+        start = time.perf_counter()
+        count = build_snapshot(
+            directory, options["workers"], options["batch_size"],
+            progress=lambda done: self.stdout.write(f"{done} entries rendered"))
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote {count} entries to {directory} in {elapsed:.1f}s."))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from encyclopedia import revisions
+from encyclopedia.revisions import KEYFRAME_INTERVAL
+
+
+class Command(BaseCommand):
+    help = "Rewrites revision chains so every entry has a keyframe every --interval revisions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("titles", nargs="*", help="entries to compact, default all")
+        parser.add_argument("--interval", type=int, default=KEYFRAME_INTERVAL)
+
+    def handle(self, *args, **options):
+        revision_store = revisions.revision_store
+        titles = options["titles"] or revision_store.titles()
+        total = 0
+        for title in titles:
+            rewritten = revision_store.compact(title, options["interval"])
+            if rewritten:
+                self.stdout.write(f"{title}: rewrote {rewritten} revisions")
+            total += rewritten
+        self.stdout.write(self.style.SUCCESS(
+            f"Compacted {len(titles)} entries, {total} revisions rewritten."))
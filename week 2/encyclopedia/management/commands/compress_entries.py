@@ -0,0 +1,68 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+from encyclopedia.compression import compression_settings, dictionaries, train_dictionary
+from encyclopedia.storage import SQLiteStorage, write_batch
+
+
+class Command(BaseCommand):
+    help = ("Rewrites every entry in the format of settings.WIKI_ENTRY_COMPRESSION, "
+            "plain UTF-8 if no FORMAT is set. With --train, first trains a new shared "
+            "dictionary from a sample of the entries.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--train", action="store_true", help="train a new dictionary first")
+        parser.add_argument("--samples", type=int, default=2000, help="entries to train on")
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        storage = util.storage
+        if isinstance(storage, SQLiteStorage):
+            raise CommandError("SQLite entries are kept as text for full-text search")
+        name = compression_settings().get("FORMAT")
+        titles = storage.list_titles()
+
+        if options["train"]:
+            sample = random.Random(options["seed"]).sample(titles, min(options["samples"], len(titles)))
+            texts = [text for text in map(storage.read, sample) if text is not None]
+            start = time.perf_counter()
+            ident = dictionaries.install(train_dictionary(texts, name or "zlib"))
+            self.stdout.write(f"trained dictionary {ident:08x} on {len(texts)} entries "
+                              f"in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        before = after = rewritten = 0
+        edited = 0
+        for i in range(0, len(titles), options["batch_size"]):
+            batch = []
+            # the version is read first, so a save after it shows up as stale
+            versions, sizes, mtimes = {}, {}, {}
+            for title in titles[i:i + options["batch_size"]]:
+                st = storage.stat(title)
+                content = storage.read(title)
+                if st is not None and content is not None:
+                    versions[title], sizes[title], mtimes[title] = st.version, st.size, st.mtime_ns
+                    batch.append((title, content))
+            # entries saved since they were read keep what was saved, the
+            # others keep their mtime, as their text is the same
+            skipped = set(write_batch(storage, batch, versions, mtimes))
+            edited += len(skipped)
+            for title, _ in batch:
+                if title not in skipped:
+                    before += sizes[title]
+                    after += storage.stat(title).size
+                    rewritten += 1
+            self.stdout.write(f"rewrote {rewritten}/{len(titles)}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Rewrote {rewritten} entries as {name or 'plain text'} in "
+            f"{time.perf_counter() - start:.1f}s: {before / 1024 / 1024:.1f} MB -> "
+            f"{after / 1024 / 1024:.1f} MB."))
+        if edited:
+            self.stdout.write(self.style.WARNING(
+                f"Left {edited} entries edited during the run as they were saved; "
+                f"run again to rewrite them."))
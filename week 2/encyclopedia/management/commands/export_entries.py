@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia import util
+from encyclopedia.archives import ArchiveWriter
+
+
+class Command(BaseCommand):
+    help = "Streams every entry into a tar, zip or JSONL archive."
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive")
+        parser.add_argument("--prefix", default="", help="only export titles starting with this")
+
+    def handle(self, *args, **options):
+        titles = util.entries_with_prefix(options["prefix"])
+        exported = 0
+        size = 0
+        start = time.perf_counter()
+        with ArchiveWriter(options["archive"]) as archive:
+            for title in titles:
+                content = util.get_entry(title)
+                if content is None:
+                    # removed since the listing
+                    continue
+                archive.write(title, content)
+                exported += 1
+                size += len(content)
+                if exported % 1000 == 0:
+                    elapsed = time.perf_counter() - start
+                    self.stdout.write(f"{exported}/{len(titles)} entries, "
+                                      f"{exported / elapsed:.0f} entries/s, {size / elapsed / 1e6:.1f} MB/s")
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {exported} entries in {elapsed:.1f}s."))
@@ -0,0 +1,157 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from markdown2 import markdown
+
+from encyclopedia import links, revisions, util
+from encyclopedia.archives import read_archive
+from encyclopedia.links import extract_links
+from encyclopedia.rendering import content_hash, render_cache
+from encyclopedia.search import search_index, term_frequencies
+from encyclopedia.signals import entry_pre_save
+from encyclopedia.snapshot import update_snapshot
+from encyclopedia.storage import write_batch
+
+
+def prepare_entry(item, render):
+    '''
+    Runs in a worker process: tokenizes an entry for the search index,
+    extracts its links and optionally renders it.
+    '''
+    title, content = item
+    freqs, length = term_frequencies(title, content)
+    html = markdown(content) if render else None
+    return title, freqs, length, extract_links(content), html
+
+
+class Command(BaseCommand):
+    help = ("Loads entries from a tar, zip or JSONL archive in batches. "
+            "Progress is saved next to the archive, so an interrupted "
+            "import can be run again and continues where it stopped.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("archive")
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--render", action="store_true",
+                            help="pre-render every entry into the render cache, "
+                                 "which must be one the server shares")
+        parser.add_argument("--checkpoint", type=int, default=20,
+                            help="save the search index and link graph every this many batches")
+        parser.add_argument("--state", help="progress file, default <archive>.progress")
+        parser.add_argument("--restart", action="store_true", help="ignore saved progress")
+
+    def load_state(self, path, archive):
+        if not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            state = json.load(f)
+        st = os.stat(archive)
+        if state.get("size") != st.st_size or state.get("mtime_ns") != st.st_mtime_ns:
+            self.stdout.write("archive changed since the last run, starting over")
+            return 0
+        return state["done"]
+
+    def save_state(self, path, archive, done):
+        st = os.stat(archive)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump({"size": st.st_size, "mtime_ns": st.st_mtime_ns, "done": done}, f)
+        os.replace(tmp, path)
+
+    def handle(self, *args, **options):
+        archive = options["archive"]
+        if options["render"] and not render_cache.shared:
+            # pages rendered into this process's memory are gone when it exits
+            raise CommandError("--render needs a WIKI_RENDER_CACHE the server shares, "
+                               "such as FileRenderCache or a DjangoRenderCache on a shared cache.")
+        state_path = options["state"] or f"{archive}.progress"
+        skip = 0 if options["restart"] else self.load_state(state_path, archive)
+        if skip:
+            self.stdout.write(f"resuming after {skip} entries")
+
+        # the FTS5 backend indexes itself; otherwise keep the saved index current
+        use_search_index = not hasattr(util.storage, "full_text_search")
+        if use_search_index:
+            search_index.ensure_loaded()
+        link_graph = links.link_graph
+        link_graph.ensure_loaded()
+
+        skipped = []
+
+        def report(problem):
+            skipped.append(problem)
+            self.stderr.write(f"skipped {problem}")
+
+        entries = islice(read_archive(archive, on_skip=report), skip, None)
+        workers = max(1, options["workers"] or 1)
+        done = skip
+        imported = 0
+        size = 0
+        batches = 0
+        start = time.perf_counter()
+        # the initializer sets Django up in workers started with "spawn"
+        with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+            while True:
+                batch = list(islice(entries, options["batch_size"]))
+                if not batch:
+                    break
+                # workers tokenize, extract links and render while the batch is written
+                prepared = pool.map(prepare_entry, batch, repeat(options["render"]),
+                                    chunksize=max(1, len(batch) // (workers * 4)))
+                # the batch bypasses util.save_entry, so what its signals
+                # keep up to date is updated here, a batch at a time
+                for title, _ in batch:
+                    entry_pre_save.send(sender=None, title=title)
+                write_batch(util.storage, batch)
+                revisions.revision_store.add_many(batch)
+                self.apply(batch, prepared, use_search_index)
+
+                done += len(batch)
+                imported += len(batch)
+                batches += 1
+                size += sum(len(content) for _, content in batch)
+                if batches % options["checkpoint"] == 0:
+                    if use_search_index:
+                        search_index.save()
+                    link_graph.save()
+                # entries already written are skipped on resume; the search
+                # index catches up with any it missed through their mtime
+                self.save_state(state_path, archive, done)
+
+                elapsed = time.perf_counter() - start
+                self.stdout.write(f"{done} entries, {imported / elapsed:.0f} entries/s, "
+                                  f"{size / elapsed / 1e6:.1f} MB/s")
+
+        if use_search_index:
+            search_index.save()
+        link_graph.save()
+        util.entry_index.invalidate()
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {imported} entries in {elapsed:.1f}s "
+            f"({imported / max(elapsed, 1e-9):.0f} entries/s)."))
+        if skipped:
+            self.stdout.write(self.style.WARNING(f"Skipped {len(skipped)} invalid entries."))
+
+    def apply(self, batch, prepared, use_search_index):
+        '''
+        Feeds a written batch into the search index, link graph, render
+        cache and snapshot.
+        '''
+        for (title, content), (_, freqs, length, targets, html) in zip(batch, prepared):
+            st = util.entry_stat(title)
+            mtime = st.mtime_ns if st else 0
+            if use_search_index:
+                search_index.add_terms(title, freqs, length, mtime, content)
+            links.link_graph.set_links(title, targets, mtime)
+            if html is not None:
+                render_cache.set(title, content_hash(content), html)
+            update_snapshot(sender=None, title=title, content=content)
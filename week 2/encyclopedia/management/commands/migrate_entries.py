@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from encyclopedia import util
+from encyclopedia.storage import BACKENDS, open_storage, write_batch
+
+
+class Command(BaseCommand):
+    help = "Copies every entry into another storage backend."
+
+    def add_arguments(self, parser):
+        parser.add_argument("target", choices=sorted(BACKENDS))
+        parser.add_argument("location", help="directory or database file of the target")
+        parser.add_argument("--source", choices=sorted(BACKENDS),
+                            help="defaults to settings.WIKI_ENTRY_STORAGE")
+        parser.add_argument("--source-location")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options["source"]:
+            if not options["source_location"]:
+                raise CommandError("--source needs --source-location")
+            source = open_storage(options["source"], options["source_location"])
+        else:
+            source = util.storage
+        target = open_storage(options["target"], options["location"])
+
+        start = time.perf_counter()
+        titles = source.list_titles()
+        copied = 0
+        for i in range(0, len(titles), options["batch_size"]):
+            batch = []
+            for title in titles[i:i + options["batch_size"]]:
+                content = source.read(title)
+                if content is not None:
+                    batch.append((title, content))
+            write_batch(target, batch)
+            copied += len(batch)
+            self.stdout.write(f"copied {copied}/{len(titles)}")
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {copied} entries to {options['target']} storage at "
+            f"{options['location']} in {elapsed:.1f}s. Point WIKI_ENTRY_STORAGE at it to switch."))
@@ -0,0 +1,23 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand
+
+from encyclopedia.links import link_graph
+
+
+class Command(BaseCommand):
+    help = "Extracts the links of every entry again and saves the link graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count())
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        count = link_graph.rebuild(max(1, options["workers"] or 1), options["batch_size"])
+        link_graph.save()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Read the links of {count} entries in {elapsed:.1f}s: "
+            f"{len(link_graph.orphans())} orphans, {len(link_graph.broken())} broken links."))
@@ -0,0 +1,162 @@
+import random
+import threading
+import time
+
+from django.dispatch import receiver
+
+from . import util
+from .signals import entry_saved
+
+# how long a weighted alias table is reused before it is rebuilt
+ALIAS_TTL = 60
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def build_alias_table(weights):
+    '''
+    Builds Vose's alias table for the given positive weights.
+    Returns (probabilities, aliases), see alias_pick.
+    '''
+    count = len(weights)
+    total = sum(weights)
+    scaled = [w * count / total for w in weights]
+    probabilities = [0.0] * count
+    aliases = [0] * count
+    small = [i for i, p in enumerate(scaled) if p < 1]
+    large = [i for i, p in enumerate(scaled) if p >= 1]
+    while small and large:
+        less, more = small.pop(), large.pop()
+        probabilities[less] = scaled[less]
+        aliases[less] = more
+        scaled[more] = scaled[more] + scaled[less] - 1
+        (small if scaled[more] < 1 else large).append(more)
+    for i in small + large:
+        probabilities[i] = 1.0
+    return probabilities, aliases
+
+
+def alias_pick(table, rng=random):
+    '''
+    Picks an index from an alias table in constant time.
+    '''
+    probabilities, aliases = table
+    i = rng.randrange(len(probabilities))
+    return i if rng.random() < probabilities[i] else aliases[i]
+
+
+class RandomPicker:
+    """
+    Picks random entries in constant time.
+
+    Keeps the entry names in an array with a name -> position map, so
+    new entries are appended and removed ones are swapped with the last
+    element and popped. Weighted picks use an alias table over the same
+    array, rebuilt at most every ALIAS_TTL seconds or after the array
+    changes. Modification times for "recent" are read from the storage
+    once and then kept up to date by saves.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._built = False
+        self.names = []
+        self.positions = {}
+        self.views = {}
+        # title -> mtime_ns, complete once _scanned
+        self.mtimes = {}
+        self._scanned = False
+        # mode -> (built at, alias table)
+        self._tables = {}
+
+    def _add(self, title):
+        if title not in self.positions:
+            self.positions[title] = len(self.names)
+            self.names.append(title)
+            self._tables.clear()
+
+    def _remove(self, title):
+        position = self.positions.pop(title, None)
+        if position is None:
+            return
+        last = self.names.pop()
+        if last != title:
+            self.names[position] = last
+            self.positions[last] = position
+        self.mtimes.pop(title, None)
+        self._tables.clear()
+
+    def _refresh(self):
+        signature = util.entries_signature()
+        if self._built and signature is not None and signature == self._signature:
+            return
+        with self._lock:
+            names = set(util.entry_index.names())
+            for title in set(self.positions) - names:
+                self._remove(title)
+            for title in names - set(self.positions):
+                self._add(title)
+            # entries changed outside the process, so read their mtimes
+            # again; without a signature that would be on every pick
+            if signature is not None:
+                self._scanned = False
+            self._signature = signature
+            self._built = True
+
+    def saved(self, title):
+        with self._lock:
+            self.mtimes[title] = time.time_ns()
+            if self._built:
+                self._add(title)
+                self._signature = util.entries_signature()
+
+    def record_view(self, title):
+        self.views[title] = self.views.get(title, 0) + 1
+
+    def _weights(self, mode):
+        if mode == "views":
+            return [1 + self.views.get(title, 0) for title in self.names]
+        # "recent": newer entries are picked more often
+        now = time.time_ns()
+        return [1 / (1 + (now - self.mtimes.get(title, 0)) / 1e9 / SECONDS_PER_DAY)
+                for title in self.names]
+
+    def _scan_mtimes(self):
+        # reads the storage without holding the lock; saves made during
+        # the scan are newer than what it finds, so they are kept
+        scanned = list(util.storage.iter_stats())
+        with self._lock:
+            for title, mtime in scanned:
+                if mtime > self.mtimes.get(title, 0):
+                    self.mtimes[title] = mtime
+            self._scanned = True
+            self._tables.pop("recent", None)
+
+    def pick(self, mode=None):
+        '''
+        Returns a random entry name, or None if there are none. mode
+        "recent" favours recently saved entries and "views" often
+        viewed ones; anything else picks uniformly.
+        '''
+        self._refresh()
+        if mode == "recent" and not self._scanned:
+            self._scan_mtimes()
+        with self._lock:
+            if not self.names:
+                return None
+            if mode not in ("recent", "views"):
+                return self.names[random.randrange(len(self.names))]
+            built_at, table = self._tables.get(mode, (0, None))
+            if table is None or time.monotonic() - built_at > ALIAS_TTL:
+                table = build_alias_table(self._weights(mode))
+                self._tables[mode] = (time.monotonic(), table)
+            return self.names[alias_pick(table)]
+
+
+random_picker = RandomPicker()
+
+
+@receiver(entry_saved)
+def update_random_picker(sender, title, content, **kwargs):
+    random_picker.saved(title)
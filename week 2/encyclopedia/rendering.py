@@ -0,0 +1,391 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from itertools import chain
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.storage import default_storage
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+from markdown2 import Markdown
+
+from .compression import gzip_body
+from .signals import entry_saved
+from .timing import stage
+
+
+def content_hash(content):
+    return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+
+BLANK_LINE = re.compile(r"[ \t]*$")
+# a line after a blank line that still belongs to the block before it:
+# indented code or list continuation, a list item, or a blockquote
+CONTINUES_BLOCK = re.compile(r"[ \t]|[*+-][ \t]|\d+[.)][ \t]|>")
+QUOTE_LINE = re.compile(r"[ \t]*>")
+FENCE_LINE = re.compile(r" {0,3}(```|~~~)")
+# constructs that tie blocks together (reference links, footnotes,
+# HTML blocks, nested quotes, indented list markers, list items going on
+# after a blank line) or that markdown2 normalises across the whole text
+NEEDS_FULL_RENDER = re.compile(
+    r"^ {0,3}\[[^\]]+\]:|\[\^|^ {0,3}<|^[ \t]*>[ \t]*>|^(?: {4}| {0,3}\t)[ \t]*>|\r"
+    r"|^[ \t]+(?:[*+-]|\d+[.)])[ \t]"
+    r"|^(?:[*+-]|\d+[.)])[ \t][^\n]*(?:\n[ \t]*\S[^\n]*)*\n(?:[ \t]*\n)+[ \t]+\S", re.M)
+
+
+# the same, for searching the raw bytes of a MappedEntry
+NEEDS_FULL_RENDER_BYTES = re.compile(NEEDS_FULL_RENDER.pattern.encode(), re.M)
+
+# characters per piece when a cached article is streamed
+STREAM_CHUNK_CHARS = 64 * 1024
+
+
+def split_blocks(content):
+    '''
+    Splits Markdown into top-level blocks that markdown2 renders the
+    same way alone as within the whole text, so that joining the
+    rendered blocks with "\n" gives exactly the full render. Returns
+    None when the text has to be rendered in one piece.
+    '''
+    if NEEDS_FULL_RENDER.search(content):
+        return None
+    return list(iter_blocks(content.split("\n"))) or None
+
+
+def iter_blocks(lines):
+    '''
+    Yields the blocks of split_blocks from an iterable of lines, keeping
+    only the current block in memory. The caller checks the text against
+    NEEDS_FULL_RENDER first.
+    '''
+    current = []
+    blank = False
+    fenced = False
+    in_quote = False
+    # markdown2 lets a blockquote with lazy or indented continuation
+    # lines swallow the blocks after it, so such a block is not split
+    lazy_quote = False
+    for line in lines:
+        if BLANK_LINE.match(line):
+            if current:
+                blank = True
+                current.append(line)
+            continue
+        if blank and not fenced and not lazy_quote and not CONTINUES_BLOCK.match(line):
+            while BLANK_LINE.match(current[-1]):
+                current.pop()
+            yield "\n".join(current)
+            current = []
+            in_quote = lazy_quote = False
+        if QUOTE_LINE.match(line):
+            in_quote = True
+        elif blank and not line[0].isspace():
+            in_quote = False
+        elif in_quote:
+            lazy_quote = True
+        blank = False
+        if FENCE_LINE.match(line):
+            fenced = not fenced
+        current.append(line)
+    if current:
+        yield "\n".join(current)
+
+
+_markdown = threading.local()
+
+
+def markdown(content):
+    '''
+    Renders Markdown with a Markdown instance kept per thread.
+    '''
+    converter = getattr(_markdown, "converter", None)
+    if converter is None:
+        converter = _markdown.converter = Markdown()
+    return converter.convert(content)
+
+
+class MemoryRenderCache:
+    """
+    In-process LRU cache of rendered articles, bounded by the total
+    size of the cached HTML in bytes.
+    """
+
+    # other processes see what is cached, see DjangoRenderCache.shared
+    shared = False
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, title):
+        with self._lock:
+            item = self._items.get(title)
+            if item is not None:
+                self._items.move_to_end(title)
+            return item
+
+    def set(self, title, digest, html, cost=None):
+        if cost is None:
+            cost = len(html.encode("utf-8"))
+        with self._lock:
+            self._discard(title)
+            if cost > self.max_bytes:
+                return
+            self._items[title] = (digest, html, cost)
+            self.size += cost
+            while self.size > self.max_bytes:
+                _, (_, _, old_cost) = self._items.popitem(last=False)
+                self.size -= old_cost
+
+    def delete(self, title):
+        with self._lock:
+            self._discard(title)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.size = 0
+
+    def _discard(self, title):
+        item = self._items.pop(title, None)
+        if item is not None:
+            self.size -= item[2]
+
+
+class DjangoRenderCache:
+    """
+    Stores rendered articles in one of the caches from settings.CACHES.
+    Eviction is left to that cache.
+    """
+
+    def __init__(self, alias="default", timeout=None):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    @property
+    def shared(self):
+        return not isinstance(self.cache, (LocMemCache, DummyCache))
+
+    def _key(self, title):
+        return "wiki-render:" + content_hash(title)
+
+    def get(self, title):
+        item = self.cache.get(self._key(title))
+        return tuple(item) if item is not None else None
+
+    def set(self, title, digest, html):
+        self.cache.set(self._key(title), (digest, html, len(html)), self.timeout)
+
+    def delete(self, title):
+        self.cache.delete(self._key(title))
+
+
+class FileRenderCache:
+    """
+    Stores rendered articles as files in a directory, by default
+    "rendered" next to "entries". When the directory grows over
+    max_bytes the least recently read files are removed. The size of
+    the directory is kept as a running total, so it is only scanned
+    when that goes over max_bytes, and corrected then.
+    """
+
+    shared = True
+
+    def __init__(self, directory=None, max_bytes=512 * 1024 * 1024):
+        if directory is None:
+            directory = os.path.join(os.path.dirname(default_storage.path("entries")), "rendered")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # bytes in the directory, None until the first scan
+        self._total = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, title):
+        return os.path.join(self.directory, content_hash(title) + ".html")
+
+    def _size(self, path):
+        try:
+            return os.stat(path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def get(self, title):
+        try:
+            with open(self._path(title), encoding="utf-8") as f:
+                digest = f.readline().rstrip("\n")
+                html = f.read()
+        except FileNotFoundError:
+            return None
+        # touch the file, its mtime orders eviction
+        try:
+            os.utime(self._path(title))
+        except FileNotFoundError:
+            pass
+        return (digest, html, len(html))
+
+    def set(self, title, digest, html):
+        path = self._path(title)
+        tmp = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(digest + "\n" + html)
+        size = self._size(tmp)
+        with self._lock:
+            replaced = self._size(path)
+            os.replace(tmp, path)
+            if self._total is not None:
+                self._total += size - replaced
+            over = self._total is None or self._total > self.max_bytes
+        if over:
+            self._evict()
+
+    def delete(self, title):
+        path = self._path(title)
+        with self._lock:
+            size = self._size(path)
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                return
+            if self._total is not None:
+                self._total -= size
+
+    def _evict(self):
+        with self._lock:
+            files = []
+            total = 0
+            with os.scandir(self.directory) as it:
+                for dir_entry in it:
+                    if dir_entry.name.endswith(".html"):
+                        st = dir_entry.stat()
+                        files.append((st.st_mtime_ns, st.st_size, dir_entry.path))
+                        total += st.st_size
+            if total > self.max_bytes:
+                for _, size, path in sorted(files):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+            self._total = total
+
+
+def load_render_cache():
+    '''
+    Builds the cache named by settings.WIKI_RENDER_CACHE, a dict with
+    a "BACKEND" dotted path and optional "OPTIONS" keyword arguments.
+    '''
+    config = getattr(settings, "WIKI_RENDER_CACHE", {})
+    backend = import_string(config.get("BACKEND", "encyclopedia.rendering.MemoryRenderCache"))
+    return backend(**config.get("OPTIONS", {}))
+
+
+render_cache = load_render_cache()
+
+# rendered blocks by the hash of their source, shared by all entries
+block_cache = MemoryRenderCache(getattr(settings, "WIKI_BLOCK_CACHE_BYTES", 32 * 1024 * 1024))
+
+# gzip-compressed articles (GzipBody) by title, for clients accepting gzip
+gzip_cache = MemoryRenderCache(getattr(settings, "WIKI_GZIP_CACHE_BYTES", 32 * 1024 * 1024))
+
+
+def render_markdown(content):
+    '''
+    Renders Markdown block by block, reusing the cached HTML of blocks
+    that were rendered before, so after an edit only the changed blocks
+    are converted. The output is identical to markdown(content).
+    '''
+    with stage("markdown"):
+        blocks = split_blocks(content)
+        if blocks is None or len(blocks) == 1:
+            return markdown(content)
+        return "\n".join(render_block(block) for block in blocks)
+
+
+def render_block(block):
+    digest = content_hash(block)
+    item = block_cache.get(digest)
+    if item is not None:
+        return item[1]
+    html = markdown(block)
+    block_cache.set(digest, digest, html)
+    return html
+
+
+def stream_markdown(entry):
+    '''
+    Yields the HTML of a MappedEntry in pieces, decoding and rendering
+    one block at a time, so memory use does not grow with the size of
+    the entry. Joined, the pieces equal render_markdown(entry.read()).
+    '''
+    if NEEDS_FULL_RENDER_BYTES.search(entry.map):
+        yield markdown(entry.read())
+        return
+    blocks = iter_blocks(entry.lines())
+    first, second = next(blocks, None), next(blocks, None)
+    if second is None:
+        # like render_markdown, a lone block is rendered as the whole text
+        yield markdown(entry.read())
+        return
+    yield render_block(first)
+    for block in chain([second], blocks):
+        yield "\n"
+        yield render_block(block)
+
+
+def render_entry(title, content):
+    '''
+    Returns the HTML for an entry, rendering the Markdown only if the
+    cached copy was made from different source.
+    '''
+    digest = content_hash(content)
+    item = render_cache.get(title)
+    if item is not None and item[0] == digest:
+        return item[1]
+    html = render_markdown(content)
+    render_cache.set(title, digest, html)
+    return html
+
+
+def gzip_entry(title, content):
+    '''
+    Returns the GzipBody of an entry's HTML, compressing it only if the
+    cached copy was made from different source.
+    '''
+    digest = content_hash(content)
+    item = gzip_cache.get(title)
+    if item is not None and item[0] == digest:
+        return item[1]
+    with stage("gzip"):
+        body = gzip_body(render_entry(title, content))
+    gzip_cache.set(title, digest, body, cost=len(body.deflate))
+    return body
+
+
+def stream_entry(title, entry):
+    '''
+    Yields the HTML of a MappedEntry: the cached copy in pieces if it
+    was made from the same source, otherwise stream_markdown. The
+    streamed render is not cached, as that would mean holding it whole.
+    '''
+    item = render_cache.get(title)
+    if item is not None and item[0] == entry.digest():
+        html = item[1]
+        for start in range(0, len(html), STREAM_CHUNK_CHARS):
+            yield html[start:start + STREAM_CHUNK_CHARS]
+    else:
+        yield from stream_markdown(entry)
+
+
+@receiver(entry_saved)
+def prewarm_render_cache(sender, title, content, **kwargs):
+    render_cache.set(title, content_hash(content), render_markdown(content))
@@ -0,0 +1,218 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from difflib import SequenceMatcher, unified_diff
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from . import util
+from .signals import entry_pre_save, entry_saved
+
+# every this many revisions a full copy is stored instead of a delta,
+# so rebuilding any revision applies at most KEYFRAME_INTERVAL - 1 deltas
+KEYFRAME_INTERVAL = 10
+
+REVISIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS revisions (
+    title TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    keyframe INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    created_ns INTEGER NOT NULL,
+    PRIMARY KEY (title, number)
+);
+"""
+
+
+def make_delta(old, new):
+    '''
+    Returns the operations turning the lines of old into the lines of
+    new: ["=", start, stop] copies old lines, ["+", lines] inserts.
+    '''
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    ops = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, old_lines, new_lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            ops.append(["=", i1, i2])
+        elif j2 > j1:
+            ops.append(["+", new_lines[j1:j2]])
+    return ops
+
+
+def apply_delta(old, ops):
+    old_lines = old.splitlines(keepends=True)
+    parts = []
+    for op in ops:
+        if op[0] == "=":
+            parts.extend(old_lines[op[1]:op[2]])
+        else:
+            parts.extend(op[1])
+    return "".join(parts)
+
+
+def pack(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"))
+
+
+def unpack(data):
+    return json.loads(zlib.decompress(data).decode("utf-8"))
+
+
+class RevisionStore:
+    """
+    Keeps the history of every entry in SQLite as a chain of compressed
+    line deltas, with a full compressed copy (keyframe) every
+    KEYFRAME_INTERVAL revisions. Revisions are numbered from 1.
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._connection().executescript(REVISIONS_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def history(self, title):
+        '''
+        Returns (number, size, creation time in ns) for every revision
+        of an entry, newest first.
+        '''
+        return self._connection().execute(
+            "SELECT number, size, created_ns FROM revisions WHERE title = ? ORDER BY number DESC",
+            (title,)).fetchall()
+
+    def latest_number(self, title):
+        row = self._connection().execute(
+            "SELECT max(number) FROM revisions WHERE title = ?", (title,)).fetchone()
+        return row[0] or 0
+
+    def get(self, title, number):
+        '''
+        Rebuilds revision number of an entry from the nearest keyframe
+        at or before it. Returns None if there is no such revision.
+        '''
+        rows = self._connection().execute(
+            "SELECT number, keyframe, data FROM revisions WHERE title = ? AND number <= ? "
+            "AND number >= (SELECT max(number) FROM revisions "
+            "               WHERE title = ? AND number <= ? AND keyframe) "
+            "ORDER BY number",
+            (title, number, title, number)).fetchall()
+        if not rows or rows[-1][0] != number:
+            return None
+        content = None
+        for _, keyframe, data in rows:
+            content = unpack(data) if keyframe else apply_delta(content, unpack(data))
+        return content
+
+    def add(self, title, content):
+        '''
+        Stores content as the next revision of an entry, unless it is
+        the same as the latest one. Returns the revision number.
+        '''
+        connection = self._connection()
+        with self._write_lock, connection:
+            # BEGIN IMMEDIATE keeps other processes from taking the same number
+            connection.execute("BEGIN IMMEDIATE")
+            return self._add(connection, title, content)
+
+    def add_many(self, items):
+        '''
+        Stores (title, content) pairs like add, in a single transaction.
+        '''
+        connection = self._connection()
+        with self._write_lock, connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for title, content in items:
+                self._add(connection, title, content)
+
+    def _add(self, connection, title, content):
+        # within a write transaction
+        latest = self.latest_number(title)
+        previous = self.get(title, latest) if latest else None
+        if previous == content:
+            return latest
+        number = latest + 1
+        keyframe = previous is None or (number - 1) % KEYFRAME_INTERVAL == 0
+        data = pack(content if keyframe else make_delta(previous, content))
+        connection.execute(
+            "INSERT INTO revisions (title, number, keyframe, data, size, created_ns) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (title, number, keyframe, data, len(content), time.time_ns()))
+        return number
+
+    def diff(self, title, old, new):
+        '''
+        Returns a unified diff between two revisions, or None if
+        either does not exist.
+        '''
+        old_content, new_content = self.get(title, old), self.get(title, new)
+        if old_content is None or new_content is None:
+            return None
+        return "".join(unified_diff(
+            old_content.splitlines(keepends=True), new_content.splitlines(keepends=True),
+            f"{title} (revision {old})", f"{title} (revision {new})"))
+
+    def compact(self, title, interval=KEYFRAME_INTERVAL):
+        '''
+        Rewrites the chain of an entry with a keyframe every interval
+        revisions, e.g. after KEYFRAME_INTERVAL was lowered or for
+        chains written before keyframes existed. Returns the number of
+        rows rewritten.
+        '''
+        with self._write_lock:
+            connection = self._connection()
+            rows = connection.execute(
+                "SELECT number, keyframe, data FROM revisions WHERE title = ? ORDER BY number",
+                (title,)).fetchall()
+            rewritten = 0
+            previous = None
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                for i, (number, keyframe, data) in enumerate(rows):
+                    content = unpack(data) if keyframe else apply_delta(previous, unpack(data))
+                    want_keyframe = i % interval == 0
+                    # deltas are always against the previous revision, so
+                    # only rows that switch between delta and keyframe change
+                    if bool(keyframe) != want_keyframe:
+                        data = pack(content if want_keyframe else make_delta(previous, content))
+                        connection.execute(
+                            "UPDATE revisions SET keyframe = ?, data = ? WHERE title = ? AND number = ?",
+                            (want_keyframe, data, title, number))
+                        rewritten += 1
+                    previous = content
+            return rewritten
+
+    def titles(self):
+        return [row[0] for row in self._connection().execute("SELECT DISTINCT title FROM revisions")]
+
+
+revision_store = RevisionStore(getattr(
+    settings, "WIKI_REVISIONS", os.path.join(settings.BASE_DIR, "revisions.sqlite3")))
+
+
+@receiver(entry_pre_save)
+def record_original(sender, title, **kwargs):
+    # an entry written before history was kept gets its current text
+    # as revision 1, so the first edit can be undone
+    if not revision_store.latest_number(title):
+        content = util.get_entry(title)
+        if content is not None:
+            revision_store.add(title, content)
+
+
+@receiver(entry_saved)
+def record_revision(sender, title, content, **kwargs):
+    revision_store.add(title, content)
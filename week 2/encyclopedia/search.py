@@ -0,0 +1,283 @@
+import heapq
+import json
+import math
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.dispatch import receiver
+
+from . import util
+from .signals import entry_saved
+
+TOKEN_RE = re.compile(r"\w+")
+
+# words in the title count this many times more than words in the body
+TITLE_WEIGHT = 3
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+SNIPPET_CHARS = 160
+
+# characters from the start of each entry kept in the index, so most
+# snippets are made without reading the entry
+EXCERPT_CHARS = 1000
+
+
+def tokenize(text):
+    '''
+    Splits text into casefolded word tokens. Works for any script
+    that Python's regex engine treats as word characters.
+    '''
+    return TOKEN_RE.findall(text.casefold())
+
+
+def term_frequencies(title, content):
+    '''
+    Returns a dict of term -> weighted frequency for one entry,
+    and the weighted length of the entry.
+    '''
+    freqs = {}
+    for token in tokenize(title):
+        freqs[token] = freqs.get(token, 0) + TITLE_WEIGHT
+    for token in tokenize(content):
+        freqs[token] = freqs.get(token, 0) + 1
+    return freqs, sum(freqs.values())
+
+
+def make_snippet(content, terms, whole=True):
+    '''
+    Returns a short piece of content around the first occurrence
+    of any of the terms. If content is only the start of the text
+    (whole=False), returns None when that is not enough to tell.
+    '''
+    text = " ".join(content.split())
+    pattern = "|".join(re.escape(term) for term in terms)
+    match = re.search(pattern, text, re.IGNORECASE) if pattern else None
+    start = 0
+    if match:
+        start = max(0, match.start() - SNIPPET_CHARS // 3)
+    if not whole and (not match or start + SNIPPET_CHARS >= len(text)):
+        return None
+    snippet = text[start:start + SNIPPET_CHARS]
+    if start > 0:
+        snippet = "..." + snippet
+    if start + SNIPPET_CHARS < len(text):
+        snippet = snippet + "..."
+    return snippet
+
+
+class SearchIndex:
+    """
+    Inverted index over entry titles and Markdown bodies, ranked with BM25.
+
+    Posting lists are kept in memory and saved as JSON to the file named
+    by settings.WIKI_SEARCH_INDEX, at most once a minute after changes (see
+    util.DeferredSave). On first use the saved index is loaded and any
+    entries whose file mtime changed since are re-indexed.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.RLock()
+        self._save_lock = threading.Lock()
+        self._loaded = False
+        self._signature = None
+        # title -> [length, mtime_ns, first EXCERPT_CHARS + 1 characters]
+        self.docs = {}
+        # term -> {title: frequency}
+        self.postings = {}
+        # title -> terms, so a document can be removed without a full scan
+        self.doc_terms = {}
+        self.total_length = 0
+        self.saver = util.DeferredSave(self.save)
+
+    # ---- building ----
+
+    def add_document(self, title, content, mtime=0):
+        freqs, length = term_frequencies(title, content)
+        self.add_terms(title, freqs, length, mtime, content)
+
+    def add_terms(self, title, freqs, length, mtime=0, content=None):
+        '''
+        Adds an entry from the output of term_frequencies, which bulk
+        imports compute in worker processes. The start of content is
+        kept for snippets.
+        '''
+        excerpt = content[:EXCERPT_CHARS + 1] if content is not None else None
+        with self._lock:
+            self.remove_document(title)
+            for term, freq in freqs.items():
+                self.postings.setdefault(term, {})[title] = freq
+            self.docs[title] = [length, mtime, excerpt]
+            self.doc_terms[title] = list(freqs)
+            self.total_length += length
+
+    def remove_document(self, title):
+        with self._lock:
+            doc = self.docs.pop(title, None)
+            if doc is None:
+                return
+            self.total_length -= doc[0]
+            for term in self.doc_terms.pop(title, ()):
+                posting = self.postings.get(term)
+                if posting is not None:
+                    posting.pop(title, None)
+                    if not posting:
+                        del self.postings[term]
+
+    def sync(self):
+        '''
+        Brings the index in line with the entry storage, re-indexing
+        only the entries that were added or modified since the last sync.
+        Returns True if anything changed.
+        '''
+        with self._lock:
+            changed = False
+            seen = set()
+            for title, mtime in util.storage.iter_stats():
+                seen.add(title)
+                doc = self.docs.get(title)
+                if doc is None or doc[1] != mtime:
+                    content = util.storage.read(title)
+                    if content is not None:
+                        self.add_document(title, content, mtime)
+                        changed = True
+            for title in set(self.docs) - seen:
+                self.remove_document(title)
+                changed = True
+            self._signature = util.entries_signature()
+            return changed
+
+    def load(self):
+        with self._lock:
+            if self.path and os.path.exists(self.path):
+                with open(self.path, encoding="utf-8") as f:
+                    data = json.load(f)
+                self.docs = data["docs"]
+                self.postings = data["postings"]
+                self.total_length = sum(doc[0] for doc in self.docs.values())
+                self.doc_terms = {}
+                for term, posting in self.postings.items():
+                    for title in posting:
+                        self.doc_terms.setdefault(title, []).append(term)
+            self._loaded = True
+            if self.sync():
+                self.saver.request()
+
+    def save(self):
+        '''
+        Writes the index to disk, replacing the old file atomically.
+        '''
+        if not self.path:
+            return
+        with self._save_lock:
+            # copied under the lock and encoded outside it, which takes
+            # far longer, so searches don't wait for the file
+            with self._lock:
+                docs = dict(self.docs)
+                postings = {term: posting.copy() for term, posting in self.postings.items()}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"docs": docs, "postings": postings}, f,
+                          ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp, self.path)
+
+    def ensure_loaded(self):
+        with self._lock:
+            if not self._loaded:
+                self.load()
+
+    def _ensure_fresh(self):
+        if not self._loaded:
+            self.load()
+        elif util.entries_signature() != self._signature:
+            if self.sync():
+                self.saver.request()
+
+    def update(self, title, content):
+        '''
+        Re-indexes a single entry after it has been saved.
+        '''
+        with self._lock:
+            if not self._loaded:
+                # the next load() picks the new file up through its mtime
+                return
+            st = util.entry_stat(title)
+            self.add_document(title, content, st.mtime_ns if st else 0)
+            self._signature = util.entries_signature()
+        self.saver.request()
+
+    # ---- querying ----
+
+    def rank(self, query, limit=20):
+        '''
+        Returns up to limit (title, score) pairs, best first.
+        '''
+        terms = set(tokenize(query))
+        with self._lock:
+            count = len(self.docs)
+            if not terms or not count:
+                return []
+            avg_length = self.total_length / count
+            scores = {}
+            for term in terms:
+                posting = self.postings.get(term)
+                if not posting:
+                    continue
+                idf = math.log(1 + (count - len(posting) + 0.5) / (len(posting) + 0.5))
+                for title, freq in posting.items():
+                    norm = K1 * (1 - B + B * self.docs[title][0] / avg_length)
+                    scores[title] = scores.get(title, 0) + idf * freq * (K1 + 1) / (freq + norm)
+        return heapq.nlargest(limit, scores.items(), key=lambda item: (item[1], item[0]))
+
+    def search(self, query, limit=20):
+        '''
+        Returns up to limit results as dicts with "title", "score"
+        and "snippet" keys, best first. Storage backends with their own
+        full-text search (SQLite FTS5) answer directly.
+        '''
+        terms = tokenize(query)
+        if hasattr(util.storage, "full_text_search"):
+            return [{"title": title, "score": score, "snippet": snippet}
+                    for title, score, snippet in util.storage.full_text_search(query, terms, limit)]
+        self._ensure_fresh()
+        return self.results(query, limit)
+
+    def results(self, query, limit=20, read=None):
+        '''
+        Returns the search() results of the index as it stands. Snippets
+        come from the start of each entry kept in the index; only when
+        the terms are not found there is the content read with read,
+        util.get_entry by default.
+        '''
+        read = read or util.get_entry
+        terms = tokenize(query)
+        results = []
+        for title, score in self.rank(query, limit):
+            with self._lock:
+                doc = self.docs.get(title)
+            excerpt = doc[2] if doc and len(doc) > 2 else None
+            snippet = None
+            if excerpt is not None:
+                snippet = make_snippet(excerpt, terms, whole=len(excerpt) <= EXCERPT_CHARS)
+            if snippet is None:
+                snippet = make_snippet(read(title) or "", terms)
+            results.append({
+                "title": title,
+                "score": score,
+                "snippet": snippet,
+            })
+        return results
+
+
+search_index = SearchIndex(getattr(settings, "WIKI_SEARCH_INDEX", None))
+
+
+@receiver(entry_saved)
+def update_search_index(sender, title, content, **kwargs):
+    if not hasattr(util.storage, "full_text_search"):
+        search_index.update(title, content)
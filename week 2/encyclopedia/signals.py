@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Sent by util.save_entry before an entry is written, with the
+# keyword argument "title".
+entry_pre_save = Signal()
+
+# Sent by util.save_entry after an entry has been written,
+# with the keyword arguments "title" and "content".
+entry_saved = Signal()
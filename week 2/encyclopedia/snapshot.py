@@ -0,0 +1,136 @@
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice, repeat
+
+import django
+from django.conf import settings
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+from . import util
+from .rendering import render_entry, render_markdown
+from .search import SearchIndex, term_frequencies
+from .signals import entry_saved
+from .storage import replace_file
+
+# entries rendered per chunk of the snapshot index page
+INDEX_CHUNK = 500
+
+INDEX_MARKER = "<!-- entries -->"
+
+
+def snapshot_directory():
+    return getattr(settings, "WIKI_SNAPSHOT_DIR", os.path.join(settings.BASE_DIR, "snapshot"))
+
+
+def article_path(directory, title):
+    return os.path.join(directory, "wiki", title + ".html")
+
+
+def search_index_path(directory):
+    return os.path.join(directory, "search_index.json")
+
+
+def write_article(directory, title, html):
+    page = render_to_string("encyclopedia/article.html", {
+        "title": title,
+        "article": html,
+        "snapshot": True,
+    })
+    replace_file(article_path(directory, title), page, sync=False)
+
+
+def write_index(directory):
+    '''
+    Writes index.html listing every entry on one page, rendered in
+    chunks around a marker like the streamed index view.
+    '''
+    names = util.entry_index.names()
+    page = render_to_string("encyclopedia/index.html", {
+        "stream_marker": INDEX_MARKER,
+        "snapshot": True,
+    })
+    head, tail = page.split(INDEX_MARKER)
+    chunks = [head]
+    for i in range(0, len(names), INDEX_CHUNK):
+        chunks.append(render_to_string("encyclopedia/index_entries.html", {
+            "entries": names[i:i + INDEX_CHUNK],
+        }))
+    chunks.append(tail)
+    replace_file(os.path.join(directory, "index.html"), "".join(chunks), sync=False)
+
+
+def build_article(item, directory):
+    '''
+    Runs in a worker process: renders an entry to its static page and
+    tokenizes it for the search index.
+    '''
+    title, content = item
+    write_article(directory, title, render_markdown(content))
+    freqs, length = term_frequencies(title, content)
+    return title, freqs, length
+
+
+def build_snapshot(directory, workers=None, batch_size=1000, progress=None):
+    '''
+    Renders every entry, the index page and the search index JSON into
+    directory, rendering in parallel across worker processes. Pages of
+    entries that no longer exist are removed. Returns the number of
+    entries written.
+    '''
+    os.makedirs(os.path.join(directory, "wiki"), exist_ok=True)
+    index = SearchIndex(search_index_path(directory))
+    titles = util.list_entries()
+    entries = ((title, util.get_entry(title)) for title in titles)
+    entries = ((title, content) for title, content in entries if content is not None)
+    workers = max(1, workers or os.cpu_count())
+    done = 0
+    # the initializer sets Django up in workers started with "spawn"
+    with ProcessPoolExecutor(workers, initializer=django.setup) as pool:
+        while True:
+            batch = list(islice(entries, batch_size))
+            if not batch:
+                break
+            mtimes = {title: util.entry_stat(title) for title, _ in batch}
+            contents = dict(batch)
+            for title, freqs, length in pool.map(build_article, batch, repeat(directory),
+                                                 chunksize=max(1, len(batch) // (workers * 4))):
+                st = mtimes[title]
+                index.add_terms(title, freqs, length, st.mtime_ns if st else 0, contents[title])
+            done += len(batch)
+            if progress:
+                progress(done)
+
+    index.save()
+    write_index(directory)
+
+    wanted = {title + ".html" for title in index.docs}
+    with os.scandir(os.path.join(directory, "wiki")) as it:
+        for dir_entry in it:
+            if dir_entry.name.endswith(".html") and dir_entry.name not in wanted:
+                os.remove(dir_entry.path)
+    return done
+
+
+# snapshot directory -> its search index, loaded on the first save
+snapshot_search_indexes = {}
+
+
+@receiver(entry_saved)
+def update_snapshot(sender, title, content, **kwargs):
+    # only keep a snapshot current that "manage.py build_snapshot" made
+    directory = snapshot_directory()
+    if not getattr(settings, "WIKI_SNAPSHOT_ON_SAVE", False) \
+            or not os.path.exists(os.path.join(directory, "index.html")):
+        return
+    # the index page only lists titles, so an edit leaves it as it is
+    new = not os.path.exists(article_path(directory, title))
+    write_article(directory, title, render_entry(title, content))
+    if new:
+        write_index(directory)
+    # its search index file follows within WIKI_INDEX_SAVE_DELAY, see util.DeferredSave
+    index = snapshot_search_indexes.get(directory)
+    if index is None:
+        index = snapshot_search_indexes[directory] = SearchIndex(search_index_path(directory))
+    index.ensure_loaded()
+    index.update(title, content)
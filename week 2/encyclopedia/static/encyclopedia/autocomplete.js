@@ -0,0 +1,29 @@
+// Suggests entry titles under the search box as the user types.
+document.addEventListener('DOMContentLoaded', () => {
+    const input = document.querySelector('input.search');
+    const list = document.querySelector('#search_titles');
+    if (!input || !list) {
+        return;
+    }
+    let pending = null;
+    input.addEventListener('input', () => {
+        clearTimeout(pending);
+        pending = setTimeout(() => {
+            const q = input.value.trim();
+            if (!q) {
+                list.innerHTML = '';
+                return;
+            }
+            fetch(`${input.dataset.autocomplete}?q=${encodeURIComponent(q)}`)
+                .then(response => response.json())
+                .then(data => {
+                    list.innerHTML = '';
+                    data.results.forEach(title => {
+                        const option = document.createElement('option');
+                        option.value = title;
+                        list.appendChild(option);
+                    });
+                });
+        }, 100);
+    });
+});
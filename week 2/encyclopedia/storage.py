@@ -0,0 +1,589 @@
+import hashlib
+import mmap
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.module_loading import import_string
+
+from .compression import decode_entry, encode_entry, is_compressed
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# version is a short string that changes whenever the entry is rewritten
+EntryStat = namedtuple("EntryStat", "mtime_ns size version")
+
+
+class EntryConflict(Exception):
+    """
+    Raised by write() when the entry is not at the version the caller
+    expected, i.e. someone else saved it in the meantime.
+    """
+
+
+class WriteLock:
+    """
+    Serialises writers: a thread lock within the process, plus an
+    flock() on a lock file across processes where fcntl is available.
+    Readers never take it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if fcntl is not None and self.path:
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+def check_version(current, expected_version):
+    '''
+    Raises EntryConflict unless the current EntryStat (or None) matches
+    expected_version. None skips the check, "" means "must not exist".
+    '''
+    if expected_version is None:
+        return
+    version = current.version if current else ""
+    if version != expected_version:
+        raise EntryConflict(f"expected version {expected_version!r}, found {version!r}")
+
+
+def is_stale(storage, title, versions):
+    '''
+    Tells if an entry is no longer at its version in versions, a dict
+    of title -> expected version (see check_version) or None. Called
+    with the storage's write lock held.
+    '''
+    if versions is None:
+        return False
+    try:
+        check_version(storage.stat(title), versions.get(title))
+    except EntryConflict:
+        return True
+    return False
+
+
+class MappedEntry:
+    """
+    A read-only memory map of an entry file. The mapped pages live in
+    the page cache and are shared by every reader of the file, and the
+    text is only decoded a line at a time as it is iterated. Writers
+    rename a new file over the old one, so a map keeps seeing the
+    version it was opened on.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            # an empty file cannot be mapped
+            if os.fstat(f.fileno()).st_size:
+                self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                if hasattr(self.map, "madvise"):
+                    self.map.madvise(mmap.MADV_SEQUENTIAL)
+            else:
+                self.map = b""
+
+    def __len__(self):
+        return len(self.map)
+
+    @property
+    def compressed(self):
+        return is_compressed(self.map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.map, mmap.mmap):
+            self.map.close()
+
+    def lines(self):
+        '''
+        Yields the decoded lines without their "\n", like
+        read().split("\n") but one line at a time.
+        '''
+        start = 0
+        while True:
+            end = self.map.find(b"\n", start)
+            if end == -1:
+                yield self.map[start:].decode("utf-8")
+                return
+            yield self.map[start:end].decode("utf-8")
+            start = end + 1
+
+    def read(self):
+        return self.map[:].decode("utf-8")
+
+    def digest(self):
+        '''
+        The SHA-1 of the content, as rendering.content_hash would give
+        for the decoded text, computed without decoding it.
+        '''
+        return hashlib.sha1(self.map).hexdigest()
+
+
+def map_entry(path):
+    '''
+    Returns a MappedEntry of the file at path, or None if it is
+    compressed and so has to be read whole.
+    '''
+    entry = MappedEntry(path)
+    if entry.compressed:
+        entry.close()
+        return None
+    return entry
+
+
+def replace_file(path, content, sync=True, mtime_ns=None):
+    '''
+    Writes content, text or bytes, to a temporary file next to path and
+    renames it over path, so readers see either the old or the new file.
+    Bulk writers pass sync=False and skip the fsync. With mtime_ns the
+    new file gets that modification time instead of the current one.
+    '''
+    directory, name = os.path.split(path)
+    tmp = os.path.join(directory, f".{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with (open(tmp, "wb") if isinstance(content, bytes) else open(tmp, "w", encoding="utf-8")) as f:
+            f.write(content)
+            if sync:
+                f.flush()
+                os.fsync(f.fileno())
+        if mtime_ns is not None:
+            os.utime(tmp, ns=(mtime_ns, mtime_ns))
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+class FlatFileStorage:
+    """
+    Keeps every entry as "<title>.md" in one directory of Django's
+    default_storage (or of a FileSystemStorage rooted at location).
+    This is the original layout of the wiki. Files are plain UTF-8 or,
+    with settings.WIKI_ENTRY_COMPRESSION, compressed (see compression.py);
+    either kind is read.
+
+    Every backend has the same methods: list_titles, read, write,
+    delete, stat, iter_stats and signature. Backends keeping entries
+    in files also have open_mapped, returning a MappedEntry. write() replaces an entry
+    atomically and takes an optional expected_version (see
+    check_version) for optimistic concurrency. signature() returns a
+    tuple that changes whenever an entry is added or removed, whose
+    last item is the time of that change in nanoseconds, or None if
+    the backend cannot tell cheaply.
+    """
+
+    def __init__(self, directory="entries", location=None):
+        self.directory = directory
+        # location is the root of a separate FileSystemStorage to use
+        self.files = FileSystemStorage(location) if location else default_storage
+        try:
+            self._lock = WriteLock(os.path.join(self.files.path(directory), ".lock"))
+        except NotImplementedError:
+            self._lock = WriteLock(None)
+
+    def _name(self, title):
+        return f"{self.directory}/{title}.md"
+
+    def list_titles(self):
+        _, filenames = self.files.listdir(self.directory)
+        return [re.sub(r"\.md$", "", filename)
+                for filename in filenames if filename.endswith(".md")]
+
+    def read(self, title):
+        try:
+            with self.files.open(self._name(title)) as f:
+                return decode_entry(f.read())
+        except FileNotFoundError:
+            return None
+
+    def open_mapped(self, title):
+        '''
+        Returns a MappedEntry, or None if the entry does not exist, is
+        compressed or the storage has no local files.
+        '''
+        try:
+            return map_entry(self.files.path(self._name(title)))
+        except (NotImplementedError, FileNotFoundError, ValueError):
+            return None
+
+    def write(self, title, content, expected_version=None):
+        filename = self._name(title)
+        with self._lock:
+            check_version(self.stat(title), expected_version)
+            try:
+                path = self.files.path(filename)
+            except NotImplementedError:
+                # remote storage, no rename available
+                if self.files.exists(filename):
+                    self.files.delete(filename)
+                self.files.save(filename, ContentFile(encode_entry(content)))
+                return
+            replace_file(path, encode_entry(content))
+
+    def write_many(self, items, versions=None, mtimes=None):
+        '''
+        Writes (title, content) pairs under one lock, without an fsync
+        per file. With versions, a dict of title -> expected version,
+        entries saved by someone else since are left as they are; their
+        titles are returned. With mtimes, a dict of title -> mtime_ns,
+        the files keep those modification times.
+        '''
+        skipped = []
+        with self._lock:
+            for title, content in items:
+                if is_stale(self, title, versions):
+                    skipped.append(title)
+                    continue
+                try:
+                    replace_file(self.files.path(self._name(title)), encode_entry(content), sync=False,
+                                 mtime_ns=mtimes.get(title) if mtimes else None)
+                except NotImplementedError:
+                    self.files.delete(self._name(title))
+                    self.files.save(self._name(title), ContentFile(encode_entry(content)))
+        return skipped
+
+    def delete(self, title):
+        with self._lock:
+            self.files.delete(self._name(title))
+
+    def stat(self, title):
+        try:
+            st = os.stat(self.files.path(self._name(title)))
+        except (NotImplementedError, FileNotFoundError, ValueError):
+            return None
+        return EntryStat(st.st_mtime_ns, st.st_size,
+                         "%x-%x-%x" % (st.st_ino, st.st_mtime_ns, st.st_size))
+
+    def iter_stats(self):
+        '''
+        Yields (title, mtime_ns) for every entry.
+        '''
+        with os.scandir(self.files.path(self.directory)) as it:
+            for dir_entry in it:
+                if dir_entry.name.endswith(".md"):
+                    yield dir_entry.name[:-3], dir_entry.stat().st_mtime_ns
+
+    def signature(self):
+        try:
+            st = os.stat(self.files.path(self.directory))
+        except (NotImplementedError, FileNotFoundError):
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+
+def escape_title(title):
+    return title.replace("%", "%25").replace("/", "%2F").replace("\\", "%5C")
+
+
+def unescape_title(name):
+    return name.replace("%5C", "\\").replace("%2F", "/").replace("%25", "%")
+
+
+class ShardedFileStorage:
+    """
+    Spreads entries over sub-directories named after the first hex
+    digits of the SHA-1 of the title, e.g. "entries_sharded/3f/Python.md",
+    so no single directory grows too large.
+
+    The set of titles is only tracked for writes made through this
+    class: a ".generation" file in the root is touched whenever an
+    entry is added or removed.
+    """
+
+    def __init__(self, directory="entries_sharded", depth=1):
+        self.directory = os.path.abspath(directory)
+        self.depth = depth
+        self._generation = os.path.join(self.directory, ".generation")
+        self._lock = WriteLock(os.path.join(self.directory, ".lock"))
+        os.makedirs(self.directory, exist_ok=True)
+        if not os.path.exists(self._generation):
+            self._touch_generation()
+
+    def _touch_generation(self):
+        replace_file(self._generation, str(time.time_ns()))
+
+    def _shard(self, title):
+        digest = hashlib.sha1(title.encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, *(digest[2 * i:2 * i + 2] for i in range(self.depth)))
+
+    def _path(self, title):
+        return os.path.join(self._shard(title), escape_title(title) + ".md")
+
+    def iter_stats(self):
+        stack = [self.directory]
+        while stack:
+            with os.scandir(stack.pop()) as it:
+                for dir_entry in it:
+                    if dir_entry.is_dir():
+                        stack.append(dir_entry.path)
+                    elif dir_entry.name.endswith(".md"):
+                        yield unescape_title(dir_entry.name[:-3]), dir_entry.stat().st_mtime_ns
+
+    def list_titles(self):
+        return [title for title, _ in self.iter_stats()]
+
+    def read(self, title):
+        try:
+            with open(self._path(title), "rb") as f:
+                return decode_entry(f.read())
+        except FileNotFoundError:
+            return None
+
+    def open_mapped(self, title):
+        try:
+            return map_entry(self._path(title))
+        except FileNotFoundError:
+            return None
+
+    def write(self, title, content, expected_version=None):
+        path = self._path(title)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            current = self.stat(title)
+            check_version(current, expected_version)
+            replace_file(path, encode_entry(content))
+            if current is None:
+                self._touch_generation()
+
+    def write_many(self, items, versions=None, mtimes=None):
+        skipped = []
+        with self._lock:
+            for title, content in items:
+                if is_stale(self, title, versions):
+                    skipped.append(title)
+                    continue
+                path = self._path(title)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                replace_file(path, encode_entry(content), sync=False,
+                             mtime_ns=mtimes.get(title) if mtimes else None)
+            self._touch_generation()
+        return skipped
+
+    def delete(self, title):
+        with self._lock:
+            try:
+                os.remove(self._path(title))
+            except FileNotFoundError:
+                return
+            self._touch_generation()
+
+    def stat(self, title):
+        try:
+            st = os.stat(self._path(title))
+        except FileNotFoundError:
+            return None
+        return EntryStat(st.st_mtime_ns, st.st_size,
+                         "%x-%x-%x" % (st.st_ino, st.st_mtime_ns, st.st_size))
+
+    def signature(self):
+        st = os.stat(self._generation)
+        return (st.st_ino, st.st_mtime_ns)
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    title TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries_meta (
+    generation INTEGER NOT NULL,
+    changed_ns INTEGER NOT NULL
+);
+INSERT INTO entries_meta SELECT 0, 0 WHERE NOT EXISTS (SELECT 1 FROM entries_meta);
+CREATE VIRTUAL TABLE IF NOT EXISTS entries_fts USING fts5(
+    title, content, content='entries', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS entries_ai AFTER INSERT ON entries BEGIN
+    INSERT INTO entries_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+    UPDATE entries_meta SET generation = generation + 1, changed_ns = new.mtime_ns;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_ad AFTER DELETE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, title, content)
+        VALUES ('delete', old.rowid, old.title, old.content);
+    UPDATE entries_meta SET generation = generation + 1,
+        changed_ns = CAST((julianday('now') - 2440587.5) * 86400000000000 AS INTEGER);
+END;
+CREATE TRIGGER IF NOT EXISTS entries_au AFTER UPDATE ON entries BEGIN
+    INSERT INTO entries_fts(entries_fts, rowid, title, content)
+        VALUES ('delete', old.rowid, old.title, old.content);
+    INSERT INTO entries_fts(rowid, title, content) VALUES (new.rowid, new.title, new.content);
+END;
+"""
+
+
+# mtime_ns always moves forward on update, so it can serve as the version
+UPSERT_ENTRY = (
+    "INSERT INTO entries (title, content, mtime_ns) VALUES (?, ?, ?) "
+    "ON CONFLICT (title) DO UPDATE SET content = excluded.content, "
+    "mtime_ns = max(excluded.mtime_ns, entries.mtime_ns + 1)"
+)
+
+
+class SQLiteStorage:
+    """
+    Keeps entries in a SQLite table, with an FTS5 table over titles
+    and contents kept in sync by triggers. Each thread gets its own
+    connection; the database runs in WAL mode so readers never wait
+    for a writer.
+    """
+
+    def __init__(self, database="entries.sqlite3"):
+        self.database = os.path.abspath(database)
+        self._local = threading.local()
+        self._connection().executescript(SQLITE_SCHEMA)
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        # a forked worker process must not use its parent's connection
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.database, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def list_titles(self):
+        return [row[0] for row in self._connection().execute("SELECT title FROM entries")]
+
+    def read(self, title):
+        row = self._connection().execute(
+            "SELECT content FROM entries WHERE title = ?", (title,)).fetchone()
+        return row[0] if row else None
+
+    def write(self, title, content, expected_version=None):
+        connection = self._connection()
+        with connection:
+            # take the write lock up front so the version check and the
+            # write happen in one step
+            connection.execute("BEGIN IMMEDIATE")
+            check_version(self.stat(title), expected_version)
+            connection.execute(UPSERT_ENTRY, (title, content, time.time_ns()))
+
+    def write_many(self, items, versions=None, mtimes=None):
+        '''
+        Writes (title, content) pairs in a single transaction. mtimes
+        is ignored: mtime_ns is the version here and must move forward.
+        '''
+        connection = self._connection()
+        now = time.time_ns()
+        with connection:
+            connection.execute("BEGIN IMMEDIATE" if versions is not None else "BEGIN")
+            skipped = [title for title, _ in items if is_stale(self, title, versions)]
+            stale = set(skipped)
+            connection.executemany(UPSERT_ENTRY, ((title, content, now) for title, content in items
+                                                  if title not in stale))
+        return skipped
+
+    def delete(self, title):
+        self._connection().execute("DELETE FROM entries WHERE title = ?", (title,))
+
+    def stat(self, title):
+        row = self._connection().execute(
+            "SELECT mtime_ns, length(CAST(content AS BLOB)) FROM entries WHERE title = ?",
+            (title,)).fetchone()
+        if row is None:
+            return None
+        return EntryStat(row[0], row[1], "%x" % row[0])
+
+    def iter_stats(self):
+        return iter(self._connection().execute("SELECT title, mtime_ns FROM entries").fetchall())
+
+    def signature(self):
+        return self._connection().execute(
+            "SELECT generation, changed_ns FROM entries_meta").fetchone()
+
+    def full_text_search(self, query, terms, limit=20):
+        '''
+        Returns up to limit (title, score, snippet) tuples ranked by
+        FTS5's bm25, with title matches weighted like the in-memory
+        search index. terms are the already tokenized query words.
+        '''
+        if not terms:
+            return []
+        match = " OR ".join('"%s"' % term.replace('"', '""') for term in terms)
+        rows = self._connection().execute(
+            "SELECT title, -bm25(entries_fts, 3.0, 1.0), "
+            "snippet(entries_fts, 1, '', '', '...', 24) "
+            "FROM entries_fts WHERE entries_fts MATCH ? ORDER BY bm25(entries_fts, 3.0, 1.0) LIMIT ?",
+            (match, limit))
+        return rows.fetchall()
+
+
+def load_entry_storage():
+    '''
+    Builds the backend named by settings.WIKI_ENTRY_STORAGE, a dict with
+    a "BACKEND" dotted path and optional "OPTIONS" keyword arguments.
+    '''
+    config = getattr(settings, "WIKI_ENTRY_STORAGE", {})
+    backend = import_string(config.get("BACKEND", "encyclopedia.storage.FlatFileStorage"))
+    return backend(**config.get("OPTIONS", {}))
+
+
+# short names used by the management commands, see open_storage
+BACKENDS = {
+    "flat": FlatFileStorage,
+    "sharded": ShardedFileStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def open_storage(name, location):
+    '''
+    Returns the BACKENDS backend called name keeping its entries at
+    location, a directory or database file given on the command line.
+    '''
+    location = os.path.abspath(location)
+    if BACKENDS[name] is FlatFileStorage:
+        # a directory of its own FileSystemStorage, not of default_storage
+        os.makedirs(location, exist_ok=True)
+        return FlatFileStorage(os.path.basename(location), location=os.path.dirname(location))
+    os.makedirs(os.path.dirname(location), exist_ok=True)
+    return BACKENDS[name](location)
+
+
+def write_batch(storage, items, versions=None, mtimes=None):
+    '''
+    Writes a list of (title, content) pairs, in one transaction
+    when the backend supports it. With versions, a dict of title ->
+    expected version, entries saved by someone else since are skipped;
+    returns their titles. With mtimes, a dict of title -> mtime_ns,
+    file backends keep those modification times.
+    '''
+    if hasattr(storage, "write_many"):
+        return storage.write_many(items, versions, mtimes)
+    skipped = []
+    for title, content in items:
+        try:
+            storage.write(title, content, versions.get(title) if versions else None)
+        except EntryConflict:
+            skipped.append(title)
+    return skipped
@@ -1,3 +1,920 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from markdown2 import markdown
+
+from . import async_views, links, picker, rendering, revisions, util, views
+from .archives import ArchiveWriter
+from .compression import dictionaries, is_compressed, train_dictionary
+from .links import LinkGraph
+from .picker import RandomPicker
+from .management.commands.bench_wiki import url_mode
+from .rendering import FileRenderCache, block_cache, render_markdown, split_blocks
+from .snapshot import build_snapshot, snapshot_search_indexes
+from .timing import SlowRequestSampler
+from .titles import TitleIndex, fold
+from .revisions import RevisionStore
+from .search import search_index
+from .storage import BACKENDS, FlatFileStorage, ShardedFileStorage, SQLiteStorage, open_storage
+
+
+class StorageTestCase(SimpleTestCase):
+    """
+    Points util at a fresh storage in a temporary directory.
+    """
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.old_storage = util.storage
+        # the views import these by name, so they are swapped there too
+        revision_store = RevisionStore(os.path.join(self.root, "revisions.sqlite3"))
+        link_graph = LinkGraph()
+        for module, name, value in [
+            (revisions, "revision_store", revision_store), (views, "revision_store", revision_store),
+            (links, "link_graph", link_graph), (views, "link_graph", link_graph),
+            (async_views, "link_graph", link_graph),
+        ]:
+            self.addCleanup(setattr, module, name, getattr(module, name))
+            setattr(module, name, value)
+        # the search index is kept in memory only, and read again after
+        self.addCleanup(setattr, search_index, "path", search_index.path)
+        self.addCleanup(setattr, search_index, "_loaded", False)
+        search_index.path, search_index._loaded = None, False
+        util.entry_index.invalidate()
+
+    def tearDown(self):
+        util.storage = self.old_storage
+        util.entry_index.invalidate()
+        shutil.rmtree(self.root)
+
+    def storages(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        yield FlatFileStorage("flat", location=self.root)
+        yield ShardedFileStorage(os.path.join(self.root, "sharded"))
+        yield SQLiteStorage(os.path.join(self.root, "entries.sqlite3"))
+
+    def use(self, storage):
+        util.storage = storage
+        util.entry_index.invalidate()
+
+
+class AtomicWriteTests(StorageTestCase):
+
+    def test_readers_never_see_a_missing_entry(self):
+        old, new = "old text " * 500, "new text " * 700
+        for storage in self.storages():
+            with self.subTest(storage=type(storage).__name__):
+                self.use(storage)
+                util.save_entry("Hot", old)
+                stop = threading.Event()
+                errors = []
+
+                def write():
+                    for i in range(60):
+                        util.save_entry("Hot", new if i % 2 else old)
+                    stop.set()
+
+                def read():
+                    while not stop.is_set():
+                        content = util.get_entry("Hot")
+                        if content not in (old, new):
+                            errors.append(content)
+
+                threads = [threading.Thread(target=write) for _ in range(2)]
+                threads += [threading.Thread(target=read) for _ in range(4)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+                self.assertEqual(errors, [])
+                self.assertEqual(util.list_entries(), ["Hot"])
+
+    def test_stale_version_is_rejected(self):
+        for storage in self.storages():
+            with self.subTest(storage=type(storage).__name__):
+                self.use(storage)
+                util.save_entry("Page", "first", expected_version="")
+                version = util.entry_stat("Page").version
+                util.save_entry("Page", "second", expected_version=version)
+                with self.assertRaises(util.EntryConflict):
+                    util.save_entry("Page", "third", expected_version=version)
+                with self.assertRaises(util.EntryConflict):
+                    util.save_entry("Page", "again", expected_version="")
+                self.assertEqual(util.get_entry("Page"), "second")
+
+    def test_only_one_concurrent_edit_wins(self):
+        for storage in self.storages():
+            with self.subTest(storage=type(storage).__name__):
+                self.use(storage)
+                util.save_entry("Page", "start")
+                for _ in range(10):
+                    version = util.entry_stat("Page").version
+                    saved = []
+                    barrier = threading.Barrier(8)
+
+                    def edit(n):
+                        barrier.wait()
+                        try:
+                            util.save_entry("Page", f"edit {n}", expected_version=version)
+                            saved.append(n)
+                        except util.EntryConflict:
+                            pass
+
+                    threads = [threading.Thread(target=edit, args=(n,)) for n in range(8)]
+                    for thread in threads:
+                        thread.start()
+                    for thread in threads:
+                        thread.join()
+
+                    self.assertEqual(len(saved), 1)
+                    self.assertEqual(util.get_entry("Page"), f"edit {saved[0]}")
+
+
+class MigrateEntriesTests(StorageTestCase):
+
+    def test_entries_are_copied_to_every_backend(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        for title in ("Python", "Django", "Ünïcode"):
+            util.save_entry(title, f"# {title}")
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            for target in BACKENDS:
+                for location in (f"relative/{target}", os.path.join(self.root, "absolute", target)):
+                    with self.subTest(target=target, location=location):
+                        call_command("migrate_entries", target, location, batch_size=2, stdout=StringIO())
+                        copy = open_storage(target, location)
+                        self.assertEqual(sorted(copy.list_titles()), sorted(util.list_entries()))
+                        self.assertEqual(copy.read("Ünïcode"), "# Ünïcode")
+        finally:
+            os.chdir(cwd)
+
+
+class ImportEntriesTests(StorageTestCase):
+
+    def test_invalid_jsonl_lines_are_skipped(self):
+        self.use(SQLiteStorage(os.path.join(self.root, "entries.sqlite3")))
+        lines = [
+            {"title": "Python", "content": "# Python"},
+            {"title": "../escaped", "content": "x"},
+            {"title": "a/b", "content": "x"},
+            {"title": "a\\b", "content": "x"},
+            {"title": ".hidden", "content": "x"},
+            {"title": "", "content": "x"},
+            {"title": 5, "content": "x"},
+            [1, 2],
+            {"title": "Django", "content": "# Django"},
+        ]
+        path = os.path.join(self.root, "entries.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(json.dumps(line) + "\n" for line in lines)
+            f.write("not json\n")
+
+        out, err = StringIO(), StringIO()
+        call_command("import_entries", path, batch_size=2, workers=1, stdout=out, stderr=err)
+        self.assertEqual(sorted(util.list_entries()), ["Django", "Python"])
+        self.assertIn("Skipped 8 invalid entries.", out.getvalue())
+        self.assertIn("line 2: invalid title '../escaped'", err.getvalue())
+        self.assertIn("line 10: not an object", err.getvalue())
+
+    def test_invalid_archive_members_are_skipped(self):
+        self.use(SQLiteStorage(os.path.join(self.root, "entries.sqlite3")))
+        for name in ("entries.zip", "entries.tar.gz"):
+            with self.subTest(archive=name):
+                path = os.path.join(self.root, name)
+                with ArchiveWriter(path) as archive:
+                    for title in ("Python", ".hidden", "a\\b", ""):
+                        archive.write(title, "# " + title)
+                out, err = StringIO(), StringIO()
+                call_command("import_entries", path, workers=1, stdout=out, stderr=err)
+                self.assertEqual(util.list_entries(), ["Python"])
+                self.assertIn("Skipped 3 invalid entries.", out.getvalue())
+                self.assertIn("entries/.hidden.md: invalid title '.hidden'", err.getvalue())
+
+    def test_render_needs_a_shared_cache(self):
+        path = os.path.join(self.root, "entries.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps({"title": "Python", "content": "# Python"}) + "\n")
+        with self.assertRaisesMessage(CommandError, "--render needs a WIKI_RENDER_CACHE"):
+            call_command("import_entries", path, render=True, workers=1, stdout=StringIO())
+        self.assertFalse(rendering.DjangoRenderCache().shared)
+        self.assertTrue(rendering.FileRenderCache(os.path.join(self.root, "rendered")).shared)
+
+    def test_history_and_links_follow_imports(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        util.save_entry("Python", "# Python")
+        # written before history was kept
+        util.storage.write("Flask", "# Flask")
+        path = os.path.join(self.root, "entries.jsonl")
+        with open(path, "w", encoding="utf-8") as f:
+            for title, content in [("Python", "# Python\n\nSee [Django](/wiki/Django)."),
+                                   ("Flask", "Like [Django](/wiki/Django)."),
+                                   ("Django", "Written in [Python](/wiki/Python).")]:
+                f.write(json.dumps({"title": title, "content": content}) + "\n")
+
+        call_command("import_entries", path, workers=1, stdout=StringIO())
+        store = revisions.revision_store
+        self.assertEqual(len(store.history("Python")), 2)
+        self.assertEqual(store.get("Python", 1), "# Python")
+        self.assertEqual(store.get("Flask", 1), "# Flask")
+        self.assertEqual(store.get("Flask", 2), "Like [Django](/wiki/Django).")
+        self.assertEqual(len(store.history("Django")), 1)
+        self.assertEqual(links.link_graph.links_to("Django"), ["Flask", "Python"])
+        self.assertEqual(links.link_graph.links_to("Python"), ["Django"])
+
+
+class IncrementalRenderTests(SimpleTestCase):
+
+    documents = [
+        "# Title\n\nFirst *paragraph*.\n\nSecond one.\n",
+        "Intro\n\n- one\n- two\n\n  still two\n\n- three\n\nAfter the list.",
+        "Text\n\n```\ncode\n\nmore code\n```\n\n    indented\n\n    code\n\nEnd",
+        "> quoted\n\nplain\n\n> quoted\nlazy line\n\nswallowed\n",
+        "> quoted\n\n    indented\n\nnext\n\n1. one\n2. two\n\nHeading\n=======\n",
+        "See [the page][page].\n\n[page]: /wiki/Page\n\nMore.",
+        "A[^1] note.\n\n[^1]: The note.",
+        "<div>\n\nhtml\n\n</div>\n\ntext",
+        "1. first\n2. second\n\n***\n\nPara\n\n  * indented list\n\n- item\n\n"
+        "    continued para in item\n\n    def f():\n        return 1",
+        "",
+    ]
+
+    # pieces of the generated documents, joined by blank lines
+    pieces = [
+        "Para with *em* and `code`.", "# Heading", "## Sub\nText under it.", "***", "* * *",
+        "- a\n- b", "1. first\n2. second", "1) paren\n2) items", "- a\n\n- loose b",
+        "  * indented list", "   1. indented ordered", "- x\n  - nested",
+        "- item\n\n    continued para in item", "* item\n\n        code in item",
+        "+ plus\n\n  lazy", "-\titem with tab\n\n\tcontinued with tab",
+        "- item\n continuation one space", "10. ten\n11. eleven\n\n     continued",
+        "    def f():\n        return 1", "\tcode with tab", "Text\n\n    code after text",
+        "> quoted\n> more", "> quote\n\n> another", "```\nfenced\n```", "~~~\ntilde\n~~~",
+        "Line one\nline two", "Setext\n======", "Text  \nwith break", "- [link](http://x.y)", "   ",
+    ]
+
+    def test_output_matches_full_render(self):
+        for content in self.documents:
+            with self.subTest(content=content):
+                block_cache.clear()
+                self.assertEqual(render_markdown(content), markdown(content))
+                # again, from the block cache
+                self.assertEqual(render_markdown(content), markdown(content))
+
+    def test_generated_documents_match_full_render(self):
+        rng = random.Random(12)
+        split = 0
+        for _ in range(1000):
+            content = rng.choice(["\n\n", "\n\n\n"]).join(
+                rng.choice(self.pieces) for _ in range(rng.randint(2, 10)))
+            split += split_blocks(content) is not None
+            block_cache.clear()
+            self.assertEqual(render_markdown(content), markdown(content), content)
+        # enough of them went through the block by block render
+        self.assertGreater(split, 100)
+
+    def test_only_changed_blocks_are_rendered(self):
+        block_cache.clear()
+        content = "\n\n".join(f"Paragraph {i}." for i in range(10))
+        render_markdown(content)
+        cached = len(block_cache._items)
+        edited = content.replace("Paragraph 4.", "Paragraph four.")
+        self.assertEqual(render_markdown(edited), markdown(edited))
+        self.assertEqual(len(block_cache._items), cached + 1)
+        self.assertIsNone(split_blocks("[a]: /b\n\ntext"))
+
+
+class FileRenderCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def size(self):
+        return sum(os.path.getsize(os.path.join(self.directory, name)) for name in os.listdir(self.directory))
+
+    def test_directory_is_only_scanned_when_full(self):
+        cache = FileRenderCache(self.directory, max_bytes=10000)
+        html = "x" * 990
+        with mock.patch.object(cache, "_evict", wraps=cache._evict) as evict:
+            for i in range(9):
+                cache.set(f"Page {i}", "digest", html)
+                # the oldest were read last
+                os.utime(cache._path(f"Page {i}"), ns=(i, i))
+            self.assertEqual(evict.call_count, 1)
+            cache.set("Page 0", "digest", html + "x")
+            cache.delete("Page 8")
+            cache.set("Page 8", "digest", html)
+            self.assertEqual(evict.call_count, 1)
+            self.assertEqual(cache._total, self.size())
+
+            cache.set("Page 9", "digest", html)
+            cache.set("Page 10", "digest", html)
+            self.assertEqual(evict.call_count, 2)
+        self.assertEqual(cache.get("Page 1"), None)
+        self.assertEqual(cache.get("Page 10"), ("digest", html, len(html)))
+        self.assertEqual(cache._total, self.size())
+        self.assertLessEqual(cache._total, 10000)
+
+
+class SnapshotTests(StorageTestCase):
+
+    def test_build_and_update_on_save(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        util.save_entry("Python", "# Python\n\nA *language*.")
+        util.save_entry("Django", "Built with Python.")
+        directory = os.path.join(self.root, "snapshot")
+        os.makedirs(os.path.join(directory, "wiki"))
+        with open(os.path.join(directory, "wiki", "Gone.html"), "w") as f:
+            f.write("stale")
+
+        self.assertEqual(build_snapshot(directory, workers=2), 2)
+        with open(os.path.join(directory, "wiki", "Python.html"), encoding="utf-8") as f:
+            self.assertIn("<em>language</em>", f.read())
+        self.assertFalse(os.path.exists(os.path.join(directory, "wiki", "Gone.html")))
+        with open(os.path.join(directory, "search_index.json"), encoding="utf-8") as f:
+            self.assertIn("Django", json.load(f)["postings"]["python"])
+
+        with override_settings(WIKI_SNAPSHOT_DIR=directory, WIKI_SNAPSHOT_ON_SAVE=True):
+            util.save_entry("Flask", "Another *framework*.")
+        snapshot_search_indexes[directory].saver.flush()
+        with open(os.path.join(directory, "wiki", "Flask.html"), encoding="utf-8") as f:
+            self.assertIn("<em>framework</em>", f.read())
+        with open(os.path.join(directory, "index.html"), encoding="utf-8") as f:
+            self.assertIn("Flask", f.read())
+        with open(os.path.join(directory, "search_index.json"), encoding="utf-8") as f:
+            self.assertIn("Flask", json.load(f)["docs"])
+
+
+class LinkGraphTests(StorageTestCase):
+
+    def test_backlinks_follow_edits(self):
+        for storage in self.storages():
+            with self.subTest(storage=type(storage).__name__):
+                self.use(storage)
+                links.link_graph = graph = LinkGraph()
+                util.save_entry("Python", "See [Django](/wiki/Django) and [Flask](/wiki/Flask).")
+                util.save_entry("Django", "[Python](/wiki/Python), [Wikipedia](https://en.wikipedia.org/wiki/Django)")
+                util.save_entry("Home", "Start at <a href=\"/wiki/Python\">Python</a>.")
+                self.assertEqual(graph.links_to("Python"), ["Django", "Home"])
+                self.assertEqual(graph.links_to("Django"), ["Python"])
+                self.assertEqual(graph.orphans(), ["Home"])
+                self.assertEqual(graph.broken(), [("Python", "Flask")])
+
+                util.save_entry("Python", "No links [here](/wiki/Python).")
+                self.assertEqual(graph.links_to("Django"), [])
+                self.assertEqual(graph.broken(), [])
+                self.assertEqual(graph.orphans(), ["Django", "Home"])
+
+                rebuilt = LinkGraph()
+                rebuilt.rebuild(workers=2)
+                self.assertEqual(rebuilt.links, graph.links)
+                self.assertEqual(rebuilt.backlinks, graph.backlinks)
+
+
+    @override_settings(WIKI_INDEX_SAVE_DELAY=60)
+    def test_saves_are_deferred(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        graph = links.link_graph
+        graph.path = os.path.join(self.root, "link_graph.json")
+        self.assertEqual(graph.links_to("Python"), [])
+        for i in range(20):
+            util.save_entry(f"Page {i}", "[Python](/wiki/Python)")
+        self.assertEqual(len(graph.links_to("Python")), 20)
+        # nothing is written until the delay is over or the process exits
+        self.assertFalse(os.path.exists(graph.path))
+        graph.saver.flush()
+        with open(graph.path, encoding="utf-8") as f:
+            self.assertEqual(len(json.load(f)["links"]), 20)
+
+
+class RevisionTests(StorageTestCase):
+
+    def keyframes(self, title):
+        return [number for number, in revisions.revision_store._connection().execute(
+            "SELECT number FROM revisions WHERE title = ? AND keyframe ORDER BY number", (title,))]
+
+    def test_history_survives_compaction(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        store = revisions.revision_store
+        contents = []
+        for i in range(25):
+            # lines are added, changed and dropped along the way
+            lines = ["# Page\n"] + [f"Line {j} of edit {i if j % 3 == 0 else 0}\n" for j in range(i % 7, i + 3)]
+            contents.append("".join(lines))
+            util.save_entry("Page", contents[-1])
+        history = store.history("Page")
+        self.assertEqual([number for number, _, _ in history], list(range(25, 0, -1)))
+        self.assertEqual(self.keyframes("Page"), [1, 11, 21])
+        for number, content in enumerate(contents, 1):
+            self.assertEqual(store.get("Page", number), content)
+        self.assertIsNone(store.get("Page", 26))
+        self.assertIn("+Line 3 of edit 23", store.diff("Page", 23, 24))
+
+        call_command("compact_revisions", "Page", interval=4, stdout=StringIO())
+        self.assertEqual(self.keyframes("Page"), list(range(1, 26, 4)))
+        call_command("compact_revisions", stdout=StringIO())
+        self.assertEqual(self.keyframes("Page"), [1, 11, 21])
+        self.assertEqual(store.history("Page"), history)
+        for number, content in enumerate(contents, 1):
+            self.assertEqual(store.get("Page", number), content)
+
+    def test_history_page_lists_every_save(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        for i in range(3):
+            util.save_entry("Page", f"# Page\n\nEdit {i}.\n" + "x" * i)
+        response = self.client.get("/wiki/Page/history")
+        self.assertEqual([revision["number"] for revision in response.context["revisions"]], [3, 2, 1])
+        self.assertEqual([revision["size"] for revision in response.context["revisions"]], [18, 17, 16])
+        for number in range(1, 4):
+            self.assertContains(response, f'href="/wiki/Page/revision/{number}"')
+        self.assertRedirects(self.client.get("/wiki/Missing/history"), "/", fetch_redirect_response=False)
+
+    def test_revision_page(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        util.save_entry("Page", "# Page\n\nFirst.")
+        util.save_entry("Page", "# Page\n\nSecond.")
+        response = self.client.get("/wiki/Page/revision/1")
+        self.assertContains(response, "<p>First.</p>")
+        self.assertNotContains(response, "Second.")
+        self.assertRedirects(self.client.get("/wiki/Page/revision/3"), "/", fetch_redirect_response=False)
+        self.assertRedirects(self.client.get("/wiki/Missing/revision/1"), "/", fetch_redirect_response=False)
+
+    def test_diff_across_a_keyframe(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        for i in range(1, 15):
+            util.save_entry("Page", "".join(f"Line {j}\n" for j in range(i)))
+        self.assertEqual(self.keyframes("Page"), [1, 11])
+        # revision 9 is rebuilt from keyframe 1, revision 12 from keyframe 11
+        response = self.client.get("/wiki/Page/diff", {"from": 9, "to": 12})
+        self.assertEqual(response.context["lines"],
+                         revisions.revision_store.diff("Page", 9, 12).splitlines())
+        self.assertContains(response, '<span class=""> Line 8</span>')
+        self.assertContains(response, '<span class="diff_add">+Line 9</span>')
+        self.assertContains(response, '<span class="diff_add">+Line 11</span>')
+        self.assertNotContains(response, "+Line 12")
+        self.assertContains(self.client.get("/wiki/Page/diff", {"from": 12, "to": 12}),
+                            "The revisions are identical.")
+        self.assertRedirects(self.client.get("/wiki/Page/diff", {"from": 9, "to": 15}),
+                             "/wiki/Page/history", fetch_redirect_response=False)
+        self.assertRedirects(self.client.get("/wiki/Page/diff", {"from": 9}),
+                             "/wiki/Page/history", fetch_redirect_response=False)
+
+
+class RandomPickerTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        self.addCleanup(setattr, picker, "random_picker", picker.random_picker)
+        picker.random_picker = RandomPicker()
+
+    def test_picks_follow_saves_and_removals(self):
+        for title in ("A", "B", "C"):
+            util.save_entry(title, title)
+        self.assertIn(picker.random_picker.pick(), ["A", "B", "C"])
+        util.storage.delete("B")
+        picks = {picker.random_picker.pick() for _ in range(200)}
+        self.assertEqual(picks, {"A", "C"})
+
+    def test_recent_weights_scan_the_storage_once(self):
+        for i in range(10):
+            util.save_entry(f"Old {i}", "old")
+            # saved a year ago, by another process
+            path = os.path.join(self.root, "flat", f"Old {i}.md")
+            os.utime(path, ns=(time.time_ns(), time.time_ns() - 365 * 24 * 3600 * 10**9))
+        random_picker = picker.random_picker = RandomPicker()
+
+        with mock.patch.object(util.storage, "iter_stats", wraps=util.storage.iter_stats) as iter_stats:
+            self.assertTrue(random_picker.pick("recent").startswith("Old"))
+            util.save_entry("New", "new")
+            # a table is rebuilt after every save, from the mtimes kept
+            picks = [random_picker.pick("recent") for _ in range(1000)]
+        self.assertEqual(iter_stats.call_count, 1)
+        self.assertGreater(picks.count("New"), 800)
+
+
+class EntryIndexTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        # its signature moves on every added entry, however close together
+        self.use(SQLiteStorage(os.path.join(self.root, "entries.sqlite3")))
+
+    def test_pages_and_initials(self):
+        titles = ["Apple", "Avocado", "Banana", "Cherry", "cherry", "Date", "Émile"]
+        util.storage.write_many([(title, title) for title in titles])
+        index = util.entry_index
+        self.assertEqual(index.page(limit=3), (["Apple", "Avocado", "Banana"], False, True))
+        self.assertEqual(index.page(after="Banana", limit=3), (["Cherry", "Date", "cherry"], True, True))
+        self.assertEqual(index.page(before="Cherry", limit=3), (["Apple", "Avocado", "Banana"], False, True))
+        self.assertEqual(index.page(start="D", limit=3), (["Date", "cherry", "Émile"], True, False))
+        self.assertEqual(index.page(after="Émile"), ([], True, False))
+        self.assertEqual(index.initials(), ["A", "B", "C", "D", "c", "É"])
+
+    def test_own_saves_are_added_without_listing(self):
+        util.save_entry("Apple", "apple")
+        self.assertEqual(util.list_entries(), ["Apple"])
+        with mock.patch.object(util.storage, "list_titles", wraps=util.storage.list_titles) as list_titles:
+            util.save_entry("Banana", "banana")
+            self.assertEqual(util.list_entries(), ["Apple", "Banana"])
+            self.assertEqual(list_titles.call_count, 0)
+
+            # another process adds an entry right before this one saves
+            util.storage.write("Cherry", "cherry")
+            util.save_entry("Date", "date")
+            self.assertEqual(util.list_entries(), ["Apple", "Banana", "Cherry", "Date"])
+            self.assertEqual(list_titles.call_count, 1)
+
+
+class TitleIndexTests(StorageTestCase):
+
+    def test_substrings_of_any_length(self):
+        self.use(SQLiteStorage(os.path.join(self.root, "entries.sqlite3")))
+        titles = ["Python", "CPython", "Jython", "HTML", "Ｐｙ", "Café", "علی", "Go", "Gone"]
+        util.storage.write_many([(title, "") for title in titles])
+        util.storage.delete("Gone")
+        index = TitleIndex()
+        for query in ["", "p", "Y", "py", "th", "ytho", "é", "fé", "علي", "g", "gon", "x", "xy"]:
+            with self.subTest(query=query):
+                key = fold(query)
+                expected = sorted(title for title in titles[:-1] if key in fold(title))
+                self.assertEqual(index.find_substring(query), expected)
+        self.assertEqual(index.find_substring("y", limit=2), ["CPython", "Jython"])
+
+    def test_exact_matches_ignore_case(self):
+        self.use(SQLiteStorage(os.path.join(self.root, "entries.sqlite3")))
+        util.storage.write_many([(title, "") for title in ["Python", "PYTHON", "Café", "علی"]])
+        index = TitleIndex()
+        self.assertEqual(index.find_exact("PYTHON"), "PYTHON")
+        self.assertEqual(index.find_exact("Python"), "Python")
+        self.assertIn(index.find_exact("python"), ["Python", "PYTHON"])
+        self.assertEqual(index.find_exact("CAFÉ"), "Café")
+        self.assertEqual(index.find_exact("علي"), "علی")
+        self.assertIsNone(index.find_exact("Pyth"))
+
+    def test_short_queries_use_their_own_postings(self):
+        self.use(SQLiteStorage(os.path.join(self.root, "entries.sqlite3")))
+        util.storage.write_many([(title, "") for title in ["Go", "Gone", "Django", "C"]])
+        index = TitleIndex()
+        index.find_substring("")
+        self.assertEqual(len(index.short_postings["go"]), 3)
+        self.assertEqual(len(index.short_postings["c"]), 1)
+        # the trigram postings are not needed for queries under three characters
+        index.postings.clear()
+        self.assertEqual(index.find_substring("GO"), ["Django", "Go", "Gone"])
+        self.assertEqual(index.find_substring("c"), ["C"])
+        self.assertEqual(index.find_substring("x"), [])
+        # removed ids stay in the postings and are skipped
+        index.remove("Gone")
+        self.assertEqual(index.find_substring("go"), ["Django", "Go"])
+        self.assertEqual(index.find_substring("e"), [])
+
+    def test_suggestions_for_misspelled_queries(self):
+        self.use(SQLiteStorage(os.path.join(self.root, "entries.sqlite3")))
+        titles = ["Python", "Pythagoras", "Django", "JavaScript", "Java", "HTML"]
+        util.storage.write_many([(title, "") for title in titles])
+        index = TitleIndex()
+        self.assertEqual(index.suggest("Pyhton")[0], "Python")
+        self.assertEqual(index.suggest("javascrpt")[0], "JavaScript")
+        self.assertEqual(index.suggest("Djnago", limit=1), ["Django"])
+        # closer titles rank first, and nothing unlike the query is suggested
+        self.assertEqual(index.suggest("Pythagora"), ["Pythagoras", "Python"])
+        self.assertEqual(index.suggest("jav"), ["Java"])
+        self.assertEqual(index.suggest("zzzz"), [])
+
+
+class SearchTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+
+    def test_results_are_ranked_with_bm25(self):
+        util.save_entry("Zoo", "Lions and tigers.")
+        util.save_entry("Feeding", "Tigers eat meat. Tigers sleep. " + "Other words here. " * 20)
+        util.save_entry("Stripes", "Tigers have stripes. Tigers hunt alone. Tigers swim.")
+        util.save_entry("Tigers", "The big cats.")
+        # the title counts three times, shorter bodies weigh more
+        self.assertEqual([result["title"] for result in search_index.search("tigers")],
+                         ["Tigers", "Stripes", "Zoo", "Feeding"])
+        # a rare term weighs more than a common one
+        self.assertEqual(search_index.search("lions tigers")[0]["title"], "Zoo")
+
+    def test_body_matches_are_found_through_the_search_page(self):
+        util.save_entry("Python", "A language named after Monty Python.")
+        util.save_entry("Django", "A web framework, written in Python, released in 2005.")
+        response = self.client.get("/search", {"q": "framework"})
+        self.assertContains(response, "/wiki/Django")
+        self.assertContains(response, "A web framework, written in Python, released in 2005.")
+        self.assertNotContains(response, "/wiki/Python")
+
+    def test_snippets_are_made_from_the_index(self):
+        util.save_entry("Short", "Intro. The keyword is here.")
+        util.save_entry("Long", "Filler text. " * 200 + "The keyword comes late, after the excerpt.")
+        with mock.patch.object(util, "get_entry", wraps=util.get_entry) as get_entry:
+            results = {result["title"]: result["snippet"] for result in search_index.search("keyword")}
+        self.assertEqual(results["Short"], "Intro. The keyword is here.")
+        self.assertTrue(results["Long"].startswith("..."))
+        self.assertTrue(results["Long"].endswith("The keyword comes late, after the excerpt."))
+        # only the entry whose match is past the excerpt is read
+        self.assertEqual([call.args for call in get_entry.call_args_list], [("Long",)])
+
+
+class AutocompleteTests(StorageTestCase):
+
+    def test_prefix_matches_are_cacheable(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        for title in ("Python", "PyPy", "pytest", "Django"):
+            util.save_entry(title, f"# {title}")
+
+        response = self.client.get("/autocomplete", {"q": "py"})
+        self.assertEqual(response.json()["results"], ["PyPy", "pytest", "Python"])
+        self.assertIn("public", response["Cache-Control"])
+        self.assertIn("max-age", response["Cache-Control"])
+        cached = self.client.get("/autocomplete", {"q": "py"}, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(cached.status_code, 304)
+
+        util.save_entry("Pyramid", "# Pyramid")
+        response = self.client.get("/autocomplete", {"q": "PYR", "limit": 1})
+        self.assertEqual(response.json()["results"], ["Pyramid"])
+
+
+class ConditionalGetTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        util.save_entry("Python", "# Python")
+
+    def test_pages_are_revalidated(self):
+        for url in ("/", "/wiki/Python"):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIn("no-cache", response["Cache-Control"])
+                self.assertIn("private", response["Cache-Control"])
+                self.assertIn("Last-Modified", response)
+                cached = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+                self.assertEqual(cached.status_code, 304)
+                self.assertIn("no-cache", cached["Cache-Control"])
+                cached = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+                self.assertEqual(cached.status_code, 304)
+
+        etag = self.client.get("/wiki/Python")["ETag"]
+        util.save_entry("Python", "# Python\n\nEdited.")
+        self.assertEqual(self.client.get("/wiki/Python", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_pending_messages_are_never_answered_with_304(self):
+        etag = self.client.get("/wiki/Python")["ETag"]
+        # a message waits for the next page once the redirect is followed
+        self.client.post("/newpage", {"title": "Python", "text": "again"})
+        response = self.client.get("/wiki/Python", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, "already exists")
+        self.assertEqual(self.client.get("/wiki/Python", HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class TimingTests(StorageTestCase):
+
+    def test_stages_are_reported(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        util.save_entry("Python", "# Python\n\nA *language*.")
+
+        response = self.client.get("/wiki/Python")
+        stages = dict(part.split(";dur=") for part in response["Server-Timing"].split(", "))
+        # the render cache was warmed when the entry was saved
+        self.assertLessEqual({"storage", "template", "total"}, set(stages))
+        self.assertNotIn("markdown", stages)
+
+        with override_settings(DEBUG=True):
+            report = self.client.get("/timings").json()
+        self.assertGreaterEqual(report["encyclopedia:article"]["total"]["count"], 1)
+
+    def test_report_is_for_staff_only(self):
+        self.assertEqual(self.client.get("/timings").status_code, 404)
+        request = RequestFactory().get("/timings")
+        request.user = mock.Mock(is_staff=False)
+        with self.assertRaises(Http404):
+            views.timings(request)
+        request.user = mock.Mock(is_staff=True)
+        self.assertEqual(views.timings(request).status_code, 200)
+
+    def test_slow_requests_are_sampled(self):
+        sampler = SlowRequestSampler(slow_ms=5, interval_ms=1, directory=self.root)
+        sampler.begin()
+        self.assertIsNone(sampler.end("fast"))
+
+        sampler.begin()
+        deadline = time.perf_counter() + 0.1
+        while time.perf_counter() < deadline:
+            pass
+        path = sampler.end("slow")
+        with open(path, encoding="utf-8") as f:
+            self.assertIn("test_slow_requests_are_sampled", f.read())
+
+
+class AsyncViewTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        util.save_entry("Python", "# Python\n\nA *language*.")
+        util.save_entry("Django", "# Django\n\nWritten in [Python](/wiki/Python).")
+
+    async def test_read_views(self):
+        with url_mode(True):
+            response = await self.async_client.get("/wiki/Python")
+            self.assertContains(response, "<em>language</em>")
+            self.assertContains(response, "Django")
+            self.assertIn("storage", response["Server-Timing"])
+
+            response = await self.async_client.get("/wiki/Python", headers={"if-none-match": response["ETag"]})
+            self.assertEqual(response.status_code, 304)
+
+            response = await self.async_client.get("/")
+            self.assertContains(response, "Django")
+            response = await self.async_client.get("/", {"stream": 1})
+            self.assertIn("Python", b"".join([chunk async for chunk in response]).decode())
+
+            response = await self.async_client.post("/search", {"q": "python"})
+            self.assertRedirects(response, "/wiki/Python", fetch_redirect_response=False)
+            response = await self.async_client.get("/random")
+            self.assertIn(response.url, ("/wiki/Python", "/wiki/Django"))
+
+
+@override_settings(WIKI_LARGE_ENTRY_BYTES=10_000)
+class LargeEntryTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        self.content = "\n\n".join(
+            f"## Part {i}\n\nSome *text* about é {i}.\n\n- one\n- two\n\n> quoted\n\n    code {i}"
+            for i in range(500))
+        util.save_entry("Large", self.content)
+        util.save_entry("Small", "# Small")
+
+    def test_only_large_entries_are_mapped(self):
+        with mock.patch.object(util.storage, "open_mapped") as open_mapped:
+            self.assertIsNone(util.open_large_entry("Small"))
+            self.assertIsNone(util.open_large_entry("Missing"))
+        open_mapped.assert_not_called()
+        with util.open_large_entry("Large") as entry:
+            self.assertEqual(entry.read(), self.content)
+            self.assertEqual(list(entry.lines()), self.content.split("\n"))
+            self.assertEqual(entry.digest(), rendering.content_hash(self.content))
+
+    def test_streamed_render_matches_full_render(self):
+        for cached in (True, False):
+            with self.subTest(cached=cached):
+                if not cached:
+                    rendering.render_cache.delete("Large")
+                response = self.client.get("/wiki/Large")
+                self.assertTrue(response.streaming)
+                html = b"".join(response.streaming_content).decode()
+                self.assertIn(render_markdown(self.content), html)
+                self.assertIn("Edit Page", html)
+
+    async def test_async_view_streams(self):
+        with url_mode(True):
+            response = await self.async_client.get("/wiki/Large")
+            html = b"".join([chunk async for chunk in response]).decode()
+        self.assertIn(render_markdown(self.content), html)
+
+
+class CompressionTests(StorageTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.settings = {"FORMAT": "zlib", "DICTIONARY": os.path.join(self.root, "entries.dict")}
+        self.texts = {f"Entry {i}": f"# Entry {i}\n\nThe wiki entry number {i} is about é and Markdown, written by the editors of the wiki.\n"
+                      for i in range(50)}
+
+    def test_plain_and_compressed_entries_are_read(self):
+        for storage in self.storages():
+            with self.subTest(storage=type(storage).__name__):
+                self.use(storage)
+                util.save_entry("Plain", "# Plain\n\n" + "text " * 100)
+                with override_settings(WIKI_ENTRY_COMPRESSION=self.settings):
+                    util.save_entry("Packed", "# Packed\n\n" + "text " * 100)
+                    self.assertEqual(util.get_entry("Plain"), "# Plain\n\n" + "text " * 100)
+                self.assertEqual(util.get_entry("Packed"), "# Packed\n\n" + "text " * 100)
+                if not isinstance(storage, SQLiteStorage):
+                    self.assertLess(util.entry_stat("Packed").size, util.entry_stat("Plain").size)
+
+    def test_old_dictionaries_stay_readable(self):
+        self.use(ShardedFileStorage(os.path.join(self.root, "sharded")))
+        with override_settings(WIKI_ENTRY_COMPRESSION=self.settings):
+            dictionaries.install(train_dictionary(self.texts.values()))
+            util.save_entry("Entry 0", self.texts["Entry 0"])
+            with open(util.storage._path("Entry 0"), "rb") as f:
+                self.assertTrue(is_compressed(f.read()))
+            dictionaries.install(train_dictionary(["other words " * 20] * 3))
+            self.assertEqual(util.get_entry("Entry 0"), self.texts["Entry 0"])
+
+            call_command("compress_entries", "--train", stdout=StringIO())
+            self.assertEqual(util.get_entry("Entry 0"), self.texts["Entry 0"])
+
+    def test_dictionary_is_read_once_until_it_changes(self):
+        self.use(ShardedFileStorage(os.path.join(self.root, "sharded")))
+        path = self.settings["DICTIONARY"]
+        with override_settings(WIKI_ENTRY_COMPRESSION=self.settings):
+            ident = dictionaries.install(train_dictionary(self.texts.values()))
+            with mock.patch("builtins.open", wraps=open) as opened:
+                for title, text in self.texts.items():
+                    util.save_entry(title, text)
+                self.assertEqual(dictionaries.current()[0], ident)
+            self.assertEqual([call for call in opened.call_args_list if call.args[0] == path],
+                             [mock.call(path, "rb")])
+            # a dictionary replaced behind our back is read again
+            with open(path, "wb") as f:
+                f.write(b"other words " * 20)
+            self.assertNotEqual(dictionaries.current()[0], ident)
+            self.assertEqual(util.get_entry("Entry 0"), self.texts["Entry 0"])
+
+    def test_edits_during_a_rewrite_are_kept(self):
+        for storage in self.storages():
+            if isinstance(storage, SQLiteStorage):
+                continue
+            with self.subTest(storage=type(storage).__name__):
+                self.use(storage)
+                for title, text in self.texts.items():
+                    util.save_entry(title, text)
+                read = storage.read
+
+                def read_then_edit(title):
+                    # someone saves the entry right after the command read it
+                    content = read(title)
+                    if title == "Entry 3":
+                        util.save_entry(title, "edited")
+                    return content
+
+                storage.read = read_then_edit
+                before = {title: storage.stat(title) for title in self.texts}
+                out = StringIO()
+                with override_settings(WIKI_ENTRY_COMPRESSION=self.settings):
+                    call_command("compress_entries", batch_size=20, stdout=out)
+                self.assertEqual(util.get_entry("Entry 3"), "edited")
+                self.assertEqual(util.get_entry("Entry 4"), self.texts["Entry 4"])
+                # rewritten entries keep their mtime, the edited one has its own
+                self.assertEqual(dict(storage.iter_stats()),
+                                 {**{title: st.mtime_ns for title, st in before.items()},
+                                  "Entry 3": storage.stat("Entry 3").mtime_ns})
+                self.assertGreater(storage.stat("Entry 3").mtime_ns, before["Entry 3"].mtime_ns)
+                self.assertIn("Rewrote 49 entries", out.getvalue())
+                self.assertIn("Left 1 entries edited", out.getvalue())
+
+    def test_articles_are_served_gzipped(self):
+        os.makedirs(os.path.join(self.root, "flat"))
+        self.use(FlatFileStorage("flat", location=self.root))
+        content = "# Python\n\n" + "\n\n".join(f"Paragraph *{i}*." for i in range(200))
+        util.save_entry("Python", content)
+
+        plain = self.client.get("/wiki/Python")
+        for _ in range(2):
+            response = self.client.get("/wiki/Python", headers={"accept-encoding": "gzip, br"})
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertIn(render_markdown(content), gzip.decompress(response.content).decode())
+        self.assertNotEqual(response["ETag"], plain["ETag"])
+        self.assertIn("Accept-Encoding", response["Vary"])
+
+
+class BenchmarkTests(StorageTestCase):
+
+    def test_results_are_written_as_json(self):
+        output = os.path.join(self.root, "results.json")
+        call_command("bench_wiki", entries=40, words=50, languages="en,fa,zh", iterations=5,
+                     clients=2, requests=60, concurrency=20, io_delay=1, output=output,
+                     stdout=StringIO())
+        with open(output, encoding="utf-8") as f:
+            results = json.load(f)
+        self.assertIn("get_entry", results["micro"])
+        self.assertGreater(results["load"]["throughput"], 0)
+        self.assertEqual(sum(view["errors"] for view in results["load"]["views"].values()), 0)
+        self.assertEqual([results["modes"][mode]["errors"] for mode in ("wsgi", "asgi")], [0, 0])
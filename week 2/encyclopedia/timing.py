@@ -0,0 +1,272 @@
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.shortcuts import render as render_template
+
+# stage name -> nanoseconds spent in it, for the request being handled
+_timings = ContextVar("wiki_timings", default=None)
+
+# histogram buckets grow by this factor, so percentiles are within ~9%
+BUCKET_GROWTH = 2 ** 0.25
+
+# the smallest bucket, in milliseconds
+BUCKET_FLOOR = 0.001
+
+# frames kept from the top of a sampled stack
+MAX_STACK_DEPTH = 100
+
+
+def timing_settings():
+    return getattr(settings, "WIKI_TIMING", {})
+
+
+class stage:
+    """
+    Context manager adding the time spent in its block to a stage of
+    the current request. Outside a timed request it only looks up the
+    context variable.
+    """
+
+    __slots__ = ("name", "timings", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.timings = _timings.get()
+        if self.timings is not None:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            elapsed = time.perf_counter_ns() - self.start
+            self.timings[self.name] = self.timings.get(self.name, 0) + elapsed
+
+
+def render(*args, **kwargs):
+    '''
+    django.shortcuts.render, timed as the "template" stage.
+    '''
+    with stage("template"):
+        return render_template(*args, **kwargs)
+
+
+class Histogram:
+    """
+    Counts of durations in log-spaced buckets, so any percentile can be
+    read back in constant memory.
+    """
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, ms):
+        bucket = 0 if ms <= BUCKET_FLOOR else math.ceil(math.log(ms / BUCKET_FLOOR, BUCKET_GROWTH))
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.max = max(self.max, ms)
+
+    def percentile(self, p):
+        '''
+        Returns the upper bound in ms of the bucket holding the p-th
+        percentile, or 0 if nothing was recorded.
+        '''
+        rank = math.ceil(self.count * p / 100)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(BUCKET_FLOOR * BUCKET_GROWTH ** bucket, self.max)
+        return 0.0
+
+
+class TimingStats:
+    """
+    Per view and stage histograms of the requests handled by this process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # (view name, stage) -> Histogram
+        self.histograms = {}
+
+    def record(self, view, timings):
+        with self._lock:
+            for name, ms in timings.items():
+                histogram = self.histograms.get((view, name))
+                if histogram is None:
+                    histogram = self.histograms[(view, name)] = Histogram()
+                histogram.record(ms)
+
+    def report(self):
+        '''
+        Returns {view: {stage: {"count", "p50", "p95", "p99", "max"}}},
+        durations in ms.
+        '''
+        with self._lock:
+            report = {}
+            for (view, name), histogram in sorted(self.histograms.items()):
+                report.setdefault(view, {})[name] = {
+                    "count": histogram.count,
+                    "p50": round(histogram.percentile(50), 3),
+                    "p95": round(histogram.percentile(95), 3),
+                    "p99": round(histogram.percentile(99), 3),
+                    "max": round(histogram.max, 3),
+                }
+            return report
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+
+
+timing_stats = TimingStats()
+
+
+def collapse(frame):
+    '''
+    Returns a stack in the collapsed format of flame graph tools,
+    "file:function;file:function" from the outermost call in.
+    '''
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class SlowRequestSampler:
+    """
+    Samples the stacks of requests once they have run for longer than
+    slow_ms, every interval_ms, from one background thread. Requests
+    that finish sooner are never sampled. The stacks of a sampled
+    request are written in collapsed format to directory.
+    """
+
+    def __init__(self, slow_ms, interval_ms=1, directory="profiles"):
+        self.slow = slow_ms / 1000
+        self.interval = interval_ms / 1000
+        self.directory = directory
+        self._lock = threading.Lock()
+        # thread id -> (start time, stack counts)
+        self.active = {}
+        self._thread = None
+
+    def begin(self):
+        with self._lock:
+            self.active[threading.get_ident()] = (time.perf_counter(), Counter())
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wiki-sampler", daemon=True)
+                self._thread.start()
+
+    def end(self, name):
+        '''
+        Stops following the current thread. Returns the path the stacks
+        were written to, or None if the request was not sampled.
+        '''
+        with self._lock:
+            _, stacks = self.active.pop(threading.get_ident(), (None, None))
+        if not stacks:
+            return None
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{time.time_ns()}-{name.replace(':', '-')}.folded")
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return path
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            now = time.perf_counter()
+            with self._lock:
+                slow = [(ident, stacks) for ident, (start, stacks) in self.active.items()
+                        if now - start >= self.slow]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for ident, stacks in slow:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[collapse(frame)] += 1
+
+
+class TimingMiddleware:
+    """
+    Times the stages of every request to an encyclopedia view, sends
+    them in a Server-Timing header and adds them to timing_stats. With
+    WIKI_TIMING["SAMPLE_SLOW_MS"] set, slow requests are also profiled;
+    the sampler follows threads, so it is skipped under ASGI where one
+    thread runs every request.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = timing_settings()
+        if not config.get("ENABLED", True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+        self.sampler = None
+        if config.get("SAMPLE_SLOW_MS") is not None:
+            self.sampler = SlowRequestSampler(
+                config["SAMPLE_SLOW_MS"], config.get("SAMPLE_INTERVAL_MS", 1),
+                config.get("PROFILE_DIR", os.path.join(settings.BASE_DIR, "profiles")))
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timings = {}
+        token = _timings.set(timings)
+        if self.sampler:
+            self.sampler.begin()
+        start = time.perf_counter_ns()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.perf_counter_ns() - start
+            _timings.reset(token)
+            if self.sampler:
+                match = request.resolver_match
+                self.sampler.end(match.view_name if match is not None else "unresolved")
+        return self.finish(request, response, timings, total)
+
+    async def __acall__(self, request):
+        timings = {}
+        token = _timings.set(timings)
+        start = time.perf_counter_ns()
+        try:
+            response = await self.get_response(request)
+        finally:
+            total = time.perf_counter_ns() - start
+            _timings.reset(token)
+        return self.finish(request, response, timings, total)
+
+    def finish(self, request, response, timings, total):
+        match = request.resolver_match
+        if match is None or match.app_name != "encyclopedia":
+            return response
+
+        view = match.view_name
+        stages = {name: ns / 1e6 for name, ns in timings.items()}
+        stages["total"] = total / 1e6
+        timing_stats.record(view, stages)
+        response["Server-Timing"] = ", ".join(
+            f"{name};dur={ms:.3f}" for name, ms in stages.items())
+        return response
@@ -0,0 +1,317 @@
+import heapq
+import threading
+import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right
+from difflib import SequenceMatcher
+
+from django.dispatch import receiver
+
+from . import util
+from .signals import entry_saved
+
+# Arabic letters that Persian keyboards type differently, folded so
+# that "علي" and "علی" find the same page
+PERSIAN_FOLD = str.maketrans({"ي": "ی", "ى": "ی", "ك": "ک", "ة": "ه"})
+
+# queries shorter than this use the unigram and bigram postings
+GRAM = 3
+
+# stop counting trigram hits for suggestions after this many postings
+SUGGEST_BUDGET = 50000
+
+# candidates with the most shared trigrams that are compared in full
+SUGGEST_CANDIDATES = 50
+
+# more changed titles than this and the prefix index sorts all names again
+PREFIX_REBUILD = 1000
+
+
+def fold(text):
+    '''
+    Returns the form of a title or query used for matching:
+    NFKC-normalised, casefolded and with Arabic/Persian variants unified.
+    '''
+    return unicodedata.normalize("NFKC", text).casefold().translate(PERSIAN_FOLD)
+
+
+def grams(text):
+    return {text[i:i + GRAM] for i in range(len(text) - GRAM + 1)}
+
+
+def padded_grams(text):
+    return grams(f"  {text} ")
+
+
+def short_grams(text):
+    return {text[i:i + n] for n in range(1, GRAM) for i in range(len(text) - n + 1)}
+
+
+class TitleIndex:
+    """
+    Lookup structure over entry titles for the search view:
+
+    - a dict from folded title to titles for exact matches,
+    - trigram posting lists (arrays of title ids) for substring queries,
+      and unigram and bigram ones for queries shorter than a trigram,
+    - the same posting lists over padded titles for "did you mean"
+      suggestions ranked by trigram similarity.
+
+    Titles are added and removed one at a time; removed ids are left in
+    the posting lists and skipped on lookup.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._signature = None
+        self._built = False
+        self.titles = []
+        self.folded = []
+        self.gram_counts = array("H")
+        self.ids = {}
+        self.exact = {}
+        self.postings = {}
+        self.short_postings = {}
+
+    def add(self, title):
+        with self._lock:
+            if title in self.ids:
+                return
+            key = fold(title)
+            title_id = len(self.titles)
+            self.titles.append(title)
+            self.folded.append(key)
+            self.ids[title] = title_id
+            self.exact.setdefault(key, []).append(title)
+            padded = padded_grams(key)
+            self.gram_counts.append(min(len(padded), 0xFFFF))
+            # the padded trigrams include every trigram of the title itself
+            for gram in padded:
+                posting = self.postings.get(gram)
+                if posting is None:
+                    posting = self.postings[gram] = array("I")
+                posting.append(title_id)
+            for gram in short_grams(key):
+                posting = self.short_postings.get(gram)
+                if posting is None:
+                    posting = self.short_postings[gram] = array("I")
+                posting.append(title_id)
+
+    def remove(self, title):
+        with self._lock:
+            title_id = self.ids.pop(title, None)
+            if title_id is None:
+                return
+            key = self.folded[title_id]
+            self.exact[key].remove(title)
+            if not self.exact[key]:
+                del self.exact[key]
+            self.titles[title_id] = None
+            self.folded[title_id] = None
+
+    def saved(self, title):
+        '''
+        Records a title written by this process.
+        '''
+        with self._lock:
+            if self._built:
+                self.add(title)
+                self._signature = util.entries_signature()
+
+    def _refresh(self):
+        '''
+        Brings the index in line with util.entry_index, adding and
+        removing only the titles that changed.
+        '''
+        signature = util.entries_signature()
+        if self._built and signature is not None and signature == self._signature:
+            return
+        with self._lock:
+            names = set(util.entry_index.names())
+            for title in set(self.ids) - names:
+                self.remove(title)
+            for title in names - set(self.ids):
+                self.add(title)
+            self._signature = signature
+            self._built = True
+
+    def find_exact(self, query):
+        '''
+        Returns the title matching query case-insensitively, or None.
+        A title matching with the exact case wins over others.
+        '''
+        self._refresh()
+        matches = self.exact.get(fold(query), [])
+        if query in matches:
+            return query
+        return matches[0] if matches else None
+
+    def find_substring(self, query, limit=None):
+        '''
+        Returns sorted titles containing query, case-insensitively,
+        at most limit of them if limit is given.
+        '''
+        self._refresh()
+        key = fold(query)
+        with self._lock:
+            if not key:
+                found = [title for title in self.titles if title is not None]
+            elif len(key) < GRAM:
+                # every title in the posting contains the query
+                found = [self.titles[title_id] for title_id in self.short_postings.get(key, ())
+                         if self.titles[title_id] is not None]
+            else:
+                postings = [self.postings.get(gram) for gram in grams(key)]
+                if not all(postings):
+                    return []
+                # verify the candidates of the rarest trigram
+                shortest = min(postings, key=len)
+                found = []
+                for title_id in set(shortest):
+                    folded = self.folded[title_id]
+                    if folded is not None and key in folded:
+                        found.append(self.titles[title_id])
+        if limit:
+            return heapq.nsmallest(limit, found)
+        return sorted(found)
+
+    def find_contained(self, query, max_length=64):
+        '''
+        Returns sorted titles that appear inside query, e.g. "Python"
+        for the query "python tutorial".
+        '''
+        self._refresh()
+        key = fold(query)[:max_length]
+        found = set()
+        for start in range(len(key)):
+            for stop in range(start + 1, len(key) + 1):
+                found.update(self.exact.get(key[start:stop], ()))
+        return sorted(found)
+
+    def suggest(self, query, limit=5, threshold=0.6):
+        '''
+        Returns up to limit titles that look like query, for "did you
+        mean" links, best first. Titles sharing the most trigrams with
+        the query are picked first, then ranked by edit similarity.
+        '''
+        self._refresh()
+        key = fold(query)
+        query_grams = padded_grams(key)
+        with self._lock:
+            hits = {}
+            budget = SUGGEST_BUDGET
+            # rare trigrams first, they say the most about the query
+            for posting in sorted(filter(None, map(self.postings.get, query_grams)), key=len):
+                if budget <= 0:
+                    break
+                budget -= len(posting)
+                for title_id in posting:
+                    hits[title_id] = hits.get(title_id, 0) + 1
+            candidates = heapq.nlargest(SUGGEST_CANDIDATES, hits.items(), key=lambda item: item[1])
+            scored = []
+            for title_id, _ in candidates:
+                folded = self.folded[title_id]
+                if folded is None:
+                    continue
+                score = SequenceMatcher(None, key, folded).ratio()
+                if score >= threshold:
+                    scored.append((score, self.titles[title_id]))
+        return [title for _, title in heapq.nlargest(limit, scored)]
+
+
+class PrefixIndex:
+    """
+    Entry titles sorted by their folded form, in two aligned lists, so
+    the titles starting with a prefix are found by binary search for
+    search-as-you-type. A few changed titles are inserted or deleted in
+    place; more than PREFIX_REBUILD of them sort the names again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signature = None
+        self._built = False
+        self.keys = []
+        self.titles = []
+
+    def build(self, names):
+        keys = [fold(title) for title in names]
+        titles = list(names)
+        # sort positions rather than (key, title) pairs, it is much faster
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        with self._lock:
+            self.keys = [keys[i] for i in order]
+            self.titles = [titles[i] for i in order]
+            self._built = True
+
+    def _insert(self, title):
+        key = fold(title)
+        i = bisect_right(self.keys, key)
+        self.keys.insert(i, key)
+        self.titles.insert(i, title)
+
+    def _delete(self, title):
+        key = fold(title)
+        i = bisect_left(self.keys, key)
+        i = self.titles.index(title, i, bisect_right(self.keys, key, i))
+        del self.keys[i]
+        del self.titles[i]
+
+    def _refresh(self):
+        signature = util.entries_signature()
+        if self._built and signature is not None and signature == self._signature:
+            return
+        names = util.entry_index.names()
+        with self._lock:
+            if self._built:
+                current, wanted = set(self.titles), set(names)
+                added, removed = wanted - current, current - wanted
+                if len(added) + len(removed) <= PREFIX_REBUILD:
+                    for title in removed:
+                        self._delete(title)
+                    for title in added:
+                        self._insert(title)
+                    self._signature = signature
+                    return
+        self.build(names)
+        self._signature = signature
+
+    def saved(self, title):
+        with self._lock:
+            if self._built:
+                key = fold(title)
+                i = bisect_left(self.keys, key)
+                if title not in self.titles[i:bisect_right(self.keys, key, i)]:
+                    self._insert(title)
+                self._signature = util.entries_signature()
+
+    def lookup(self, prefix, limit=10):
+        '''
+        Returns up to limit titles starting with prefix, case-insensitively,
+        in folded order, so shorter titles come before their extensions.
+        '''
+        key = fold(prefix)
+        with self._lock:
+            i = bisect_left(self.keys, key)
+            found = []
+            while i < len(self.keys) and len(found) < limit and self.keys[i].startswith(key):
+                found.append(self.titles[i])
+                i += 1
+        return found
+
+    def complete(self, prefix, limit=10):
+        '''
+        Like lookup, after bringing the titles in line with the entries.
+        '''
+        self._refresh()
+        return self.lookup(prefix, limit)
+
+
+title_index = TitleIndex()
+prefix_index = PrefixIndex()
+
+
+@receiver(entry_saved)
+def update_title_index(sender, title, content, **kwargs):
+    title_index.saved(title)
+    prefix_index.saved(title)
@@ -1,12 +1,26 @@
+from django.conf import settings
 from django.urls import path
 
 from . import views
+
+# under ASGI the read-only views are served by their coroutine versions
+if getattr(settings, "WIKI_ASYNC", {}).get("VIEWS"):
+    from . import async_views as read_views
+else:
+    read_views = views
+
 app_name = 'encyclopedia'
 urlpatterns = [
-    path("", views.index, name="index"),
+    path("", read_views.index, name="index"),
     path("newpage", views.newpage, name = "newpage"),
-    path("random", views.random, name = "random"),
-    path("wiki/<str:name>", views.article, name="article"),
+    path("random", read_views.random, name = "random"),
+    path("links", views.links, name = "links"),
+    path("wiki/<str:name>", read_views.article, name="article"),
     path("wiki/<str:name>/edit", views.edit, name = "edit"),
-    path("search", views.search, name = "search"),
+    path("wiki/<str:name>/history", views.history, name = "history"),
+    path("wiki/<str:name>/revision/<int:number>", views.revision, name = "revision"),
+    path("wiki/<str:name>/diff", views.diff, name = "diff"),
+    path("search", read_views.search, name = "search"),
+    path("autocomplete", views.autocomplete, name = "autocomplete"),
+    path("timings", views.timings, name = "timings"),
 ]
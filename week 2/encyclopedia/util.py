@@ -1,28 +1,238 @@
-import re
+import atexit
+import threading
+from bisect import bisect_left, bisect_right, insort
 
-from django.core.files.base import ContentFile
-from django.core.files.storage import default_storage
+from django.conf import settings
+
+from .signals import entry_pre_save, entry_saved
+from .storage import EntryConflict, load_entry_storage
+from .timing import stage
+
+# backend holding the entries, see settings.WIKI_ENTRY_STORAGE
+storage = load_entry_storage()
+
+
+def entries_signature():
+    '''
+    Returns something that changes whenever an entry is added,
+    removed or renamed, or None if the storage cannot tell.
+    '''
+    return storage.signature()
+
+
+def entry_stat(title):
+    '''
+    Returns an EntryStat (mtime_ns, size, version) for an entry,
+    or None if the entry does not exist.
+    '''
+    with stage("storage"):
+        return storage.stat(title)
+
+
+class DeferredSave:
+    """
+    Calls save at most once every settings.WIKI_INDEX_SAVE_DELAY
+    seconds however often request() is called, from a timer thread,
+    and once more when the process exits.
+
+    For indexes saved whole to a file that catch up with the entries
+    when they are loaded: a save lost in a crash only means reading the
+    entries changed since the last one again, while saving after every
+    edit makes each one cost as much as the whole index.
+    """
+
+    def __init__(self, save):
+        self._save = save
+        self._lock = threading.Lock()
+        self._timer = None
+        self._registered = False
+
+    def request(self):
+        delay = getattr(settings, "WIKI_INDEX_SAVE_DELAY", 60)
+        if delay <= 0:
+            self._save()
+            return
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(delay, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+            if not self._registered:
+                atexit.register(self.flush)
+                self._registered = True
+
+    def flush(self):
+        '''
+        Saves now if a save is pending.
+        '''
+        with self._lock:
+            timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+            self._save()
+
+
+class EntryIndex:
+    """
+    Process-wide sorted index of encyclopedia entry names.
+
+    The index is built once from the entry storage and then kept up to
+    date by save_entry. If entries are added or removed from outside the
+    process (the storage signature moves), it is rebuilt on next use.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names = []
+        self._members = set()
+        self._signature = None
+        self._built = False
+        # (names list it was computed from, initials)
+        self._initials = None
+
+    def _rebuild(self, signature):
+        with stage("listdir"):
+            self._names = sorted(storage.list_titles())
+        self._members = set(self._names)
+        self._signature = signature
+        self._built = True
+
+    def _refresh(self):
+        signature = entries_signature()
+        if not self._built or signature is None or signature != self._signature:
+            with self._lock:
+                if not self._built or signature is None or signature != self._signature:
+                    self._rebuild(signature)
+
+    def names(self):
+        '''
+        Returns the sorted list of entry names. The list is shared,
+        callers must not modify it.
+        '''
+        self._refresh()
+        return self._names
+
+    def contains(self, title):
+        self._refresh()
+        return title in self._members
+
+    def with_prefix(self, prefix):
+        '''
+        Returns the sorted entry names starting with prefix.
+        '''
+        names = self.names()
+        start = bisect_left(names, prefix)
+        stop = start
+        while stop < len(names) and names[stop].startswith(prefix):
+            stop += 1
+        return names[start:stop]
+
+    def page(self, after=None, before=None, start=None, limit=100):
+        '''
+        Returns (names, has_previous, has_next) for one page of the
+        sorted names: the limit names right after the title "after",
+        right before the title "before", or from "start" onwards.
+        '''
+        names = self.names()
+        if before is not None:
+            stop = bisect_left(names, before)
+            first = max(0, stop - limit)
+        else:
+            if after is not None:
+                first = bisect_right(names, after)
+            elif start is not None:
+                first = bisect_left(names, start)
+            else:
+                first = 0
+            stop = min(len(names), first + limit)
+        return names[first:stop], first > 0, stop < len(names)
+
+    def initials(self):
+        '''
+        Returns the sorted distinct first characters of the names,
+        for an alphabetical jump index.
+        '''
+        names = self.names()
+        if self._initials is None or self._initials[0] is not names:
+            initials = set()
+            i = 0
+            # jump from one initial to the next instead of visiting every name
+            while i < len(names):
+                if not names[i]:
+                    i += 1
+                    continue
+                initial = names[i][0]
+                initials.add(initial)
+                i = bisect_left(names, chr(ord(initial) + 1), i) if ord(initial) < 0x10FFFF else len(names)
+            self._initials = (names, sorted(initials))
+        return self._initials[1]
+
+    def add(self, title, before):
+        '''
+        Records a title written by this process without listing the
+        directory again. before is the storage signature from just
+        before the write: if it is not the one the index was built at,
+        others changed the entries too and the index is listed again.
+        '''
+        with self._lock:
+            if not self._built:
+                return
+            if before is None or before != self._signature:
+                self._built = False
+                return
+            if title not in self._members:
+                # copy on write so readers holding the old list are unaffected
+                names = list(self._names)
+                insort(names, title)
+                self._names = names
+                self._members = self._members | {title}
+            self._signature = entries_signature()
+
+    def invalidate(self):
+        with self._lock:
+            self._built = False
+
+
+entry_index = EntryIndex()
 
 
 def list_entries():
     """
     Returns a list of all names of encyclopedia entries.
     """
-    _, filenames = default_storage.listdir("entries")
-    return list(sorted(re.sub(r"\.md$", "", filename)
-                for filename in filenames if filename.endswith(".md")))
+    return list(entry_index.names())
+
+
+def entry_exists(title):
+    """
+    Tells if an entry with exactly this title exists.
+    """
+    return entry_index.contains(title)
+
+
+def entries_with_prefix(prefix):
+    """
+    Returns a sorted list of the entry names starting with prefix.
+    """
+    return entry_index.with_prefix(prefix)
 
 
-def save_entry(title, content):
+def save_entry(title, content, expected_version=None):
     """
     Saves an encyclopedia entry, given its title and Markdown
     content. If an existing entry with the same title already exists,
     it is replaced.
+
+    If expected_version is given, the entry is only written if its
+    current version (entry_stat(title).version, or "" for a missing
+    entry) still matches, otherwise EntryConflict is raised.
     """
-    filename = f"entries/{title}.md"
-    if default_storage.exists(filename):
-        default_storage.delete(filename)
-    default_storage.save(filename, ContentFile(content))
+    entry_pre_save.send(sender=None, title=title)
+    before = entries_signature()
+    storage.write(title, content, expected_version)
+    entry_index.add(title, before)
+    entry_saved.send(sender=None, title=title, content=content)
 
 
 def get_entry(title):
@@ -30,15 +240,35 @@ def get_entry(title):
     Retrieves an encyclopedia entry by its title. If no such
     entry exists, the function returns None.
     """
-    try:
-        f = default_storage.open(f"entries/{title}.md")
-        return f.read().decode("utf-8")
-    except FileNotFoundError:
+    with stage("storage"):
+        return storage.read(title)
+
+
+def open_large_entry(title):
+    """
+    Memory-maps an entry so it can be read and rendered piece by piece.
+    Returns a MappedEntry, to be closed by the caller, or None if the
+    entry does not exist, is smaller than settings.WIKI_LARGE_ENTRY_BYTES
+    or the storage cannot map it; get_entry is the way to read those.
+    """
+    if not hasattr(storage, "open_mapped"):
+        return None
+    large = getattr(settings, "WIKI_LARGE_ENTRY_BYTES", 1024 * 1024)
+    with stage("storage"):
+        # most entries are small, and a stat is cheaper than a mapping
+        stat = storage.stat(title)
+        if stat is None or stat.size < large:
+            return None
+        entry = storage.open_mapped(title)
+    # the entry may have been replaced since the stat
+    if entry is not None and len(entry) < large:
+        entry.close()
         return None
+    return entry
 
 def check_sub(string, sub_str):
     '''
-    Takes in a string and a substring and tells if 
+    Takes in a string and a substring and tells if
     the substring is present in the string.
     '''
     if sub_str.upper()  in string.upper():
@@ -1,26 +1,190 @@
+import re
+import zlib
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timezone
+from functools import wraps
+from django.conf import settings
 from django.contrib import messages
-from django.shortcuts import render, redirect
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import redirect
+from django.template.loader import render_to_string
+from django.views.decorators.cache import cache_control, never_cache
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from markdown2 import markdown
-from random import choice
 from . import util
+from .links import link_graph
+from .picker import random_picker
+from .compression import gzip_page
+from .rendering import gzip_entry, render_entry, stream_entry
+from .revisions import revision_store
+from .search import search_index
+from .timing import render, stage, timing_stats
+from .titles import prefix_index, title_index
 from .forms import AddPage, EditPage
 
 
+def index_etag(request):
+    signature = util.entries_signature()
+    if signature:
+        return "index-" + "-".join("%x" % part for part in signature)
+
+
+def index_last_modified(request):
+    signature = util.entries_signature()
+    if signature:
+        return datetime.fromtimestamp(signature[1] / 1e9, tz=timezone.utc)
+
+
+def article_etag(request, name):
+    st = util.entry_stat(name)
+    if st:
+        # the page also lists the entries linking to it
+        backlinks = "\n".join(link_graph.links_to(name))
+        etag = "%s-%x" % (st.version, zlib.crc32(backlinks.encode("utf-8")))
+        # gzip and plain pages are different representations
+        return etag + "-gzip" if accepts_gzip(request) else etag
+
+
+def article_last_modified(request, name):
+    st = util.entry_stat(name)
+    if st:
+        return datetime.fromtimestamp(st.mtime_ns / 1e9, tz=timezone.utc)
+
+
+def unless_messages(validator):
+    '''
+    Wraps an etag or last-modified function of a page to return None
+    while flash messages are waiting, so the page that shows them is
+    never answered with a 304.
+    '''
+    @wraps(validator)
+    def wrapper(request, *args, **kwargs):
+        if messages.get_messages(request):
+            return None
+        return validator(request, *args, **kwargs)
+    return wrapper
+
+
+# the pages show flash messages and a CSRF token, so browsers keep
+# them for this user only and revalidate them on every visit
+index_page_etag = unless_messages(index_etag)
+index_page_last_modified = unless_messages(index_last_modified)
+article_page_etag = unless_messages(article_etag)
+article_page_last_modified = unless_messages(article_last_modified)
+
+PAGE_CACHE_CONTROL = {"private": True, "no_cache": True}
+
+
+ACCEPTS_GZIP = re.compile(r"\bgzip\b")
+
+
+def accepts_gzip(request):
+    return bool(ACCEPTS_GZIP.search(request.headers.get("Accept-Encoding", "")))
+
+
+# entries per page of the index, and the most a client can ask for
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# entries rendered per chunk when the index is streamed
+STREAM_CHUNK = 500
+
+STREAM_MARKER = "<!-- entries -->"
+
+# where the body goes when a large article is streamed
+ARTICLE_MARKER = "<!-- article -->"
+
+
+@cache_control(**PAGE_CACHE_CONTROL)
+@condition(etag_func=index_page_etag, last_modified_func=index_page_last_modified)
 def index(request):
-    return render(request, "encyclopedia/index.html", {
-        "entries": util.list_entries()
-    })
+    after = request.GET.get("after")
+    before = request.GET.get("before")
+    start = request.GET.get("from")
+
+    # ?stream=1 sends every entry from the cursor on, rendered in chunks
+    if request.GET.get("stream"):
+        return stream_index(request, after, start)
+
+    try:
+        limit = min(max(int(request.GET.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except ValueError:
+        limit = PAGE_SIZE
+    return render(request, "encyclopedia/index.html", index_page(after, before, start, limit))
+
+
+def index_page(after, before, start, limit):
+    entries, has_previous, has_next = util.entry_index.page(after, before, start, limit)
+    return {
+        "entries": entries,
+        "initials": util.entry_index.initials(),
+        "previous_cursor": entries[0] if has_previous and entries else None,
+        "next_cursor": entries[-1] if has_next and entries else None,
+        "limit": limit,
+    }
+
 
+def stream_index(request, after, start):
+    names = util.entry_index.names()
+    if after is not None:
+        first = bisect_right(names, after)
+    elif start is not None:
+        first = bisect_left(names, start)
+    else:
+        first = 0
+
+    # render the page once around a marker, then fill the list in chunks
+    page = render_to_string("encyclopedia/index.html", {
+        "stream_marker": STREAM_MARKER,
+        "initials": util.entry_index.initials(),
+    }, request)
+    head, tail = page.split(STREAM_MARKER)
+
+    def chunks():
+        yield head
+        for i in range(first, len(names), STREAM_CHUNK):
+            yield render_to_string("encyclopedia/index_entries.html", {
+                "entries": names[i:i + STREAM_CHUNK],
+            })
+        yield tail
+
+    return StreamingHttpResponse(chunks())
 
+
+@vary_on_headers("Accept-Encoding")
+@cache_control(**PAGE_CACHE_CONTROL)
+@condition(etag_func=article_page_etag, last_modified_func=article_page_last_modified)
 def article(request, name):
     if request.method == 'POST':
         return redirect('encyclopedia:edit', name = name)
 
+    # large entries are memory-mapped and rendered as they are sent
+    mapped = util.open_large_entry(name)
+    if mapped is not None:
+        random_picker.record_view(name)
+        head, tail = article_parts(request, name)
+
+        def chunks():
+            try:
+                yield head
+                yield from stream_entry(name, mapped)
+                yield tail
+            finally:
+                mapped.close()
+
+        return StreamingHttpResponse(chunks())
+
     entry = util.get_entry(name)
     if entry:
+        random_picker.record_view(name)
+        # the compressed article is cached, only the page around it is compressed here
+        if accepts_gzip(request):
+            return gzip_article(request, name, gzip_entry(name, entry))
         return render(request, "encyclopedia/article.html",{
             "title":name,
-            "article": markdown(entry)
+            "article": render_entry(name, entry),
+            "backlinks": link_graph.links_to(name),
         })
     else:
         return render(request, "encyclopedia/article.html",{
@@ -28,6 +192,30 @@ def article(request, name):
         })
 
 
+def article_parts(request, name):
+    '''
+    Renders the article page around ARTICLE_MARKER and returns the
+    parts before and after it.
+    '''
+    page = render_to_string("encyclopedia/article.html", {
+        "title": name,
+        "article": ARTICLE_MARKER,
+        "backlinks": link_graph.links_to(name),
+    }, request)
+    return page.split(ARTICLE_MARKER)
+
+
+def gzip_article(request, name, body):
+    '''
+    Returns a gzip-encoded article page around the GzipBody of its article.
+    '''
+    head, tail = article_parts(request, name)
+    with stage("gzip"):
+        response = HttpResponse(gzip_page(head, body, tail))
+    response["Content-Encoding"] = "gzip"
+    return response
+
+
 def newpage(request):
     if request.method == 'POST':
         form = AddPage(request.POST)
@@ -37,8 +225,7 @@ def newpage(request):
             content = form.cleaned_data["text"]
 
             # check if title already exists
-            entries= util.list_entries()
-            if title in entries:
+            if util.entry_exists(title):
                 messages.error(request, f'ERROR: Page named {title} already exists.')
                 return redirect('encyclopedia:newpage')
 
@@ -48,9 +235,13 @@ def newpage(request):
 
                 # save md in entries
                 try:
-                    util.save_entry(title, content)
+                    util.save_entry(title, content, expected_version='')
                     messages.success(request, 'Page added successfully')
                     return redirect('encyclopedia:article', name = title)
+                # created by someone else in the meantime
+                except util.EntryConflict:
+                    messages.error(request, f'ERROR: Page named {title} already exists.')
+                    return redirect('encyclopedia:newpage')
                 # some error while saving
                 except:
                     messages.error(request, f'Some error occured while creating {title} page.')
@@ -72,12 +263,12 @@ def edit(request, name):
             # get post data
             title = form.cleaned_data["title"]
             content = form.cleaned_data["text"]
+            version = form.cleaned_data["version"] or None
 
             # verify title
             if title == name:
                 # check if title already exists
-                entries= util.list_entries()
-                if title not in entries:
+                if not util.entry_exists(title):
                     messages.error(request, f'ERROR: Page named {title} doesn\'t exist.')
                     return redirect('encyclopedia:index')
 
@@ -87,9 +278,13 @@ def edit(request, name):
 
                     # save md in entries
                     try:
-                        util.save_entry(title, content)
+                        util.save_entry(title, content, expected_version=version)
                         messages.success(request, 'Page edited successfully')
                         return redirect('encyclopedia:article', name = title)
+                    # someone saved the page after this form was loaded
+                    except util.EntryConflict:
+                        messages.error(request, f'ERROR: {title} was changed by someone else while you were editing. Please review the latest version.')
+                        return redirect('encyclopedia:edit', name = title)
                     # some error while editing
                     except:
                         messages.error(request, f'Some error occured while editing {title} page.')
@@ -102,10 +297,13 @@ def edit(request, name):
             return redirect('encyclopedia:index')
 
     else:
+        # read the version first, a save in between then shows up as a conflict
+        stat = util.entry_stat(name)
         entry = util.get_entry(name)
         form = EditPage()
         form.fields['title'].initial = name
         form.fields['text'].initial = entry
+        form.fields['version'].initial = stat.version if stat else ''
         
         if entry:
             return render(request, "encyclopedia/edit.html",{
@@ -118,33 +316,148 @@ def edit(request, name):
 
 
 def random(request):
-    entries = util.list_entries()
-    random_choice = choice(entries)
+    # ?weight=recent or ?weight=views skews the pick, see RandomPicker
+    random_choice = random_picker.pick(request.GET.get('weight'))
+    if random_choice is None:
+        messages.error(request, 'ERROR: There are no pages yet.')
+        return redirect('encyclopedia:index')
     return redirect('encyclopedia:article', name= random_choice)
 
 
-def search(request):
+def history(request, name):
+    revisions = [{
+        'number': number,
+        'size': size,
+        'created': datetime.fromtimestamp(created_ns / 1e9, tz=timezone.utc),
+    } for number, size, created_ns in revision_store.history(name)]
+    if not revisions:
+        messages.error(request, f'ERROR: No history for {name}.')
+        return redirect('encyclopedia:index')
+    return render(request, "encyclopedia/history.html", {
+        "title": name,
+        "revisions": revisions,
+    })
 
-    if request.method =='POST':
-        q = request.POST.get('q').strip()
-        entries = util.list_entries()
-        if q:
-            # check perfect match
-            for entry in entries:
-                if q.lower() == entry.lower():
-                    return redirect('encyclopedia:article', name=entry)
-
-            substrings=set()
-            # check for substrings
-            for entry in util.list_entries():
-                if util.check_sub(entry, q):
-                    substrings.add(entry)
-                elif util.check_sub(q, entry):
-                    substrings.add(entry)
-
-            return render(request, 'encyclopedia/search.html', {
-                'entries': sorted(substrings),
-                'search': q
-            })
+
+def links(request):
+    return render(request, "encyclopedia/links.html", {
+        "orphans": link_graph.orphans(),
+        "broken": link_graph.broken(),
+    })
+
+
+def render_revision(content):
+    with stage("markdown"):
+        return markdown(content)
+
+
+def revision(request, name, number):
+    content = revision_store.get(name, number)
+    if content is None:
+        messages.error(request, f'ERROR: {name} has no revision {number}.')
+        return redirect('encyclopedia:index')
+    return render(request, "encyclopedia/revision.html", {
+        "title": name,
+        "number": number,
+        "article": render_revision(content),
+    })
+
+
+def diff(request, name):
+    try:
+        old = int(request.GET.get('from', ''))
+        new = int(request.GET.get('to', ''))
+    except ValueError:
+        messages.error(request, 'ERROR: Choose two revisions to compare.')
+        return redirect('encyclopedia:history', name = name)
+    changes = revision_store.diff(name, old, new)
+    if changes is None:
+        messages.error(request, f'ERROR: {name} has no revision {old} or {new}.')
+        return redirect('encyclopedia:history', name = name)
+    return render(request, "encyclopedia/diff.html", {
+        "title": name,
+        "old": old,
+        "new": new,
+        "lines": changes.splitlines(),
+    })
+
+
+# most title matches listed on the search page
+TITLE_MATCHES = 100
+
+
+def search_results(q):
+    '''
+    Returns (title, results, suggestions) for a search query: the title
+    matching it exactly if there is one, otherwise the result list and
+    "did you mean" titles for when it is empty.
+    '''
+    with stage("search"):
+        # check perfect match
+        match = title_index.find_exact(q)
+        if match:
+            return match, [], []
+
+        # titles containing the query, or contained in it
+        substrings = set(title_index.find_substring(q, limit=TITLE_MATCHES))
+        substrings.update(title_index.find_contained(q))
+
+        # title matches first, then full text matches ranked by the index
+        results = [{'title': entry, 'snippet': ''} for entry in sorted(substrings)]
+        for result in search_index.search(q):
+            if result['title'] not in substrings:
+                results.append(result)
+        return None, results, [] if results else title_index.suggest(q)
+
+
+def search_query(request):
+    # static snapshot pages search with GET, having no CSRF token
+    source = request.POST if request.method == 'POST' else request.GET
+    return source.get('q', '').strip()
+
+
+def search(request):
+    q = search_query(request)
+    if q:
+        match, results, suggestions = search_results(q)
+        if match:
+            return redirect('encyclopedia:article', name=match)
+        return render(request, 'encyclopedia/search.html', {
+            'results': results,
+            'suggestions': suggestions,
+            'search': q
+        })
     return render(request, 'encyclopedia/search.html')
 
+
+# titles returned by the autocomplete endpoint by default, and at most
+AUTOCOMPLETE_LIMIT = 10
+MAX_AUTOCOMPLETE_LIMIT = 50
+
+# how long browsers and proxies may reuse an autocomplete response
+# before revalidating it against the ETag
+AUTOCOMPLETE_MAX_AGE = 60
+
+
+@cache_control(public=True, max_age=AUTOCOMPLETE_MAX_AGE)
+@condition(etag_func=index_etag, last_modified_func=index_last_modified)
+def autocomplete(request):
+    q = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', AUTOCOMPLETE_LIMIT)), 1), MAX_AUTOCOMPLETE_LIMIT)
+    except ValueError:
+        limit = AUTOCOMPLETE_LIMIT
+    return JsonResponse({
+        'query': q,
+        'results': prefix_index.complete(q, limit) if q.strip() else [],
+    })
+
+
+@never_cache
+def timings(request):
+    # p50/p95/p99 per view and stage since the process started, only
+    # for staff outside of DEBUG
+    user = getattr(request, 'user', None)
+    if not settings.DEBUG and not (user and user.is_staff):
+        raise Http404
+    return JsonResponse(timing_stats.report())
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'encyclopedia.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -119,3 +120,79 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/3.0/howto/static-files/
 
 STATIC_URL = '/static/'
+
+
+# Encyclopedia
+
+# Where entries are kept. Other backends are
+# encyclopedia.storage.ShardedFileStorage (OPTIONS: directory, depth) and
+# encyclopedia.storage.SQLiteStorage (OPTIONS: database)
+WIKI_ENTRY_STORAGE = {
+    'BACKEND': 'encyclopedia.storage.FlatFileStorage',
+    'OPTIONS': {'directory': 'entries'},
+}
+
+# On-disk format of entries in the file backends: FORMAT None keeps plain
+# Markdown, "zlib" or "zstd" (needs the zstandard package) compresses
+# entries of at least MIN_BYTES with the shared DICTIONARY trained by
+# "manage.py compress_entries --train". Reads detect the format of each
+# file, so plain and compressed entries can be mixed.
+WIKI_ENTRY_COMPRESSION = {
+    'FORMAT': None,
+    'LEVEL': 9,
+    'MIN_BYTES': 64,
+    'DICTIONARY': os.path.join(BASE_DIR, 'entries.dict'),
+}
+
+# Where the full-text search index is saved between restarts
+WIKI_SEARCH_INDEX = os.path.join(BASE_DIR, 'search_index.json')
+
+# Where the links between entries are saved between restarts
+WIKI_LINK_GRAPH = os.path.join(BASE_DIR, 'link_graph.json')
+
+# Edits reach the search index and link graph at once, but their files
+# are saved at most this often (in seconds), and on exit. Entries edited
+# since the last save are read again on the next start
+WIKI_INDEX_SAVE_DELAY = 60
+
+# Database keeping the revision history of every entry
+WIKI_REVISIONS = os.path.join(BASE_DIR, 'revisions.sqlite3')
+
+# Cache for rendered articles. Other backends are
+# encyclopedia.rendering.DjangoRenderCache (OPTIONS: alias, timeout) and
+# encyclopedia.rendering.FileRenderCache (OPTIONS: directory, max_bytes)
+WIKI_RENDER_CACHE = {
+    'BACKEND': 'encyclopedia.rendering.MemoryRenderCache',
+    'OPTIONS': {'max_bytes': 64 * 1024 * 1024},
+}
+
+# Static copy of the wiki written by "manage.py build_snapshot". With
+# WIKI_SNAPSHOT_ON_SAVE, saving an entry re-renders its page and the index
+WIKI_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'snapshot')
+WIKI_SNAPSHOT_ON_SAVE = False
+
+# Per-stage timings of encyclopedia views, sent in Server-Timing headers
+# and aggregated at /timings. With SAMPLE_SLOW_MS set, requests running
+# longer than that are sampled every SAMPLE_INTERVAL_MS and their stacks
+# written to PROFILE_DIR in collapsed (flame graph) format
+WIKI_TIMING = {
+    'ENABLED': True,
+    'SAMPLE_SLOW_MS': None,
+    'SAMPLE_INTERVAL_MS': 1,
+    'PROFILE_DIR': os.path.join(BASE_DIR, 'profiles'),
+}
+
+# Entries of at least this many bytes are memory-mapped and their
+# articles rendered block by block as the response is sent, so a
+# request never holds a whole large entry or its HTML in memory
+WIKI_LARGE_ENTRY_BYTES = 1024 * 1024
+
+# Async views for ASGI (see encyclopedia/async_views.py). VIEWS routes
+# index, article, search and random to the coroutine versions; asgi.py
+# turns it on. Entry reads run in IO_THREADS threads and Markdown
+# rendering in at most RENDER_THREADS at once.
+WIKI_ASYNC = {
+    'VIEWS': os.environ.get('WIKI_ASYNC_VIEWS') == '1',
+    'IO_THREADS': 32,
+    'RENDER_THREADS': os.cpu_count(),
+}
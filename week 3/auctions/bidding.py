@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Bid, Listing
+
+
+# =========================================
+# 💰 Bid Placement
+# Validates and records bids atomically. The listing's current price
+# is moved with a compare-and-set UPDATE that only matches while the
+# bid is still high enough, so of two racing bidders exactly one can
+# win and accepted bids always go up.
+# =========================================
+# the largest amount an IntegerField holds on every database
+MAX_AMOUNT = 2 ** 31 - 1
+
+
+class BidRejected(Exception):
+    """Raised by place_bid with a message that can be shown to the bidder."""
+
+
+def parse_amount(value):
+    """
+    Return the whole dollar amount typed into a form, or None if it
+    isn't one an amount field can store.
+    """
+    try:
+        amount = int(value)
+    except (TypeError, ValueError):
+        return None
+    return amount if 0 <= amount <= MAX_AMOUNT else None
+
+
+def place_bid(list_id, user, amount):
+    """
+    Record a bid of amount by user on a listing and make it the
+    current bid. Returns the new Bid, or raises BidRejected if the
+    listing is missing, closed or past its end, or the bid is not
+    high enough.
+
+    The UPDATE locks the listing row until the transaction ends, so
+    concurrent bids on the same listing are applied one at a time,
+    each checked against the price left by the one before it.
+    """
+    amount = int(amount)
+    with transaction.atomic():
+        high_enough = (Q(current_bid__isnull=True, start_bid__lte=amount)
+                       | Q(current_bid__lt=amount))
+        # an ended auction may not be closed by close_auctions yet
+        running = Q(ends_at__isnull=True) | Q(ends_at__gt=timezone.now())
+        updated = Listing.objects.filter(high_enough, running, pk=list_id, active_status=True).update(
+            current_bid=amount,
+            current_bidder=user,
+            bid_count=F('bid_count') + 1,
+        )
+        if not updated:
+            raise BidRejected(rejection_reason(list_id))
+        # the listing is already updated, so the bid must not update it again
+        bid = Bid(list_id_id=list_id, user_id=user, amount=amount)
+        bid.save(update_listing=False)
+    return bid
+
+
+def rejection_reason(list_id):
+    """Return why a bid on the listing was not accepted."""
+    listing = Listing.objects.filter(pk=list_id).only(
+        'active_status', 'current_bid', 'start_bid', 'ends_at').first()
+    if listing is None:
+        return 'Something went wrong. Try again.'
+    if not listing.active_status:
+        return 'This listing is closed.'
+    if listing.ends_at and listing.ends_at <= timezone.now():
+        return 'This auction has ended.'
+    if listing.current_bid is not None:
+        return 'Bid must be higher than current bid.'
+    return 'Bid must be at least the starting bid.'
@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .events import publish_on_commit
+from .models import Listing, Watchlist
+
+
+# =========================================
+# 🔒 Closing Auctions
+# Closes listings in bulk: the current bidder kept on each listing is
+# its winner, so a whole batch is closed by one UPDATE, and their
+# watchlist rows go in one DELETE. Used by the owner's close button
+# and by "manage.py close_auctions" for listings past their end.
+# =========================================
+BATCH_SIZE = 5000
+
+
+def close_listings(listings):
+    """
+    Close the active listings in the queryset, which may be sliced.
+    Returns the number closed.
+    """
+    with transaction.atomic():
+        ids = list(listings.values_list('id', flat=True))
+        # of those, the ones still active, locked until they are closed
+        rows = list(Listing.objects.select_for_update().filter(pk__in=ids, active_status=True)
+                    .values_list('id', 'current_bid'))
+        ids = [pk for pk, _ in rows]
+        # the winner is whoever holds the current bid when it closes
+        closed = Listing.objects.filter(pk__in=ids, active_status=True).update(
+            active_status=False, winner=F('current_bidder'))
+        Watchlist.objects.filter(list_id__in=ids).delete()
+        for pk, amount in rows:
+            publish_on_commit(pk, "close", {'amount': amount})
+    return closed
+
+
+def due_listings(now=None):
+    """Return the active listings whose end has passed, earliest first."""
+    return (Listing.objects.filter(active_status=True, ends_at__lte=now or timezone.now())
+            .order_by('ends_at', 'id'))
+
+
+def close_due(now=None, batch_size=BATCH_SIZE):
+    """
+    Close up to batch_size listings that have ended, earliest first,
+    and return the number closed.
+    """
+    return close_listings(due_listings(now)[:batch_size])
+
+
+def next_due():
+    """Return when the next active listing ends, or None."""
+    return (Listing.objects.filter(active_status=True, ends_at__isnull=False)
+            .order_by('ends_at').values_list('ends_at', flat=True).first())
@@ -0,0 +1,218 @@
+import asyncio
+import json
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+from .models import Bid, Comment, Listing
+
+
+# =========================================
+# 📡 Listing Events
+# Bids, comments and closes are published to a channel per listing
+# once their transaction commits; listing pages follow them over
+# Server-Sent Events (see streaming.py) instead of reloading.
+# =========================================
+
+# data is the event's JSON text, encoded once for all subscribers
+Event = namedtuple("Event", "id kind data")
+
+
+def listing_channel(list_id):
+    return f"listing-{list_id}"
+
+
+class Channel:
+    """The recent events of one channel and what wakes its listeners."""
+
+    def __init__(self, floor, buffer):
+        # events with an id above floor are all still in the buffer
+        self.floor = floor
+        self.events = deque(maxlen=buffer)
+        self.subscribers = 0
+        # event loop -> asyncio.Event set on the next publish
+        self.wakers = {}
+        # event loop -> timer waking its listeners for a heartbeat
+        self.ticks = {}
+
+
+class LocalBroker:
+    """
+    In-process pub/sub: events only reach subscribers in the same
+    process, so with several workers a shared backend is needed.
+
+    publish() may be called from any thread. Listeners don't get a
+    queue or a timer each; they wait on one asyncio.Event per channel
+    and event loop and read what they missed from the channel's
+    buffer, so the only work per listener is waking it up.
+    """
+
+    def __init__(self, buffer=50, max_channels=10000):
+        self.buffer = buffer
+        self.max_channels = max_channels
+        self._lock = threading.Lock()
+        self._channels = OrderedDict()
+        # ids keep growing across restarts, so an id from before one is
+        # always older than what this process can replay
+        self._last_id = time.time_ns() // 1000
+        # highest id of an event dropped along with its channel
+        self._dropped = self._last_id
+
+    def position(self):
+        """Return the id of the latest event published on any channel."""
+        with self._lock:
+            return self._last_id
+
+    def _channel(self, name):
+        # with self._lock held
+        channel = self._channels.get(name)
+        if channel is None:
+            # forget the least recently used channels nobody listens to,
+            # before adding this one, which has no subscribers yet either
+            while len(self._channels) >= self.max_channels:
+                for old_name, old in self._channels.items():
+                    if not old.subscribers:
+                        break
+                else:
+                    break
+                del self._channels[old_name]
+                if old.events:
+                    self._dropped = max(self._dropped, old.events[-1].id)
+            channel = self._channels[name] = Channel(self._dropped, self.buffer)
+        else:
+            self._channels.move_to_end(name)
+        return channel
+
+    def publish(self, channel, kind, data):
+        """Send an event to everyone listening on the channel."""
+        data = json.dumps(data)
+        with self._lock:
+            self._last_id += 1
+            event = Event(self._last_id, kind, data)
+            ch = self._channel(channel)
+            if len(ch.events) == ch.events.maxlen:
+                ch.floor = ch.events[0].id
+            ch.events.append(event)
+            loops = list(ch.wakers)
+        for loop in loops:
+            try:
+                loop.call_soon_threadsafe(self._wake, ch, loop)
+            except RuntimeError:
+                # the loop is closed, its listeners are gone
+                with self._lock:
+                    ch.wakers.pop(loop, None)
+        return event
+
+    def _wake(self, channel, loop):
+        # runs in loop, so no listener of it can be between reading
+        # the buffer and waiting on the old Event
+        waker = channel.wakers.get(loop)
+        if waker is not None:
+            channel.wakers[loop] = asyncio.Event()
+            waker.set()
+
+    def _tick(self, channel, loop, timeout):
+        # wakes the listeners with nothing new, once per timeout for
+        # all of them, while there are any
+        with self._lock:
+            if not channel.subscribers:
+                channel.ticks.pop(loop, None)
+                return
+            channel.ticks[loop] = loop.call_later(timeout, self._tick, channel, loop, timeout)
+        self._wake(channel, loop)
+
+    async def listen(self, channel, after=None, timeout=None):
+        """
+        Yield the events published on the channel from now on, or all
+        after the event id after. If some of those can't be replayed
+        any more a "reset" event is yielded instead and the listener
+        should reload what it shows. With a timeout, None is yielded at
+        least that often when nothing was published.
+        """
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            ch = self._channel(channel)
+            ch.subscribers += 1
+            ch.wakers.setdefault(loop, asyncio.Event())
+            if timeout and loop not in ch.ticks:
+                ch.ticks[loop] = loop.call_later(timeout, self._tick, ch, loop, timeout)
+            last = self._last_id if after is None else after
+        woken = False
+        try:
+            while True:
+                with self._lock:
+                    if not ch.floor <= last <= self._last_id:
+                        pending = [Event(self._last_id, "reset", "{}")]
+                    else:
+                        # newest first, up to the last one already sent
+                        pending = []
+                        for event in reversed(ch.events):
+                            if event.id <= last:
+                                break
+                            pending.append(event)
+                        pending.reverse()
+                    waker = ch.wakers[loop]
+                for event in pending:
+                    yield event
+                    last = event.id
+                if woken and not pending and timeout:
+                    yield None
+                woken = not pending
+                if woken:
+                    await waker.wait()
+        finally:
+            with self._lock:
+                ch.subscribers -= 1
+
+
+def load_broker():
+    """
+    Builds the broker named by settings.AUCTION_EVENTS, a dict with a
+    "BACKEND" dotted path and optional "OPTIONS" keyword arguments.
+    """
+    config = getattr(settings, "AUCTION_EVENTS", {})
+    backend = import_string(config.get("BACKEND", "auctions.events.LocalBroker"))
+    return backend(**config.get("OPTIONS", {}))
+
+
+broker = load_broker()
+
+
+def publish_on_commit(list_id, kind, data):
+    """Publish once the current transaction commits, right away outside one."""
+    transaction.on_commit(lambda: broker.publish(listing_channel(list_id), kind, data))
+
+
+# ==========================
+# 📣 RECEIVERS
+# Closes are published by closing.close_listings, the only place
+# listings are closed, so saving a closed listing again sends nothing.
+# ==========================
+@receiver(post_save, sender=Bid)
+def bid_placed(sender, instance, created, **kwargs):
+    # the page keeps the highest amount and count it has seen, so events
+    # arriving out of order or already in the page change nothing. The
+    # bid's transaction holds the listing row, so the count is its own.
+    if created:
+        count = Listing.objects.filter(pk=instance.list_id_id).values_list('bid_count', flat=True).first()
+        publish_on_commit(instance.list_id_id, "bid", {
+            'amount': instance.amount,
+            'bidder': instance.user_id.username if instance.user_id_id else None,
+            'count': count,
+        })
+
+
+@receiver(post_save, sender=Comment)
+def comment_added(sender, instance, created, **kwargs):
+    if created:
+        publish_on_commit(instance.list_id_id, "comment", {
+            'id': instance.pk,
+            'user': instance.user_id.username,
+            'comment': instance.comment,
+        })
@@ -1,4 +1,6 @@
 from django import forms
+from django.utils import timezone
+
 from .models import Listing
 
 # =========================================
@@ -10,6 +12,16 @@ from .models import Listing
 class NewItem(forms.ModelForm):
     """Form for creating a new auction listing."""
 
+    # Days the auction runs for; close_auctions closes it after that
+    duration = forms.TypedChoiceField(
+        choices=[('', 'Until I close it'), (1, '1 day'), (3, '3 days'), (7, '7 days'), (14, '14 days')],
+        coerce=int,
+        empty_value=None,
+        required=False,
+        label='Duration',
+        widget=forms.Select(attrs={'class': 'form-control'}),
+    )
+
     class Meta:
         model = Listing
         fields = ('title', 'desc', 'img', 'category', 'start_bid')
@@ -32,6 +44,11 @@ class NewItem(forms.ModelForm):
             'start_bid': 'Starting Bid',
         }
 
+    def ends_at(self):
+        """Return when the auction ends, None if the owner closes it."""
+        days = self.cleaned_data.get('duration')
+        return timezone.now() + timezone.timedelta(days=days) if days else None
+
 
 # =========================================
 # 👨‍💻 Developer Information
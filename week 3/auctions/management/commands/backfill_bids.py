@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from auctions.models import Bid, Listing, bid_summary
+
+
+# =========================================
+# 🔁 Backfill Bid Summary
+# Recomputes Listing.current_bid, current_bidder and bid_count from
+# the Bid table, e.g. after bids were deleted or edited in the admin.
+# =========================================
+class Command(BaseCommand):
+    help = "Recomputes the current bid, current bidder and bid count of every listing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000,
+                            help="listings updated per transaction")
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        last = Listing.objects.aggregate(Max('id'))['id__max'] or 0
+        batch_size = options["batch_size"]
+        updated = 0
+
+        # one UPDATE per range of ids keeps each transaction short
+        for low in range(0, last + 1, batch_size):
+            with transaction.atomic():
+                updated += Listing.objects.filter(id__gte=low, id__lt=low + batch_size).update(
+                    **bid_summary(Bid))
+
+        elapsed = time.perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(f"Backfilled {updated} listings in {elapsed:.1f}s."))
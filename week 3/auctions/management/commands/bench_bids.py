@@ -0,0 +1,83 @@
+import random
+import threading
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from auctions.bidding import BidRejected, place_bid
+from auctions.models import Listing, User
+
+
+# =========================================
+# 🏁 Bid Throughput Benchmark
+# Many bidders race on one hot listing through bidding.place_bid.
+# Creates its own users and listing and removes them afterwards.
+# =========================================
+class Command(BaseCommand):
+    help = "Measures bids per second on one listing with concurrent bidders and checks their order."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bidders", type=int, default=16, help="concurrent bidding threads")
+        parser.add_argument("--bids", type=int, default=5000, help="bids sent in total")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        owner = User.objects.create(username=f"bench-owner-{time.time_ns()}")
+        bidders = [User.objects.create(username=f"bench-bidder-{i}-{time.time_ns()}")
+                   for i in range(options["bidders"])]
+        listing = Listing.objects.create(user=owner, title="Benchmark", start_bid=1)
+        try:
+            self.run(listing, bidders, options["bids"], options["seed"])
+        finally:
+            listing.delete()
+            User.objects.filter(pk__in=[owner.pk] + [user.pk for user in bidders]).delete()
+
+    def run(self, listing, bidders, bids, seed):
+        lock = threading.Lock()
+        remaining = [bids]
+        counts = {"accepted": 0, "rejected": 0}
+        errors = []
+
+        def bid(user, rng):
+            try:
+                while True:
+                    with lock:
+                        if not remaining[0]:
+                            return
+                        remaining[0] -= 1
+                    current = Listing.objects.values_list("current_bid", flat=True).get(pk=listing.pk)
+                    try:
+                        place_bid(listing.pk, user, (current or 0) + rng.randint(1, 3))
+                        outcome = "accepted"
+                    except BidRejected:
+                        outcome = "rejected"
+                    with lock:
+                        counts[outcome] += 1
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bid, args=(user, random.Random(seed + i)))
+                   for i, user in enumerate(bidders)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        if errors:
+            raise CommandError(f"{len(errors)} bidders failed, first with {errors[0]!r}")
+
+        amounts = list(listing.bids.order_by("id").values_list("amount", flat=True))
+        listing.refresh_from_db()
+        if any(a >= b for a, b in zip(amounts, amounts[1:])) or listing.current_bid != amounts[-1] \
+                or listing.bid_count != len(amounts):
+            raise CommandError("accepted bids are out of order")
+
+        attempts = counts["accepted"] + counts["rejected"]
+        self.stdout.write(f"{attempts} bids from {len(bidders)} bidders in {elapsed:.2f}s: "
+                          f"{attempts / elapsed:.0f} bids/s, {counts['accepted']} accepted, "
+                          f"{counts['rejected']} outbid")
+        self.stdout.write(self.style.SUCCESS("Accepted bids are strictly increasing."))
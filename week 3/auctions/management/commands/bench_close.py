@@ -0,0 +1,68 @@
+import random
+import time
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from auctions.models import Listing, User, Watchlist
+
+
+# =========================================
+# ⏰ Auction Closing Benchmark
+# Seeds the test database with auctions that all end in the same
+# minute, each with a leading bidder and watchlist rows, and times
+# "manage.py close_auctions --once" closing them.
+# =========================================
+class Command(BaseCommand):
+    help = "Times closing many auctions that end in the same minute."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--listings", type=int, default=100000, help="auctions ending together")
+        parser.add_argument("--watchers", type=int, default=2, help="watchlist rows per auction")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            self.run(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def run(self, options):
+        rng = random.Random(options["seed"])
+        owner = User.objects.create(username="bench-owner")
+        bidders = User.objects.bulk_create(User(username=f"bench-bidder-{i}") for i in range(100))
+        minute = timezone.now().replace(second=0, microsecond=0) - timezone.timedelta(minutes=1)
+
+        start = time.perf_counter()
+        for low in range(0, options["listings"], 10000):
+            with transaction.atomic():
+                listings = Listing.objects.bulk_create(
+                    Listing(user=owner, title=f"Auction {i}", start_bid=10, current_bid=20,
+                            current_bidder=rng.choice(bidders), bid_count=1,
+                            ends_at=minute + timezone.timedelta(seconds=rng.random() * 60))
+                    for i in range(low, min(low + 10000, options["listings"])))
+                Watchlist.objects.bulk_create(
+                    Watchlist(list_id=listing, user_id=bidder)
+                    for listing in listings for bidder in rng.sample(bidders, options["watchers"]))
+        self.stdout.write(f"seeded {options['listings']} auctions ending in the same minute "
+                          f"in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        call_command("close_auctions", once=True, batch_size=options["batch_size"], stdout=StringIO())
+        elapsed = time.perf_counter() - start
+
+        if Listing.objects.filter(active_status=True).exists() or Watchlist.objects.exists():
+            raise CommandError("some auctions were left open or watched")
+        if Listing.objects.exclude(winner=F('current_bidder')).exists():
+            raise CommandError("some auctions were closed without their leading bidder as winner")
+        self.stdout.write(f"closed {options['listings']} auctions in {elapsed:.2f}s, "
+                          f"{options['listings'] / elapsed:.0f} per second")
+        self.stdout.write(self.style.SUCCESS("Every auction closed with its leading bidder as winner."))
+
@@ -0,0 +1,118 @@
+import asyncio
+import resource
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from auctions.events import broker, listing_channel
+from auctions.models import Listing, User
+from auctions.streaming import EventStreamApp
+
+
+# =========================================
+# 📡 Event Stream Benchmark
+# Opens many /listing/<id>/events streams on the ASGI app in this
+# process, logged in to listings in the test database, publishes events from another thread like a bidding view
+# would, and measures how long each takes to reach every stream.
+# =========================================
+class Command(BaseCommand):
+    help = "Measures memory per open listing event stream and how fast events reach all of them."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--subscribers", type=int, default=10000, help="open event streams")
+        parser.add_argument("--listings", type=int, default=1, help="listings the streams are spread over")
+        parser.add_argument("--events", type=int, default=20, help="events published per listing")
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            owner = User.objects.create(username="bench-owner")
+            self.list_ids = [Listing.objects.create(user=owner, title=f"Auction {i}", start_bid=10).id
+                             for i in range(options["listings"])]
+            # streams are refused without a logged in session
+            client = Client()
+            client.force_login(User.objects.create(username="bench-watcher"))
+            self.cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            asyncio.run(self.run(options["subscribers"], options["listings"], options["events"]))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    async def run(self, subscribers, listings, events):
+        async def django(scope, receive, send):
+            raise CommandError(f"{scope['path']} was not served as an event stream")
+
+        app = EventStreamApp(django)
+        loop = asyncio.get_running_loop()
+        hang_up = asyncio.Event()
+        opened = [0]
+        # event id -> streams it reached, and set once it reached all
+        delivered = {}
+        arrived = {}
+
+        def stream(list_id):
+            requested = False
+
+            async def receive():
+                nonlocal requested
+                if not requested:
+                    requested = True
+                    return {"type": "http.request"}
+                await hang_up.wait()
+                return {"type": "http.disconnect"}
+
+            async def send(message):
+                body = message.get("body", b"")
+                if body.startswith(b"retry:"):
+                    opened[0] += 1
+                elif body.startswith(b"id: "):
+                    event_id = int(body[4:body.index(b"\n")])
+                    delivered[event_id] = delivered.get(event_id, 0) + 1
+                    if delivered[event_id] == subscribers // listings:
+                        arrived.setdefault(event_id, asyncio.Event()).set()
+
+            scope = {"type": "http", "method": "GET", "path": f"/listing/{list_id}/events",
+                     "headers": [(b"host", b"localhost"), (b"cookie", self.cookie.encode())],
+                     "query_string": b""}
+            return app(scope, receive, send)
+
+        before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        tasks = [asyncio.create_task(stream(self.list_ids[i % listings])) for i in range(subscribers - subscribers % listings)]
+        while opened[0] < len(tasks):
+            await asyncio.sleep(0.01)
+        connect = time.perf_counter() - start
+        per_stream = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before) * 1024 / len(tasks)
+        self.stdout.write(f"opened {len(tasks)} streams on {listings} listings in {connect:.2f}s, "
+                          f"about {per_stream / 1024:.1f} KB each")
+
+        latencies = []
+        start = time.perf_counter()
+        for n in range(events):
+            for list_id in self.list_ids:
+                published = time.perf_counter()
+                # published from another thread, as bidding views do
+                event = await loop.run_in_executor(
+                    None, broker.publish, listing_channel(list_id), "bid", {'amount': n, 'bidder': "bench"})
+                waiter = arrived.setdefault(event.id, asyncio.Event())
+                if delivered.get(event.id, 0) < len(tasks) // listings:
+                    await waiter.wait()
+                latencies.append(time.perf_counter() - published)
+        elapsed = time.perf_counter() - start
+
+        hang_up.set()
+        await asyncio.gather(*tasks)
+        deliveries = sum(delivered.values())
+        if deliveries != len(tasks) * events:
+            raise CommandError(f"{deliveries} of {len(tasks) * events} events were delivered")
+
+        latencies.sort()
+        self.stdout.write(f"{events * listings} events to {len(tasks)} streams: "
+                          f"{deliveries / elapsed:.0f} deliveries/s, time to reach every stream "
+                          f"p50 {statistics.median(latencies) * 1000:.1f} ms, "
+                          f"max {latencies[-1] * 1000:.1f} ms")
+        self.stdout.write(self.style.SUCCESS("Every event reached every stream once."))
@@ -0,0 +1,111 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from auctions.models import Listing, User
+from auctions.search import SORTS, active_listings, encode_cursor, search_listings
+
+
+# =========================================
+# 🔎 Listing Search Benchmark
+# Seeds the test database with more and more listings and times
+# search.search_listings on its first page and half way through,
+# next to the OFFSET query it replaces. Keyset pages should take
+# about as long at every size.
+# =========================================
+WORDS = [f"{a}{b}" for a in ("red", "old", "big", "tiny", "rare", "used", "new", "gold", "oak", "iron")
+         for b in ("lamp", "book", "chair", "coin", "doll", "bike", "watch", "ring", "desk", "card",
+                   "vase", "clock", "shoe", "hat", "kit", "toy", "map", "cup", "pen", "bag")]
+CATEGORIES = [key for key, _ in Listing.CATEGORIES_CHOICES]
+
+SCENARIOS = {
+    "newest": {},
+    "newest in category": {'category': 'books'},
+    "price": {'sort': 'price'},
+    "price high, category": {'sort': '-price', 'category': 'toys'},
+    "ending soon": {'sort': 'ending'},
+    "price 100-200": {'sort': 'price', 'min_price': 100, 'max_price': 200},
+    "text": {'text': 'goldcoin'},
+}
+
+
+class Command(BaseCommand):
+    help = "Times listing search pages on a test database seeded with up to a million listings."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000,1000000",
+                            help="comma separated listing counts to measure at")
+        parser.add_argument("--repeat", type=int, default=20, help="runs per measurement")
+        parser.add_argument("--keep", action="store_true",
+                            help="keep the seeded test database and reuse it next time")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        old_name = connection.settings_dict["NAME"]
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options["keep"])
+        try:
+            rng = random.Random(options["seed"])
+            for size in sorted(int(size) for size in options["sizes"].split(",")):
+                self.seed(size, rng)
+                self.measure(size, options["repeat"])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options["keep"])
+
+    def seed(self, size, rng):
+        count = Listing.objects.count()
+        if count >= size:
+            return
+        owner, _ = User.objects.get_or_create(username="bench-owner")
+        now = timezone.now()
+        start = time.perf_counter()
+        while count < size:
+            batch = []
+            for _ in range(min(10000, size - count)):
+                start_bid = rng.randint(1, 1000)
+                batch.append(Listing(
+                    user=owner,
+                    title=" ".join(rng.sample(WORDS, 3)),
+                    desc=" ".join(rng.sample(WORDS, 8)),
+                    category=rng.choice(CATEGORIES),
+                    start_bid=start_bid,
+                    current_bid=start_bid + rng.randint(1, 500) if rng.random() < 0.5 else None,
+                    # a tenth are closed, most of the rest end in the next month
+                    active_status=rng.random() > 0.1,
+                    ends_at=now + timezone.timedelta(minutes=rng.randint(1, 43200))
+                    if rng.random() < 0.8 else None,
+                ))
+            with transaction.atomic():
+                Listing.objects.bulk_create(batch)
+            count += len(batch)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        self.stdout.write(f"seeded {size} listings in {time.perf_counter() - start:.1f}s")
+
+    def timed(self, repeat, run):
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings) * 1000
+
+    def measure(self, size, repeat):
+        self.stdout.write(f"{size} listings, ms per page of 20 (median of {repeat}):")
+        self.stdout.write(f"  {'':22} {'matches':>8} {'first':>7} {'middle':>7} {'OFFSET':>8}")
+        for name, filters in SCENARIOS.items():
+            field, _ = SORTS[filters.get('sort', 'newest')]
+            listings = active_listings(**filters)
+            matches = listings.count()
+            first = self.timed(repeat, lambda: search_listings(**filters))
+            middle = offset = float("nan")
+            if matches > 40:
+                # the page half way through, by cursor and by OFFSET
+                half = matches // 2
+                cursor = encode_cursor(*listings.values_list(field, 'id')[half - 1])
+                middle = self.timed(repeat, lambda: search_listings(after=cursor, **filters))
+                offset = self.timed(max(1, repeat // 4), lambda: list(listings[half:half + 20]))
+            self.stdout.write(f"  {name:22} {matches:8} {first:7.2f} {middle:7.2f} {offset:8.2f}")
@@ -0,0 +1,57 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from auctions.closing import BATCH_SIZE, close_due, next_due
+
+
+# =========================================
+# ⏰ Auction Closing Worker
+# Polls for listings past their end time on the partial index over
+# (ends_at, id) and closes them in batches, sleeping until the next
+# one ends. Run one of these next to the web workers.
+# =========================================
+class Command(BaseCommand):
+    help = "Closes auctions whose end time has passed, in batches, until stopped."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE,
+                            help="listings closed per transaction")
+        parser.add_argument("--interval", type=float, default=30,
+                            help="longest sleep in seconds, so new early endings are seen")
+        parser.add_argument("--once", action="store_true",
+                            help="close what is due now and exit")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                self.close_all(options["batch_size"])
+                if options["once"]:
+                    return
+                time.sleep(self.until_next(options["interval"]))
+        except KeyboardInterrupt:
+            self.stdout.write("Stopped.")
+
+    def close_all(self, batch_size):
+        start = time.perf_counter()
+        now = timezone.now()
+        total = 0
+        # batches keep each write short so bids aren't held up for long
+        while True:
+            closed = close_due(now, batch_size)
+            total += closed
+            if closed < batch_size:
+                break
+        if total:
+            self.stdout.write(f"closed {total} auctions in {time.perf_counter() - start:.2f}s")
+        return total
+
+    def until_next(self, interval):
+        ends_at = next_due()
+        # a long sleep shouldn't find the database connection gone
+        connection.close()
+        if ends_at is None:
+            return interval
+        return min(interval, max(0, (ends_at - timezone.now()).total_seconds()))
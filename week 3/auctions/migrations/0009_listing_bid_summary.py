@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:05
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill(apps, schema_editor):
+    # a copy of models.bid_summary as it was, so later changes to it
+    # don't change what this migration does
+    Listing = apps.get_model('auctions', 'Listing')
+    Bid = apps.get_model('auctions', 'Bid')
+    top = Bid.objects.filter(list_id=OuterRef('pk')).order_by('-amount', 'id')
+    count = (Bid.objects.filter(list_id=OuterRef('pk')).order_by()
+             .values('list_id').annotate(count=Count('id')).values('count'))
+    Listing.objects.update(
+        current_bid=Subquery(top.values('amount')[:1]),
+        current_bidder=Subquery(top.values('user_id')[:1]),
+        bid_count=Coalesce(Subquery(count), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0008_alter_listing_category_alter_listing_user_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='bid_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='current_bid',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='current_bidder',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='leading_bids', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
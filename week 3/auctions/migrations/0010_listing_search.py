@@ -0,0 +1,77 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:21
+
+import django.db.models.functions.comparison
+from django.db import migrations, models
+
+# Full-text index of listing titles and descriptions for SQLite, kept
+# in step by triggers. Other databases search with icontains, see
+# auctions.search.text_filter. Bids don't touch title or desc, so they
+# don't fire the update trigger. SQLite drops the triggers when Django
+# remakes the table for an AlterField, so such a migration must run
+# FTS_TABLE again.
+FTS_TABLE = [
+    """CREATE VIRTUAL TABLE auctions_listing_fts USING fts5(
+        title, "desc", content='auctions_listing', content_rowid='id')""",
+    """CREATE TRIGGER auctions_listing_fts_insert AFTER INSERT ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(rowid, title, "desc") VALUES (new.id, new.title, new."desc");
+    END""",
+    """CREATE TRIGGER auctions_listing_fts_delete AFTER DELETE ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(auctions_listing_fts, rowid, title, "desc")
+        VALUES ('delete', old.id, old.title, old."desc");
+    END""",
+    """CREATE TRIGGER auctions_listing_fts_update AFTER UPDATE OF title, "desc" ON auctions_listing BEGIN
+        INSERT INTO auctions_listing_fts(auctions_listing_fts, rowid, title, "desc")
+        VALUES ('delete', old.id, old.title, old."desc");
+        INSERT INTO auctions_listing_fts(rowid, title, "desc") VALUES (new.id, new.title, new."desc");
+    END""",
+    "INSERT INTO auctions_listing_fts(auctions_listing_fts) VALUES ('rebuild')",
+]
+
+
+def create_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in FTS_TABLE:
+            schema_editor.execute(statement)
+
+
+def drop_fts(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for trigger in ('insert', 'delete', 'update'):
+            schema_editor.execute(f"DROP TRIGGER auctions_listing_fts_{trigger}")
+        schema_editor.execute("DROP TABLE auctions_listing_fts")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auctions', '0009_listing_bid_summary'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='ends_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active_status', True)), fields=['category', 'id'], name='listing_category_newest'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(django.db.models.functions.comparison.Coalesce('current_bid', 'start_bid'), models.F('id'), condition=models.Q(('active_status', True)), name='listing_price'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(models.F('category'), django.db.models.functions.comparison.Coalesce('current_bid', 'start_bid'), models.F('id'), condition=models.Q(('active_status', True)), name='listing_category_price'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active_status', True)), fields=['ends_at', 'id'], name='listing_ending'),
+        ),
+        migrations.AddIndex(
+            model_name='listing',
+            index=models.Index(condition=models.Q(('active_status', True)), fields=['category', 'ends_at', 'id'], name='listing_category_ending'),
+        ),
+        migrations.RunPython(create_fts, drop_fts),
+    ]
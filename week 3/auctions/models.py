@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
 
 
 # =========================================
@@ -11,6 +13,11 @@ class User(AbstractUser):
     pass
 
 
+def current_price():
+    """The price a listing is at: its highest bid, or the starting bid."""
+    return Coalesce('current_bid', 'start_bid')
+
+
 # =========================================
 # 📦 Listing Model
 # Represents an item listed for auction.
@@ -62,6 +69,41 @@ class Listing(models.Model):
         related_name="bids_won"
     )
 
+    # Denormalized summary of the bids, kept up to date by Bid.save()
+    # so pages listing many auctions need no query per listing.
+    # "manage.py backfill_bids" recomputes it from the Bid table.
+    current_bid = models.IntegerField(blank=True, null=True)
+    current_bidder = models.ForeignKey(
+        User,
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name="leading_bids"
+    )
+    bid_count = models.PositiveIntegerField(default=0)
+
+    # When the auction ends, if it has an end
+    ends_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        # One index per way search.search_listings pages through active
+        # listings, with and without a category, so every page is read
+        # straight off an index however deep it is. They only hold
+        # active listings; newest first without a category walks the
+        # primary key.
+        indexes = [
+            models.Index(fields=['category', 'id'], condition=Q(active_status=True),
+                         name='listing_category_newest'),
+            models.Index(current_price(), F('id'), condition=Q(active_status=True),
+                         name='listing_price'),
+            models.Index(F('category'), current_price(), F('id'), condition=Q(active_status=True),
+                         name='listing_category_price'),
+            models.Index(fields=['ends_at', 'id'], condition=Q(active_status=True),
+                         name='listing_ending'),
+            models.Index(fields=['category', 'ends_at', 'id'], condition=Q(active_status=True),
+                         name='listing_category_ending'),
+        ]
+
     def __str__(self):
         """Return a human-readable representation of the Listing."""
         return f'{self.title}'
@@ -88,11 +130,51 @@ class Bid(models.Model):
     amount = models.IntegerField()
     winner = models.BooleanField(default=False)
 
+    def save(self, *args, update_listing=True, **kwargs):
+        """
+        Save the bid and, for a new bid, update the bid summary of its
+        listing in the same transaction. The update is a single
+        conditional UPDATE, so concurrent bids cannot lose counts; on
+        equal amounts the earlier bid stays the current one.
+        bidding.place_bid moves the listing itself and passes
+        update_listing=False.
+        """
+        created = self._state.adding
+        # within place_bid's transaction a savepoint would only cost time
+        with transaction.atomic(savepoint=False):
+            # the listing goes first, so post_save receivers see its new count
+            if created and update_listing:
+                higher = Q(current_bid__isnull=True) | Q(current_bid__lt=self.amount)
+                Listing.objects.filter(pk=self.list_id_id).update(
+                    bid_count=F('bid_count') + 1,
+                    current_bid=Case(When(higher, then=Value(self.amount)), default=F('current_bid'),
+                                     output_field=models.IntegerField()),
+                    current_bidder=Case(When(higher, then=Value(self.user_id_id)),
+                                        default=F('current_bidder'), output_field=models.IntegerField()),
+                )
+            super().save(*args, **kwargs)
+
     def __str__(self):
         """Return a readable representation of the Bid."""
         return f'{self.id}: {self.amount}'
 
 
+def bid_summary(bid_model):
+    """
+    Return the expressions that recompute Listing.current_bid,
+    current_bidder and bid_count from the bids in one UPDATE, for
+    the given Bid model.
+    """
+    top = bid_model.objects.filter(list_id=OuterRef('pk')).order_by('-amount', 'id')
+    count = (bid_model.objects.filter(list_id=OuterRef('pk')).order_by()
+             .values('list_id').annotate(count=Count('id')).values('count'))
+    return {
+        'current_bid': Subquery(top.values('amount')[:1]),
+        'current_bidder': Subquery(top.values('user_id')[:1]),
+        'bid_count': Coalesce(Subquery(count), 0),
+    }
+
+
 # =========================================
 # 💬 Comment Model
 # Stores user comments on specific listings.
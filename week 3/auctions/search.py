@@ -0,0 +1,128 @@
+import base64
+import binascii
+import json
+
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.dateparse import parse_datetime
+
+from .models import Listing, current_price
+
+
+# =========================================
+# 🔎 Listing Search
+# Pages through active listings with keyset pagination: each page
+# starts after the sort key and id of the last listing shown, so the
+# database reads one page off an index (see Listing.Meta.indexes)
+# instead of counting past every listing before it as OFFSET does.
+# =========================================
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# sort name -> (field, descending). Ties are broken by id, so that
+# every listing has a distinct place to start a page after.
+SORTS = {
+    'newest': ('id', True),
+    'price': ('price', False),
+    '-price': ('price', True),
+    'ending': ('ends_at', False),
+}
+
+
+class InvalidCursor(ValueError):
+    """Raised for a page cursor that wasn't made by search_listings."""
+
+
+def encode_cursor(value, pk):
+    if hasattr(value, 'isoformat'):
+        value = value.isoformat()
+    return base64.urlsafe_b64encode(json.dumps([value, pk]).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, field):
+    try:
+        value, pk = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, ValueError, TypeError):
+        raise InvalidCursor(cursor)
+    try:
+        if field == 'ends_at':
+            value = parse_datetime(value) if isinstance(value, str) else None
+        elif not is_integer(value):
+            value = None
+    except ValueError:
+        # a well formed date that doesn't exist
+        value = None
+    if not is_integer(pk) or value is None:
+        raise InvalidCursor(cursor)
+    return value, pk
+
+
+def is_integer(value):
+    # bools are ints too, and SQLite has none wider than 64 bits
+    return type(value) is int and -2 ** 63 <= value < 2 ** 63
+
+
+def text_filter(text):
+    """
+    Return a filter for listings whose title or description has every
+    word of text, as a word prefix on SQLite (which has the full-text
+    index from migration 0010) and as a substring elsewhere.
+    """
+    words = text.split()
+    if connection.vendor == 'sqlite':
+        query = ' '.join('"%s"*' % word.replace('"', '""') for word in words)
+        return Q(id__in=RawSQL(
+            "SELECT rowid FROM auctions_listing_fts WHERE auctions_listing_fts MATCH %s", [query]))
+    match = Q()
+    for word in words:
+        match &= Q(title__icontains=word) | Q(desc__icontains=word)
+    return match
+
+
+def active_listings(category=None, text=None, min_price=None, max_price=None, sort='newest'):
+    """
+    Return the active listings matching the filters in the order of
+    sort, annotated with their current price.
+    """
+    field, descending = SORTS[sort]
+    listings = Listing.objects.filter(active_status=True).annotate(price=current_price())
+    if category:
+        listings = listings.filter(category=category)
+    if text and text.split():
+        listings = listings.filter(text_filter(text))
+    if min_price is not None:
+        listings = listings.filter(price__gte=min_price)
+    if max_price is not None:
+        listings = listings.filter(price__lte=max_price)
+    if field == 'ends_at':
+        listings = listings.filter(ends_at__isnull=False)
+    order = [f'-{field}', '-id'] if descending else [field, 'id']
+    return listings.order_by(*dict.fromkeys(order))
+
+
+def search_listings(after=None, limit=PAGE_SIZE, **filters):
+    """
+    Return a page of active_listings(**filters) and the cursor of the
+    next page, None on the last one. Raises InvalidCursor if after is
+    not a cursor from this function for the same sort.
+    """
+    field, descending = SORTS[filters.get('sort', 'newest')]
+    listings = active_listings(**filters)
+    if after:
+        value, pk = decode_cursor(after, field)
+        op = 'lt' if descending else 'gt'
+        if field == 'id':
+            listings = listings.filter(**{f'id__{op}': pk})
+        else:
+            # the first filter alone is a range on the index, the
+            # second only skips the ties already shown
+            listings = listings.filter(**{f'{field}__{op}e': value}).filter(
+                Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk}))
+
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    page = list(listings[:limit + 1])
+    if len(page) <= limit:
+        return page, None
+    last = page[limit - 1]
+    return page[:limit], encode_cursor(getattr(last, field), last.id)
@@ -0,0 +1,94 @@
+// =========================================
+// 🔴 Live Listing Updates
+// Follows the bids, comments and close of the listing on the page
+// over Server-Sent Events (see auctions/streaming.py), so watchers
+// don't have to reload it.
+// =========================================
+(function () {
+    const live = document.getElementById('live');
+    if (!live || !window.EventSource) {
+        return;
+    }
+
+    let current = Number(live.dataset.current);
+    let count = Number(live.dataset.count);
+    const start = Number(live.dataset.start);
+
+    // events after data-after are not in the page yet; on reconnects
+    // the browser sends the id of the last one it got instead
+    const source = new EventSource(live.dataset.url + '?after=' + live.dataset.after);
+
+    function reload() {
+        source.close();
+        window.location.reload();
+    }
+
+    // 💰 the highest amount is the current bid and the highest count the
+    // number of bids; a bid the page already shows changes neither
+    source.addEventListener('bid', function (message) {
+        const bid = JSON.parse(message.data);
+        count = Math.max(count, bid.count);
+        document.querySelectorAll('.bid-count').forEach(function (element) {
+            element.textContent = count;
+        });
+        if (bid.amount <= current) {
+            return;
+        }
+        current = bid.amount;
+
+        const shown = document.getElementById('current-bid');
+        if (!shown) {
+            // the first bid changes too much of the page
+            reload();
+            return;
+        }
+        shown.textContent = current;
+
+        const margin = document.getElementById('bid-margin');
+        if (margin) {
+            margin.textContent = current - start;
+        }
+        const input = document.querySelector('input[name="bid_amount"]');
+        if (input) {
+            input.min = current + 1;
+        }
+        const status = document.getElementById('bid-status');
+        if (status) {
+            status.textContent = bid.bidder === live.dataset.user
+                ? 'Your bid is the current bid.'
+                : 'Place bids to become the highest bidder.';
+        }
+    });
+
+    // 💬 new comments go at the end of the list, once
+    source.addEventListener('comment', function (message) {
+        const comment = JSON.parse(message.data);
+        if (document.querySelector('[data-comment-id="' + comment.id + '"]')) {
+            return;
+        }
+        const empty = document.getElementById('no-comments');
+        if (empty) {
+            empty.remove();
+        }
+
+        const body = document.createElement('div');
+        body.className = 'card-body p-4';
+        body.dataset.commentId = comment.id;
+        const name = document.createElement('h6');
+        name.className = 'fw-bold mb-1';
+        name.textContent = comment.user;
+        const text = document.createElement('p');
+        text.className = 'mb-0';
+        text.textContent = comment.comment;
+        body.append(name, text);
+
+        const rule = document.createElement('hr');
+        rule.className = 'my-0';
+        document.getElementById('comments').append(rule, body);
+    });
+
+    // 🔒 a closed listing shows the winner, and a reset means events
+    // were missed while disconnected: both need the page from the server
+    source.addEventListener('close', reload);
+    source.addEventListener('reset', reload);
+})();
@@ -0,0 +1,139 @@
+import asyncio
+import functools
+import re
+from importlib import import_module
+from io import BytesIO
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+
+from .events import broker, listing_channel
+from .models import Listing
+
+
+# =========================================
+# 🔴 Live Listing Streams
+# An ASGI app in front of Django (see commerce/asgi.py) that serves
+# /listing/<id>/events as Server-Sent Events itself. A Django request
+# keeps a thread for as long as it is open, which ten thousand open
+# streams can't afford; here a stream is one task and a few buffers.
+# =========================================
+EVENTS_PATH = re.compile(r"^/listing/(\d+)/events$")
+
+HEADERS = [
+    (b"content-type", b"text/event-stream"),
+    (b"cache-control", b"no-cache"),
+    # keep proxies like nginx from holding events back
+    (b"x-accel-buffering", b"no"),
+]
+
+
+# every stream of a listing sends the same few recent events
+@functools.lru_cache(maxsize=1024)
+def sse(event):
+    """Return an Event as Server-Sent Events text."""
+    return f"id: {event.id}\nevent: {event.kind}\ndata: {event.data}\n\n".encode()
+
+
+def last_event_id(scope):
+    """
+    Return the id of the last event the client has, from the
+    Last-Event-ID header EventSource sends when it reconnects or the
+    "after" parameter the page starts with, or None.
+    """
+    value = dict(scope["headers"]).get(b"last-event-id", b"").decode("latin-1")
+    if not value:
+        value = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("after", [""])[0]
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return None
+
+
+def refusal(scope, list_id):
+    """
+    Return the status a stream is refused with, or None to serve it.
+    Streams don't go through Django's middleware, so the checks the
+    listing page gets from it are made here: a Host in ALLOWED_HOSTS,
+    a logged in user and a listing that is still open.
+    """
+    request = ASGIRequest(scope, BytesIO())
+    try:
+        request.get_host()
+    except DisallowedHost:
+        return 400
+    engine = import_module(settings.SESSION_ENGINE)
+    request.session = engine.SessionStore(request.COOKIES.get(settings.SESSION_COOKIE_NAME))
+    if not get_user(request).is_authenticated:
+        return 403
+    if not Listing.objects.filter(pk=list_id, active_status=True).exists():
+        return 404
+    return None
+
+
+class EventStreamApp:
+    """Serve listing event streams and hand every other request to application."""
+
+    def __init__(self, application):
+        self.application = application
+        # seconds between keep-alive comments on an idle stream
+        self.heartbeat = getattr(settings, "AUCTION_EVENTS", {}).get("HEARTBEAT", 15)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["method"] == "GET":
+            match = EVENTS_PATH.match(scope["path"])
+            if match:
+                return await self.stream(int(match.group(1)), scope, receive, send)
+        await self.application(scope, receive, send)
+
+    async def stream(self, list_id, scope, receive, send):
+        # one trip to a database thread for the session, user and listing
+        status = await sync_to_async(refusal)(scope, list_id)
+        if status is not None:
+            # EventSource doesn't reconnect after an error status
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        task = asyncio.current_task()
+        disconnected = False
+
+        async def watch():
+            # the request has no body, so the next message is the disconnect
+            nonlocal disconnected
+            while (await receive())["type"] != "http.disconnect":
+                pass
+            disconnected = True
+            task.cancel()
+
+        watcher = asyncio.create_task(watch())
+        # pages send what they have; others get what happens from now on,
+        # even if it happens before the generator first runs
+        after = last_event_id(scope)
+        if after is None:
+            after = broker.position()
+        events = broker.listen(listing_channel(list_id), after, self.heartbeat)
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": HEADERS})
+            # reconnect after 3s if the connection drops
+            await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+            async for event in events:
+                if event is None:
+                    await send({"type": "http.response.body", "body": b": ping\n\n", "more_body": True})
+                    continue
+                # a closed listing has nothing more to say
+                closed = event.kind == "close"
+                await send({"type": "http.response.body", "body": sse(event), "more_body": not closed})
+                if closed:
+                    break
+        except asyncio.CancelledError:
+            if not disconnected:
+                raise
+        finally:
+            watcher.cancel()
+            await events.aclose()
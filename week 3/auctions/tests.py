@@ -1,3 +1,467 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import threading
+from io import StringIO
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from asgiref.testing import ApplicationCommunicator
+from django.core.asgi import get_asgi_application
+from django.core.management import call_command
+from django.utils import timezone
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+
+from .bidding import BidRejected, place_bid
+from .closing import close_due, close_listings
+from .events import LocalBroker, broker, listing_channel
+from .models import Bid, Comment, Listing, User, Watchlist
+from .search import SORTS, InvalidCursor, encode_cursor, search_listings
+from .streaming import EventStreamApp, last_event_id
+
+
+# =========================================
+# 💰 Bid Summary
+# Listing.current_bid, current_bidder and bid_count follow the bids.
+# =========================================
+class BidSummaryTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.bidders = [User.objects.create(username=f"bidder{i}") for i in range(3)]
+
+    def make_listings(self, count):
+        listings = Listing.objects.bulk_create(
+            Listing(user=self.owner, title=f"Item {i}", start_bid=10, category="books")
+            for i in range(count))
+        for listing in listings:
+            for amount, bidder in zip((20, 30, 25), self.bidders):
+                Bid.objects.create(list_id=listing, user_id=bidder, amount=amount)
+            Watchlist.objects.create(list_id=listing, user_id=self.bidders[0])
+        return listings
+
+    def test_summary_follows_bids(self):
+        listing, = self.make_listings(1)
+        Bid.objects.create(list_id=listing, user_id=self.bidders[2], amount=30)
+        listing.refresh_from_db()
+        # on equal amounts the earlier bid stays the current one
+        self.assertEqual((listing.current_bid, listing.current_bidder, listing.bid_count),
+                         (30, self.bidders[1], 4))
+
+    def test_backfill_recomputes_summary(self):
+        listing, = self.make_listings(1)
+        Listing.objects.update(current_bid=None, current_bidder=None, bid_count=0)
+        call_command("backfill_bids", batch_size=1, stdout=StringIO())
+        listing.refresh_from_db()
+        self.assertEqual((listing.current_bid, listing.current_bidder, listing.bid_count),
+                         (30, self.bidders[1], 3))
+
+    def count_queries(self, path, listings):
+        self.make_listings(listings)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertContains(response, "Current Bid: $30")
+        return len(queries)
+
+    def test_index_queries_do_not_grow_with_listings(self):
+        few = self.count_queries("/", 2)
+        self.assertEqual(self.count_queries("/", 20), few)
+
+    def test_watchlist_queries_do_not_grow_with_listings(self):
+        self.client.force_login(self.bidders[0])
+        few = self.count_queries("/watchlist", 2)
+        self.assertEqual(self.count_queries("/watchlist", 20), few)
+
+    def test_listing_page_and_close_use_summary(self):
+        listing, = self.make_listings(1)
+        self.client.force_login(self.bidders[1])
+        response = self.client.get(f"/listing/{listing.id}")
+        self.assertContains(response, "Current Bid: $<span id=\"current-bid\">30</span>")
+        self.assertContains(response, "<span class=\"bid-count\">3</span> bids placed so far.")
+        self.assertContains(response, "Your bid is the current bid.")
+
+        self.client.force_login(self.owner)
+        self.client.post(f"/listing/{listing.id}", {"close": ""})
+        listing.refresh_from_db()
+        self.assertEqual((listing.active_status, listing.winner), (False, self.bidders[1]))
+        self.assertFalse(listing.watchlisted.exists())
+
+
+# =========================================
+# 🏁 Concurrent Bidding
+# Racing bidders never get two bids accepted out of order.
+# =========================================
+class PlaceBidTests(TransactionTestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.listing = Listing.objects.create(user=self.owner, title="Hot item", start_bid=10)
+
+    def test_rejected_bids(self):
+        with self.assertRaisesMessage(BidRejected, "at least the starting bid"):
+            place_bid(self.listing.id, self.owner, 9)
+        place_bid(self.listing.id, self.owner, 10)
+        with self.assertRaisesMessage(BidRejected, "higher than current bid"):
+            place_bid(self.listing.id, self.owner, 10)
+        Listing.objects.filter(pk=self.listing.id).update(active_status=False)
+        with self.assertRaisesMessage(BidRejected, "closed"):
+            place_bid(self.listing.id, self.owner, 100)
+
+    def test_malformed_amounts_are_refused(self):
+        bidder = User.objects.create(username="bidder")
+        self.client.force_login(bidder)
+        for amount in ("", "abc", "--5", "-5", "²", "1" * 30, "2147483648"):
+            with self.subTest(amount=amount):
+                response = self.client.post(f"/listing/{self.listing.id}",
+                                            {"bid": "", "bid_amount": amount}, follow=True)
+                self.assertContains(response, "Enter a valid bid amount.")
+        self.assertFalse(self.listing.bids.exists())
+
+    def test_concurrent_bids_stay_ordered(self):
+        bidders = [User.objects.create(username=f"bidder{i}") for i in range(8)]
+        errors = []
+
+        def bid(user, seed):
+            rng = random.Random(seed)
+            try:
+                for _ in range(40):
+                    current = Listing.objects.values_list("current_bid", flat=True).get(pk=self.listing.id)
+                    # often the same amount another bidder is sending
+                    try:
+                        place_bid(self.listing.id, user, (current or 9) + rng.randint(1, 2))
+                    except BidRejected:
+                        pass
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=bid, args=(user, i)) for i, user in enumerate(bidders)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+        amounts = list(self.listing.bids.order_by("id").values_list("amount", flat=True))
+        self.assertGreater(len(amounts), 40)
+        self.assertTrue(all(a < b for a, b in zip(amounts, amounts[1:])))
+        self.listing.refresh_from_db()
+        self.assertEqual((self.listing.current_bid, self.listing.bid_count), (amounts[-1], len(amounts)))
+        self.assertEqual(self.listing.bids.get(amount=amounts[-1]).user_id, self.listing.current_bidder)
+
+
+# =========================================
+# 📡 Listing Events
+# Bids, comments and closes are streamed to listing pages.
+# =========================================
+class ListingEventTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.bidder = User.objects.create(username="bidder")
+        self.listing = Listing.objects.create(user=self.owner, title="Hot item", start_bid=10)
+
+    def test_broker_replays_missed_events(self):
+        broker = LocalBroker(buffer=2)
+        start = broker.position()
+        ids = [broker.publish("a", "bid", {'amount': amount}).id for amount in (10, 11, 12)]
+        broker.publish("b", "bid", {'amount': 5})
+
+        async def first(after, channel="a", timeout=None):
+            events = broker.listen(channel, after, timeout)
+            try:
+                return await anext(events)
+            finally:
+                await events.aclose()
+
+        # the buffer still has the last two events, the first is gone
+        self.assertEqual(json.loads(asyncio.run(first(ids[0])).data), {'amount': 11})
+        self.assertEqual(asyncio.run(first(start)).kind, "reset")
+        # an id this broker never gave out, e.g. from before a restart
+        self.assertEqual(asyncio.run(first(ids[-1] + 100)).kind, "reset")
+        # a heartbeat when nothing happens
+        self.assertIsNone(asyncio.run(first(None, "c", timeout=0.01)))
+
+    def test_broker_forgets_least_recently_used_channels(self):
+        broker = LocalBroker(max_channels=2)
+        start = broker.position()
+        broker.publish("a", "bid", {})
+        broker.publish("b", "bid", {})
+        broker.publish("a", "bid", {})
+        broker.publish("c", "bid", {})
+        self.assertEqual(list(broker._channels), ["a", "c"])
+        # "b" comes back empty, so what it held can't be replayed
+        self.assertGreater(broker._channel("b").floor, start)
+
+        # with every channel listened to, a new one is kept all the same
+        for channel in broker._channels.values():
+            channel.subscribers = 1
+        channel = broker._channel("d")
+        self.assertIs(broker._channels["d"], channel)
+        broker.publish("d", "bid", {})
+        self.assertEqual(len(channel.events), 1)
+
+    def test_last_event_id_from_header_or_query(self):
+        scope = {'headers': [(b"last-event-id", b"12")], 'query_string': b"after=7"}
+        self.assertEqual(last_event_id(scope), 12)
+        self.assertEqual(last_event_id({'headers': [], 'query_string': b"after=7"}), 7)
+        for value in (b"", b"x", "²".encode()):
+            self.assertIsNone(last_event_id({'headers': [(b"last-event-id", value)], 'query_string': b""}))
+
+    def test_stream_without_asgi_tells_page_to_stop(self):
+        self.client.force_login(self.bidder)
+        response = self.client.get(f"/listing/{self.listing.id}")
+        self.assertContains(response, f'data-url="/listing/{self.listing.id}/events"')
+        self.assertEqual(self.client.get(f"/listing/{self.listing.id}/events").status_code, 204)
+
+    def test_only_closing_publishes_close(self):
+        with patch.object(broker, "publish") as publish:
+            self.publish(lambda: Listing.objects.filter(pk=self.listing.id).update(active_status=False))
+            self.listing.refresh_from_db()
+            # e.g. an admin edit of a listing closed before
+            self.listing.title = "Renamed"
+            self.publish(self.listing.save)
+        publish.assert_not_called()
+
+    def test_events_carry_what_the_page_dedupes_on(self):
+        comment = Comment.objects.create(list_id=self.listing, user_id=self.bidder, comment="First")
+        self.client.force_login(self.bidder)
+        self.assertContains(self.client.get(f"/listing/{self.listing.id}"),
+                            f'data-comment-id="{comment.id}"')
+
+        channel = listing_channel(self.listing.id)
+        with patch.object(broker, "publish") as publish:
+            self.publish(lambda: place_bid(self.listing.id, self.bidder, 15))
+            self.publish(lambda: Bid.objects.create(list_id=self.listing, user_id=self.owner, amount=20))
+        self.assertEqual([call.args for call in publish.call_args_list], [
+            (channel, "bid", {'amount': 15, 'bidder': "bidder", 'count': 1}),
+            (channel, "bid", {'amount': 20, 'bidder': "owner", 'count': 2}),
+        ])
+
+    def publish(self, action):
+        # in the thread with the test's connection, which async tests
+        # reach through sync_to_async
+        with self.captureOnCommitCallbacks(execute=True):
+            action()
+
+    def stream(self, list_id, host=b"testserver", user=None):
+        headers = [(b"host", host)]
+        if user:
+            self.client.force_login(user)
+            headers.append((b"cookie", f"sessionid={self.client.cookies['sessionid'].value}".encode()))
+        return ApplicationCommunicator(EventStreamApp(get_asgi_application()), {
+            'type': 'http', 'method': 'GET', 'path': f"/listing/{list_id}/events",
+            'headers': headers, 'query_string': b"",
+        })
+
+    async def test_stream_is_refused_like_the_listing_page(self):
+        closed = await Listing.objects.acreate(
+            user=self.owner, title="Sold", start_bid=10, active_status=False)
+        cases = [
+            (self.listing.id, b"testserver", None, 403),
+            (self.listing.id, b"evil.example", self.bidder, 400),
+            (closed.id, b"testserver", self.bidder, 404),
+            (closed.id + 1, b"testserver", self.bidder, 404),
+        ]
+        for list_id, host, user, status in cases:
+            with self.subTest(list_id=list_id, host=host, user=user):
+                stream = await sync_to_async(self.stream)(list_id, host, user)
+                await stream.send_input({'type': 'http.request'})
+                self.assertEqual((await stream.receive_output())['status'], status)
+                self.assertFalse((await stream.receive_output()).get('more_body'))
+                await stream.wait()
+
+    async def test_stream_sends_bids_comments_and_close(self):
+        stream = await sync_to_async(self.stream)(self.listing.id, user=self.bidder)
+        await stream.send_input({'type': 'http.request'})
+        self.assertEqual((await stream.receive_output())['status'], 200)
+        self.assertEqual((await stream.receive_output())['body'], b"retry: 3000\n\n")
+
+        def bid_and_comment():
+            place_bid(self.listing.id, self.bidder, 15)
+            Comment.objects.create(list_id=self.listing, user_id=self.bidder, comment="Mine!")
+
+        await sync_to_async(self.publish)(bid_and_comment)
+        bid = (await stream.receive_output())['body'].decode()
+        self.assertIn('event: bid\ndata: {"amount": 15, "bidder": "bidder", "count": 1}', bid)
+        comment = (await stream.receive_output())['body'].decode()
+        comment_id = await Comment.objects.values_list('id', flat=True).aget(comment="Mine!")
+        self.assertIn('event: comment\ndata: {"id": %d, "user": "bidder", "comment": "Mine!"}' % comment_id, comment)
+
+        await sync_to_async(self.publish)(lambda: close_listings(Listing.objects.filter(pk=self.listing.id)))
+        close = await stream.receive_output()
+        self.assertIn(b"event: close", close['body'])
+        # the stream ends with the auction
+        self.assertFalse(close['more_body'])
+        await stream.wait()
+
+
+# =========================================
+# 🔎 Listing Search
+# Keyset pages, filters and the indexes they run on.
+# =========================================
+class SearchTests(TestCase):
+
+    def setUp(self):
+        owner = User.objects.create(username="owner")
+        now = timezone.now()
+        # few distinct prices and end times, so pages split ties
+        self.listings = Listing.objects.bulk_create(
+            Listing(user=owner, title=f"{['Red', 'Blue'][i % 2]} lamp {i}", desc="A lamp",
+                    start_bid=10 + i % 4, category=['books', 'toys'][i % 3 == 0],
+                    ends_at=now + timezone.timedelta(hours=i % 5) if i % 7 else None)
+            for i in range(45))
+        Listing.objects.filter(pk=self.listings[0].pk).update(current_bid=100)
+        Listing.objects.filter(pk=self.listings[1].pk).update(active_status=False)
+
+    def all_pages(self, **filters):
+        seen, cursor = [], None
+        while True:
+            page, cursor = search_listings(after=cursor, limit=4, **filters)
+            seen += page
+            if cursor is None:
+                return seen
+
+    def test_pages_cover_every_listing_once_in_order(self):
+        for sort, (field, descending) in SORTS.items():
+            for filters in ({}, {'category': 'toys'}, {'min_price': 11, 'max_price': 12}):
+                with self.subTest(sort=sort, **filters):
+                    expected = list(search_listings(sort=sort, limit=100, **filters)[0])
+                    keys = [(getattr(listing, field), listing.id) for listing in expected]
+                    self.assertEqual(keys, sorted(keys, reverse=descending))
+                    self.assertEqual(self.all_pages(sort=sort, **filters), expected)
+
+        prices = [listing.price for listing in self.all_pages(min_price=11, max_price=100)]
+        self.assertIn(100, prices)
+        self.assertTrue(all(11 <= price <= 100 for price in prices))
+
+    def test_text_search(self):
+        found = self.all_pages(text="red LAM")
+        self.assertEqual(len(found), 23)
+        self.assertTrue(all(listing.title.startswith("Red") for listing in found))
+        # the full-text index follows edits
+        Listing.objects.filter(pk=self.listings[2].pk).update(title="Green lamp")
+        self.assertEqual([listing.id for listing in self.all_pages(text="green")], [self.listings[2].id])
+
+    def test_pages_are_read_off_an_index(self):
+        for sort in SORTS:
+            for filters in ({}, {'category': 'toys'}, {'min_price': 11}):
+                with self.subTest(sort=sort, **filters):
+                    after = search_listings(sort=sort, limit=4, **filters)[1]
+                    with CaptureQueriesContext(connection) as queries:
+                        search_listings(sort=sort, after=after, **filters)
+                    with connection.cursor() as plan:
+                        plan.execute("EXPLAIN QUERY PLAN " + queries[0]['sql'])
+                        steps = " ".join(row[-1] for row in plan.fetchall())
+                    self.assertNotIn("TEMP B-TREE", steps)
+                    self.assertRegex(steps, "USING (INDEX listing_|INTEGER PRIMARY KEY)")
+
+    def test_index_pages_and_api(self):
+        response = self.client.get("/", {'sort': 'price', 'q': 'lamp'})
+        self.assertEqual(len(response.context['listings']), 20)
+        next_page = response.context['next_page']
+        self.assertContains(response, f'href="?{next_page}"'.replace('&', '&amp;'))
+        second = self.client.get(f"/?{next_page}").context['listings']
+        self.assertGreaterEqual(second[0].price, response.context['listings'][-1].price)
+
+        # a broken or forged cursor starts over, odd prices are ignored
+        self.assertEqual(self.client.get("/", {'after': 'nonsense'}).status_code, 200)
+        for sort, key in (('price', "x"), ('price', [1]), ('newest', True), ('price', 2 ** 70),
+                          ('ending', "2026-13-45T00:00:00"), ('ending', 5)):
+            with self.subTest(sort=sort, key=key):
+                after = encode_cursor(key, 1)
+                with self.assertRaises(InvalidCursor):
+                    search_listings(after=after, sort=sort)
+                response = self.client.get("/", {'sort': sort, 'after': after, 'min': '²', 'max': '9' * 30})
+                self.assertEqual(len(response.context['listings']), 20)
+
+        data = self.client.get("/api/listings", {'category': 'toys', 'sort': '-price'}).json()
+        self.assertEqual(len(data['listings']), 15)
+        self.assertIsNone(data['next'])
+        self.assertEqual(data['listings'][0]['price'], 100)
+
+
+# =========================================
+# ⏰ Closing Auctions
+# close_auctions closes listings past their end in batches.
+# =========================================
+class ClosingTests(TestCase):
+
+    def setUp(self):
+        self.owner = User.objects.create(username="owner")
+        self.bidder = User.objects.create(username="bidder")
+        self.now = timezone.now()
+
+    def make_listings(self, count, ends_in):
+        listings = Listing.objects.bulk_create(
+            Listing(user=self.owner, title=f"Item {i}", start_bid=10, ends_at=self.now + ends_in)
+            for i in range(count))
+        for listing in listings:
+            Bid.objects.create(list_id=listing, user_id=self.bidder, amount=20)
+            Watchlist.objects.create(list_id=listing, user_id=self.bidder)
+        return listings
+
+    def test_worker_closes_due_auctions_in_batches(self):
+        due = self.make_listings(5, timezone.timedelta(minutes=-1))
+        later = self.make_listings(1, timezone.timedelta(hours=1))
+        Listing.objects.create(user=self.owner, title="No end", start_bid=10)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            call_command("close_auctions", once=True, batch_size=2, stdout=StringIO())
+        self.assertEqual(len(callbacks), 5)
+
+        closed = Listing.objects.filter(active_status=False)
+        self.assertEqual(sorted(closed.values_list('id', flat=True)), [listing.id for listing in due])
+        self.assertTrue(all(listing.winner == self.bidder for listing in closed))
+        self.assertEqual(list(Watchlist.objects.values_list('list_id', flat=True)), [later[0].id])
+
+    def test_queries_per_batch_do_not_grow(self):
+        self.make_listings(1, timezone.timedelta(minutes=-2))
+        self.make_listings(20, timezone.timedelta(minutes=-1))
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(close_due(batch_size=1), 1)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(close_due(batch_size=100), 20)
+        self.assertEqual(len(many), len(one))
+
+    def test_only_active_listings_are_closed(self):
+        active, closed = self.make_listings(2, timezone.timedelta(hours=1))
+        Listing.objects.filter(pk=closed.pk).update(active_status=False)
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(close_listings(Listing.objects.filter(user=self.owner)), 1)
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(list(Watchlist.objects.values_list('list_id', flat=True)), [closed.id])
+        self.assertFalse(Listing.objects.filter(active_status=True).exists())
+
+    def test_bids_after_the_end_are_rejected(self):
+        listing, = self.make_listings(1, timezone.timedelta(seconds=-1))
+        with self.assertRaisesMessage(BidRejected, "ended"):
+            place_bid(listing.id, self.bidder, 50)
+
+    def test_closed_page_says_how_it_closed(self):
+        ended, = self.make_listings(1, timezone.timedelta(minutes=-1))
+        unsold = Listing.objects.create(user=self.owner, title="Unsold", start_bid=10,
+                                        ends_at=self.now - timezone.timedelta(minutes=1))
+        closed = Listing.objects.create(user=self.owner, title="Withdrawn", start_bid=10)
+        close_due()
+        close_listings(Listing.objects.filter(pk=closed.pk))
+
+        self.client.force_login(self.bidder)
+        response = self.client.get(f"/listing/{ended.id}")
+        self.assertContains(response, "The auction has ended.")
+        self.assertContains(response, "You have won this bidding with bid of $20")
+        response = self.client.get(f"/listing/{unsold.id}")
+        self.assertContains(response, "The auction has ended.")
+        self.assertContains(response, "No bids were placed.")
+        self.assertNotContains(response, "$None")
+        response = self.client.get(f"/listing/{closed.id}")
+        self.assertContains(response, "The listing is closed by the owner.")
+        self.assertContains(response, "No bids were placed.")
+
+        self.client.force_login(self.owner)
+        response = self.client.get(f"/listing/{unsold.id}")
+        self.assertContains(response, "The auction has ended.")
+        self.assertNotContains(response, "$None")
@@ -15,6 +15,9 @@ urlpatterns = [
     # 📄 Listing Detail (Individual auction listing)
     path("listing/<int:list_id>", views.listing, name="listing"),
 
+    # 🔴 Live bids and comments of a listing (served by commerce/asgi.py)
+    path("listing/<int:list_id>/events", views.listing_events, name="listing_events"),
+
     # 🚪 Logout page
     path("logout", views.logout_view, name="logout"),
 
@@ -36,6 +39,9 @@ urlpatterns = [
     # 🧾 Register New User
     path("register", views.register, name="register"),
 
+    # 📤 Listing search as JSON, paged like the homepage
+    path("api/listings", views.listings_api, name="listings_api"),
+
     # ⚠️ Custom Not Found Page
     path("notfound", views.not_found, name="not_found"),
 ]
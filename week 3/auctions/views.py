@@ -1,40 +1,92 @@
 from multiprocessing import context
 from django.contrib.auth import authenticate, login, logout
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, redirect
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.db.models import Max
 
-from .models import User, Listing, Bid, Comment, Watchlist
+from .models import User, Listing, Comment, Watchlist
+from .bidding import BidRejected, parse_amount, place_bid
+from .closing import close_listings
+from .events import broker
+from .search import SORTS, InvalidCursor, search_listings
 from .forms import NewItem
 from commerce.settings import LOGIN_REDIRECT_URL
 
 
+# ==========================
+# 🔎 LISTING SEARCH
+# ==========================
+def listing_search(request, category=None):
+    """
+    Return a page of active listings for the filters in the query
+    string (q, min, max, sort and the page cursor after), and the
+    query string of the next page, None on the last one.
+    """
+    params = request.GET
+    sort = params.get('sort') if params.get('sort') in SORTS else 'newest'
+    min_price, max_price = [parse_amount(params.get(name)) for name in ('min', 'max')]
+    filters = dict(category=category, text=params.get('q', ''), min_price=min_price,
+                   max_price=max_price, sort=sort)
+
+    try:
+        listings, cursor = search_listings(after=params.get('after'), **filters)
+    except InvalidCursor:
+        # a mangled link starts over at the first page
+        listings, cursor = search_listings(**filters)
+
+    next_page = None
+    if cursor:
+        query = params.copy()
+        query['after'] = cursor
+        next_page = query.urlencode()
+    return listings, next_page
+
+
 # ==========================
 # 🏠 INDEX PAGE
 # ==========================
 def index(request):
     """
-    Display all active listings on the homepage.
+    Display a page of active listings on the homepage, filtered and
+    sorted as asked in the query string.
     Each listing includes its highest bid and readable category name.
+    The highest bid is stored on the listing, so this is a single query.
     """
-    listings = Listing.objects.filter(active_status=True)
+    listings, next_page = listing_search(request)
 
-    # Attach category name and highest bid to each listing
+    # Attach readable category name to each listing
     for item in listings:
         item.category = item.get_category_display()
-        highest_amount_dict = item.bids.aggregate(Max('amount'))
-        highest_amount = highest_amount_dict['amount__max']
-        if highest_amount:
-            item.bid = item.bids.get(amount=highest_amount)
 
-    context = {'listings': listings}
+    context = {'listings': listings, 'next_page': next_page}
     return render(request, "auctions/index.html", context)
 
 
+# ==========================
+# 📤 LISTINGS API
+# ==========================
+def listings_api(request):
+    """
+    Return a page of active listings as JSON, with the same query
+    string as the index page plus category.
+    """
+    listings, next_page = listing_search(request, request.GET.get('category'))
+    data = [{
+        'id': listing.id,
+        'title': listing.title,
+        'category': listing.category,
+        'price': listing.price,
+        'bids': listing.bid_count,
+        'ends_at': listing.ends_at,
+        'url': reverse('listing', args=[listing.id]),
+    } for listing in listings]
+    return JsonResponse({'listings': data, 'next': next_page and f"?{next_page}"})
+
+
 # ==========================
 # ⚠️ NOT FOUND PAGE
 # ==========================
@@ -130,6 +182,7 @@ def new_listing(request):
                 img=form.cleaned_data['img'],
                 category=form.cleaned_data['category'],
                 start_bid=form.cleaned_data['start_bid'],
+                ends_at=form.ends_at(),
             )
             new.save()
 
@@ -181,53 +234,32 @@ def listing(request, list_id):
 
             # 💰 Place a new bid
             elif 'bid' in request.POST:
-                bid_amount = request.POST.get('bid_amount')
+                bid_amount = parse_amount(request.POST.get('bid_amount'))
 
-                if not bid_amount:
+                if bid_amount is None:
                     messages.error(request, 'Enter a valid bid amount.')
                     return redirect('listing', list_id=list_id)
 
-                listing = Listing.objects.get(pk=list_id)
-
-                # Get highest bid so far
-                highest_amount = listing.bids.aggregate(Max('amount'))['amount__max']
-
-                # Validate the bid
-                if highest_amount:
-                    if int(highest_amount) >= int(bid_amount):
-                        messages.error(request, 'Bid must be higher than current bid.')
-                        return redirect('listing', list_id=list_id)
-                else:
-                    if int(listing.start_bid) > int(bid_amount):
-                        messages.error(request, 'Bid must be at least the starting bid.')
-                        return redirect('listing', list_id=list_id)
+                # Validate and save the bid in one step, see bidding.place_bid
+                try:
+                    place_bid(list_id, user, bid_amount)
+                except BidRejected as rejection:
+                    messages.error(request, str(rejection))
+                    return redirect('listing', list_id=list_id)
 
-                # Save the new bid
-                Bid.objects.create(list_id=listing, user_id=user, amount=bid_amount)
                 messages.success(request, 'Bid placed successfully.')
                 return redirect('listing', list_id=list_id)
 
             # 🔒 Close the auction (owner only)
             elif 'close' in request.POST:
-                listing = Listing.objects.get(pk=list_id)
-                if user.id != listing.user.id:
+                listing = Listing.objects.filter(pk=list_id).only('user_id').first()
+                if listing is None or user.id != listing.user_id:
                     messages.error(request, 'Only the owner can close this listing.')
                     return redirect('listing', list_id=list_id)
 
-                # Remove from all watchlists
-                listing.watchlisted.all().delete()
-
-                # Determine winner
-                highest_amount_dict = listing.bids.aggregate(Max('amount'))
-                highest_amount = highest_amount_dict['amount__max']
-                if highest_amount:
-                    highest_bid = listing.bids.get(amount=highest_amount)
-                    listing.winner = highest_bid.user_id
-                else:
-                    listing.winner = None  # Safe fallback if no bids exist
-
-                listing.active_status = False
-                listing.save()
+                # The current bidder wins, and the listing leaves all
+                # watchlists, in one UPDATE and one DELETE
+                close_listings(Listing.objects.filter(pk=list_id, active_status=True))
 
                 messages.success(request, 'Listing closed successfully.')
                 return redirect('listing', list_id=list_id)
@@ -241,8 +273,11 @@ def listing(request, list_id):
                 return redirect('listing', list_id=list_id)
 
         # ======= GET REQUEST =======
+        # Events after this one are replayed to the page; those it already
+        # shows are ignored by listing_events.js
+        last_event = broker.position()
         try:
-            listing = Listing.objects.get(pk=list_id)
+            listing = Listing.objects.select_related('user', 'current_bidder').get(pk=list_id)
         except Listing.DoesNotExist:
             return redirect('not_found')
 
@@ -252,13 +287,11 @@ def listing(request, list_id):
         # Get readable category name
         listing.category = listing.get_category_display()
 
-        # Get current highest bid
-        highest_amount = listing.bids.aggregate(Max('amount'))['amount__max']
-        if highest_amount:
-            listing.bid = listing.bids.get(amount=highest_amount)
+        # Listings past their end are closed by close_auctions, not the owner
+        ended = listing.ends_at is not None and listing.ends_at <= timezone.now()
 
         # Get total number of bids and comments
-        count = listing.bids.count()
+        count = listing.bid_count
         comments = listing.list_comments.all()
 
         context = {
@@ -267,11 +300,25 @@ def listing(request, list_id):
             'user': user,
             'comments': comments,
             'watchlisted': watchlisted,
+            'last_event': last_event,
+            'ended': ended,
         }
 
         return render(request, "auctions/listing.html", context)
 
 
+# ==========================
+# 🔴 LISTING EVENTS
+# ==========================
+def listing_events(request, list_id):
+    """
+    Event streams are served by the ASGI app in commerce/asgi.py.
+    Without it there are none, and 204 tells the page's EventSource
+    to stop reconnecting.
+    """
+    return HttpResponse(status=204)
+
+
 # ==========================
 # 👁 USER WATCHLIST
 # ==========================
@@ -281,14 +328,8 @@ def watchlist(request):
     Display all listings currently in the user's watchlist.
     """
     user = request.user
-    listings = user.watchlist.all()
-
-    # Attach highest bid for each listing in watchlist
-    for item in listings:
-        highest_amount_dict = item.list_id.bids.aggregate(Max('amount'))
-        highest_amount = highest_amount_dict['amount__max']
-        if highest_amount:
-            item.list_id.bid = item.list_id.bids.get(amount=highest_amount)
+    # The listings come in the same query, with their highest bid
+    listings = user.watchlist.select_related('list_id')
 
     context = {'listings': listings}
     return render(request, "auctions/watchlist.html", context)
@@ -309,14 +350,15 @@ def category(request):
 # ==========================
 def category_type(request, cat):
     """
-    Display all active listings belonging to a specific category.
+    Display a page of active listings belonging to a specific category.
     """
-    listings = Listing.objects.filter(category=cat, active_status=True)
+    listings, next_page = listing_search(request, cat)
     category_name = [c[1] for c in Listing.category.field.choices if c[0] == cat][0]
 
     context = {
         'listings': listings,
-        'category': category_name
+        'category': category_name,
+        'next_page': next_page,
     }
     return render(request, "auctions/category_listing.html", context)
 
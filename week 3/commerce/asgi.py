@@ -13,4 +13,10 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'commerce.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported once Django is set up, it needs the models
+from auctions.streaming import EventStreamApp  # noqa: E402
+
+# live listing events are streamed outside of Django's request handling
+application = EventStreamApp(django_application)